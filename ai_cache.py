@@ -0,0 +1,118 @@
+"""
+Кэш ответов AI для генерации квестов
+Ключ — нормализованная цель пользователя (регистр, пробелы и пунктуация не различаются).
+Два уровня: LRU в памяти и таблица ai_cache в SQLite; записи живут AI_CACHE_TTL_HOURS
+и вытесняются по размеру
+"""
+
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import config
+from database_async import db
+from metrics import metrics
+
+AI_CACHE_HITS = metrics.counter("ai_cache_hits_total", "Попадания в кэш ответов AI")
+AI_CACHE_MISSES = metrics.counter("ai_cache_misses_total", "Промахи кэша ответов AI")
+AI_CACHE_SAVED = metrics.counter("ai_cache_saved_seconds_total", "Сэкономленное время генерации AI (по исходной задержке ответа)")
+
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+# Как часто чистить таблицу кэша от просроченных и лишних записей (каждые N записей)
+PRUNE_EVERY = 50
+
+
+def normalize_goal(text: str) -> str:
+    """«Хочу  ПОХУДЕТЬ!» и «хочу похудеть» дают один ключ"""
+    text = (text or "").lower().replace("ё", "е")
+    text = _PUNCT_RE.sub(" ", text).replace("_", " ")
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+class AIResponseCache:
+    """Двухуровневый кэш: LRU в памяти поверх таблицы SQLite"""
+
+    def __init__(
+        self,
+        database=None,
+        memory_size: Optional[int] = None,
+        db_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        clock=time.time,
+    ):
+        """
+        Args:
+            database: База данных (по умолчанию глобальная db)
+            memory_size: Записей в памяти (по умолчанию config.AI_CACHE_MEMORY_SIZE)
+            db_size: Записей в SQLite (по умолчанию config.AI_CACHE_DB_SIZE)
+            ttl: Время жизни записи, с (по умолчанию config.AI_CACHE_TTL_HOURS)
+            clock: Источник времени (для тестов)
+        """
+        self.database = database or db
+        self.memory_size = memory_size or config.AI_CACHE_MEMORY_SIZE
+        self.db_size = db_size or config.AI_CACHE_DB_SIZE
+        self.ttl = ttl or config.AI_CACHE_TTL_HOURS * 3600
+        self.clock = clock
+        # key -> (expires_at, value, latency)
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {"hits_memory": 0, "hits_db": 0, "misses": 0, "saved_seconds": 0.0}
+        self._puts = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Ответ из кэша или None"""
+        now = self.clock()
+        entry = self.memory.get(key)
+        if entry and entry[0] <= now:
+            del self.memory[key]
+            entry = None
+        if entry:
+            self.memory.move_to_end(key)
+            self.stats["hits_memory"] += 1
+        else:
+            try:
+                entry = await self.database.get_ai_cache(key, now)
+            except Exception:
+                entry = None
+            if not entry:
+                self.stats["misses"] += 1
+                AI_CACHE_MISSES.inc()
+                return None
+            self._remember(key, entry)
+            self.stats["hits_db"] += 1
+        _, value, latency = entry
+        self.stats["saved_seconds"] += latency
+        AI_CACHE_HITS.inc()
+        AI_CACHE_SAVED.inc(latency)
+        return value
+
+    async def put(self, key: str, value: Dict[str, Any], latency: float) -> None:
+        """Сохранить ответ; latency — сколько заняла генерация (для учёта сэкономленного времени)"""
+        now = self.clock()
+        entry = (now + self.ttl, value, latency)
+        self._remember(key, entry)
+        try:
+            await self.database.put_ai_cache(key, value, now, entry[0], latency)
+            self._puts += 1
+            if self._puts % PRUNE_EVERY == 0:
+                await self.database.prune_ai_cache(now, self.db_size)
+        except Exception:
+            pass
+
+    def _remember(self, key: str, entry: tuple) -> None:
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def report(self) -> Dict[str, Any]:
+        """Доля попаданий и сэкономленное время"""
+        hits = self.stats["hits_memory"] + self.stats["hits_db"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "saved_seconds": round(self.stats["saved_seconds"], 1),
+            "hit_ratio": round(hits / total, 3) if total else 0.0,
+            "memory_entries": len(self.memory),
+        }
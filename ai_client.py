@@ -4,10 +4,87 @@
 """
 
 import aiohttp
+import asyncio
 import json
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, Awaitable, Callable, List
 from loguru import logger
+from ai_cache import AIResponseCache, normalize_goal
 from config import config
+from metrics import metrics
+from resilience import CircuitBreaker, ConcurrencyLimiter, Overloaded, UserQuota
+
+AI_CONNECTIONS_NEW = metrics.counter("ai_connections_new_total", "Новые TCP/TLS-соединения с AI API")
+AI_CONNECTIONS_REUSED = metrics.counter("ai_connections_reused_total", "Запросы к AI API через уже открытое соединение")
+AI_DNS_CACHE_HITS = metrics.counter("ai_dns_cache_hits_total", "Попадания в DNS-кэш коннектора AI")
+AI_COALESCED = metrics.counter("ai_coalesced_requests_total", "Вызовы AI, присоединённые к уже выполняющемуся запросу")
+AI_COOLDOWN_REJECTS = metrics.counter("ai_cooldown_rejects_total", "Вызовы AI, отклонённые в окне после общей неудачи")
+AI_BUDGET_EXCEEDED = metrics.counter("ai_budget_exceeded_total", "Генерации AI, не уложившиеся в бюджет ожидания (ответ дописывается в кэш в фоне)")
+AI_TIME_TO_FIRST_CONTENT = metrics.histogram(
+    "ai_time_to_first_content_seconds",
+    "Время от запроса до первого поля квеста при потоковой генерации",
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 20, 30),
+)
+
+# Получатель промежуточных полей квеста при потоковой генерации
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# С какого числа окон охлаждения начинать удаление истёкших
+FAILED_PRUNE_MIN = 256
+
+
+def parse_partial_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Разбор недописанного JSON-объекта: незакрытые строки, массивы и объекты закрываются,
+    недописанная пара «ключ: значение» отбрасывается
+    
+    '{"title": "Бег по утр' → {"title": "Бег по утр"}
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    stack: List[str] = []
+    # Позиции запятых вне строк и состояние стека скобок на момент каждой
+    cuts: List[tuple] = []
+    in_str = escaped = False
+    for i, ch in enumerate(text):
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                text = text[:i + 1]
+                break
+        elif ch == ",":
+            cuts.append((i, list(stack)))
+    candidates = []
+    if stack:
+        tail = text[:-1] if escaped else text
+        candidates.append((tail + ('"' if in_str else "")) + "".join(reversed(stack)))
+        for pos, st in reversed(cuts):
+            candidates.append(text[:pos] + "".join(reversed(st)))
+        candidates.append("{}")
+    else:
+        candidates.append(text)
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        return value if isinstance(value, dict) else None
+    return None
 
 
 class WindsurfAIClient:
@@ -18,13 +95,93 @@ class WindsurfAIClient:
         self.api_url = config.WINDSURF_API_URL
         self.api_key = config.WINDSURF_API_KEY
         self.timeout = aiohttp.ClientTimeout(total=30)
+        # Общая сессия с пулом соединений (keep-alive, DNS-кэш): открывается при старте бота
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.stats = {"new_connections": 0, "reused_connections": 0, "dns_cache_hits": 0}
+        # Кэш сгенерированных квестов по нормализованной цели
+        self.cache = AIResponseCache()
+        # Выполняющиеся запросы и окна охлаждения после неудач по ключу запроса
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._failed_until: Dict[str, float] = {}
+        # Размер, при котором из _failed_until удаляются истёкшие окна
+        self._failed_prune_at = FAILED_PRUNE_MIN
+        # Генерации, дописывающиеся в кэш после истечения бюджета ожидания
+        self._background: set = set()
+        # Защита AI API при сбоях: лимит одновременных запросов с очередью, автомат отключения
+        # по доле ошибок и медленных ответов, квота запросов на пользователя
+        self.limiter = ConcurrencyLimiter(
+            "ai",
+            max_inflight=config.AI_MAX_CONCURRENCY,
+            max_queue=config.AI_MAX_QUEUE,
+            queue_timeout=config.AI_QUEUE_TIMEOUT_SECONDS,
+        )
+        self.breaker = CircuitBreaker(
+            "ai",
+            window=config.AI_BREAKER_WINDOW,
+            min_calls=config.AI_BREAKER_MIN_CALLS,
+            failure_rate=config.AI_BREAKER_FAILURE_RATE,
+            slow_call_seconds=config.AI_BREAKER_SLOW_SECONDS,
+            open_seconds=config.AI_BREAKER_OPEN_SECONDS,
+        )
+        self.quota = UserQuota("ai", per_minute=config.AI_USER_REQUESTS_PER_MINUTE, burst=config.AI_USER_BURST)
+
+    async def start(self) -> None:
+        """Открыть общую сессию с настроенным пулом соединений"""
+        if self.session and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=config.AI_POOL_LIMIT,
+            keepalive_timeout=config.AI_KEEPALIVE_SECONDS,
+            ttl_dns_cache=config.AI_DNS_CACHE_SECONDS,
+        )
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_new)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+        trace.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        self.session = aiohttp.ClientSession(timeout=self.timeout, connector=connector, trace_configs=[trace])
+        logger.info(f"🤖 AI-сессия открыта (пул {config.AI_POOL_LIMIT}, keep-alive {config.AI_KEEPALIVE_SECONDS} с)")
+
+    async def close(self) -> None:
+        """Закрыть общую сессию"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info(f"🤖 AI-сессия закрыта, соединения: {self.stats}, кэш: {self.cache.report()}")
+        self.session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Общая сессия; открывается при первом запросе, если бот не открыл её при старте"""
+        if self.session is None or self.session.closed:
+            await self.start()
+        return self.session
+
+    async def _on_connection_new(self, session, ctx, params) -> None:
+        self.stats["new_connections"] += 1
+        AI_CONNECTIONS_NEW.inc()
+
+    async def _on_connection_reused(self, session, ctx, params) -> None:
+        self.stats["reused_connections"] += 1
+        AI_CONNECTIONS_REUSED.inc()
+
+    async def _on_dns_cache_hit(self, session, ctx, params) -> None:
+        self.stats["dns_cache_hits"] += 1
+        AI_DNS_CACHE_HITS.inc()
     
-    async def generate_quest(self, user_goal: str) -> Optional[Dict[str, Any]]:
+    async def generate_quest(
+        self,
+        user_goal: str,
+        on_progress: Optional[ProgressCallback] = None,
+        user_id: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Генерация квеста на основе цели пользователя через Windsurf AI
+        Одинаковые по смыслу цели (регистр, пробелы, пунктуация) отдаются из кэша
         
         Args:
             user_goal: Цель пользователя (например, "Хочу похудеть на 5 кг")
+            on_progress: Вызывается с уже полученными полями квеста по мере потоковой генерации
+                (только для вызова, который действительно выполняет запрос)
+            user_id: Пользователь, с квоты которого списывается запрос к AI API
+                (ответ из кэша и ожидание общего запроса квоту не расходуют)
             
         Returns:
             Optional[Dict[str, Any]]: Словарь с данными квеста или None при ошибке
@@ -40,6 +197,168 @@ class WindsurfAIClient:
             logger.warning("⚠️ API ключ Windsurf AI не установлен")
             return None
         
+        key = normalize_goal(user_goal)
+        if not key:
+            if not self._charge(user_id, None):
+                return None
+            return await self._request_quest(user_goal, on_progress)
+        cached = await self.cache.get(key)
+        if cached:
+            logger.info(f"💾 Квест из кэша AI: {cached.get('title', 'Без названия')}")
+            return cached
+        flight = f"quest:{key}"
+        if not self._charge(user_id, flight):
+            return None
+        return await self._single_flight(flight, lambda: self._generate_and_cache(user_goal, key, on_progress))
+    
+    async def generate_quest_within(
+        self,
+        user_goal: str,
+        budget: float,
+        on_progress: Optional[ProgressCallback] = None,
+        user_id: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        generate_quest с бюджетом ожидания
+        
+        Если ответ не начал поступать за budget секунд (или потоковая генерация
+        замолчала на budget секунд), возвращает None, а запрос продолжается в фоне:
+        удачный ответ попадёт в кэш и достанется следующему такому же запросу.
+        Пока поля квеста поступают по потоку (on_progress), ожидание продлевается.
+        budget <= 0 — ждать без ограничения.
+        """
+        loop = asyncio.get_running_loop()
+        last_progress = loop.time()
+        progress = on_progress
+        if on_progress is not None:
+            async def progress(fields: Dict[str, Any]) -> None:
+                nonlocal last_progress
+                last_progress = loop.time()
+                await on_progress(fields)
+        task = asyncio.ensure_future(self.generate_quest(user_goal, progress, user_id))
+        if budget <= 0:
+            return await task
+        while not task.done():
+            remaining = last_progress + budget - loop.time()
+            if remaining <= 0:
+                AI_BUDGET_EXCEEDED.inc()
+                logger.info(f"⏱ AI не ответил за {budget:g} с, запрос продолжается в фоне: {user_goal[:50]}")
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                return None
+            await asyncio.wait((task,), timeout=remaining)
+        return task.result()
+    
+    async def _generate_and_cache(
+        self,
+        user_goal: str,
+        key: str,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Запрос к AI и сохранение удачного ответа в кэш"""
+        started = time.perf_counter()
+        quest_data = await self._request_quest(user_goal, on_progress)
+        if quest_data:
+            await self.cache.put(key, quest_data, time.perf_counter() - started)
+        return quest_data
+    
+    async def _single_flight(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Один запрос к AI на одинаковые одновременные вызовы
+        
+        Параллельные вызовы с тем же ключом ждут один общий запрос. Неудача (None)
+        тоже общая: ещё AI_FAILURE_COOLDOWN_SECONDS вызовы с этим ключом сразу получают None,
+        не нагружая AI API. Запрос выполняется отдельной задачей, поэтому отмена
+        одного из ожидающих не отменяет его для остальных.
+        """
+        failed_until = self._failed_until.get(key)
+        if failed_until:
+            if time.monotonic() < failed_until:
+                AI_COOLDOWN_REJECTS.inc()
+                return None
+            del self._failed_until[key]
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_flight(key, t))
+        else:
+            AI_COALESCED.inc()
+        return await asyncio.shield(task)
+    
+    def _finish_flight(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            now = time.monotonic()
+            # Окна охлаждения неповторившихся запросов иначе копились бы без предела
+            if len(self._failed_until) >= self._failed_prune_at:
+                self._failed_until = {k: until for k, until in self._failed_until.items() if until > now}
+                self._failed_prune_at = max(FAILED_PRUNE_MIN, 2 * len(self._failed_until))
+            self._failed_until[key] = now + config.AI_FAILURE_COOLDOWN_SECONDS
+    
+    async def _guarded(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Запрос к AI API через автомат отключения и ограничитель одновременных запросов
+        
+        Пока автомат разомкнут или очередь ожидания заполнена, возвращает None сразу,
+        не дожидаясь таймаута. Результат None или ответ дольше AI_BREAKER_SLOW_SECONDS
+        считаются неудачей автомата.
+        """
+        if not self.breaker.allow():
+            logger.debug(f"AI circuit open, retry after {self.breaker.retry_after():.0f}s")
+            return None
+        try:
+            async with self.limiter:
+                started = time.monotonic()
+                result = await factory()
+        except Overloaded as e:
+            self.breaker.release()
+            logger.warning(f"⚠️ Запрос к AI отклонён: {e}")
+            return None
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(False, 0.0)
+            raise
+        self.breaker.record(result is not None, time.monotonic() - started)
+        return result
+    
+    def retry_after(self) -> float:
+        """
+        Проверка перед запросом пользователя: состояние автомата отключения
+        Квота пользователя списывается в generate_quest(user_id=...) — только за запрос к AI API
+        
+        Returns:
+            float: 0 — запрос можно выполнять, иначе через сколько секунд повторить
+        """
+        return self.breaker.retry_after()
+    
+    def _charge(self, user_id: Optional[int], flight: Optional[str]) -> bool:
+        """Списать квоту пользователя, если вызов выполнит новый запрос к AI API; False — квота исчерпана"""
+        if user_id is None:
+            return True
+        if flight is not None:
+            # Присоединение к выполняющемуся запросу или отказ в окне охлаждения — без запроса к API
+            failed_until = self._failed_until.get(flight)
+            if flight in self._inflight or (failed_until and time.monotonic() < failed_until):
+                return True
+        return not self.quota.acquire(user_id)
+    
+    async def _request_quest(
+        self,
+        user_goal: str,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Запрос генерации квеста к Windsurf AI (без кэша) с защитой от перегрузки"""
+        return await self._guarded(lambda: self._post_quest(user_goal, on_progress))
+    
+    async def _post_quest(
+        self,
+        user_goal: str,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Запрос генерации квеста к Windsurf AI; с on_progress — потоковый (SSE)"""
         # Формируем промт для AI
         prompt = f"""
 Ты — эксперт по постановке целей и созданию мотивирующих квестов.
@@ -77,26 +396,33 @@ class WindsurfAIClient:
                 "temperature": 0.7,
                 "max_tokens": 500
             }
+            stream = on_progress is not None and config.AI_STREAM
+            if stream:
+                payload["stream"] = True
             
             logger.info(f"🤖 Отправка запроса к Windsurf AI: {user_goal[:50]}...")
             
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(self.api_url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
+            session = await self._get_session()
+            async with session.post(self.api_url, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    if stream and response.content_type == "text/event-stream":
+                        ai_response = await self._read_stream(response, on_progress)
+                    else:
+                        # Сервер без поддержки потоковой передачи отвечает обычным JSON
+                        data = await response.json(content_type=None)
                         
                         # Извлекаем ответ AI
                         ai_response = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                        
-                        # Парсим JSON из ответа
-                        quest_data = json.loads(ai_response)
-                        
-                        logger.info(f"✅ Квест сгенерирован AI: {quest_data.get('title', 'Без названия')}")
-                        return quest_data
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Ошибка API Windsurf AI ({response.status}): {error_text}")
-                        return None
+                    
+                    # Парсим JSON из ответа
+                    quest_data = json.loads(ai_response)
+                    
+                    logger.info(f"✅ Квест сгенерирован AI: {quest_data.get('title', 'Без названия')}")
+                    return quest_data
+                else:
+                    error_text = await response.text()
+                    logger.error(f"❌ Ошибка API Windsurf AI ({response.status}): {error_text}")
+                    return None
         
         except json.JSONDecodeError as e:
             logger.error(f"❌ Ошибка парсинга JSON от AI: {e}")
@@ -108,6 +434,48 @@ class WindsurfAIClient:
             logger.error(f"❌ Неожиданная ошибка при работе с AI: {e}")
             return None
     
+    async def _read_stream(self, response: aiohttp.ClientResponse, on_progress: ProgressCallback) -> str:
+        """
+        Чтение ответа в формате SSE (data: {...} построчно, завершение data: [DONE])
+        
+        По мере поступления текста JSON разбирается частично, и on_progress получает
+        уже известные поля (title, description, tips — в том числе недописанные).
+        
+        Returns:
+            str: Полный текст ответа AI
+        """
+        started = time.perf_counter()
+        parts: List[str] = []
+        last_fields: Dict[str, Any] = {}
+        first_content = False
+        async for raw in response.content:
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                choice = json.loads(data).get("choices", [{}])[0]
+            except (ValueError, AttributeError, IndexError):
+                continue
+            delta = (choice.get("delta") or choice.get("message") or {}).get("content")
+            if not delta:
+                continue
+            parts.append(delta)
+            fields = parse_partial_json("".join(parts))
+            if not fields or fields == last_fields:
+                continue
+            last_fields = fields
+            if not first_content and fields.get("title"):
+                first_content = True
+                AI_TIME_TO_FIRST_CONTENT.observe(time.perf_counter() - started)
+            try:
+                await on_progress(fields)
+            except Exception as e:
+                logger.warning(f"AI stream progress callback error: {e}")
+        return "".join(parts)
+    
     async def get_motivation(self, quest_title: str, progress: int, target: int) -> Optional[str]:
         """
         Получение мотивационного сообщения от AI на основе прогресса квеста
@@ -149,14 +517,7 @@ class WindsurfAIClient:
                 "max_tokens": 100
             }
             
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(self.api_url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        motivation = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                        return motivation.strip()
-                    else:
-                        return None
+            return await self._guarded(lambda: self._post_text(headers, payload))
         
         except Exception as e:
             logger.error(f"❌ Ошибка получения мотивации от AI: {e}")
@@ -202,19 +563,24 @@ class WindsurfAIClient:
                 "max_tokens": 300
             }
             
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(self.api_url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        analysis = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                        return analysis.strip()
-                    else:
-                        return None
+            return await self._guarded(lambda: self._post_text(headers, payload))
         
         except Exception as e:
             logger.error(f"❌ Ошибка анализа цели AI: {e}")
             return None
 
+    
+    async def _post_text(self, headers: Dict[str, str], payload: Dict[str, Any]) -> Optional[str]:
+        """Запрос к AI API с текстовым ответом"""
+        session = await self._get_session()
+        async with session.post(self.api_url, headers=headers, json=payload) as response:
+            if response.status == 200:
+                data = await response.json()
+                text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+                return text.strip()
+            else:
+                return None
+
 
 # Создаем глобальный экземпляр клиента
 ai_client = WindsurfAIClient()
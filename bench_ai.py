@@ -0,0 +1,187 @@
+"""
+Нагрузочный тест AI-клиента на локальном mock Windsurf
+Поднимает mock_windsurf в том же процессе (или использует --url) и вызывает
+generate_quest / get_motivation с заданной конкурентностью или частотой.
+Печатает пропускную способность, p50/p95/p99 задержки по операциям, исходы
+(ответ / None / исключение), статистику сервера и метрики клиента: соединения,
+кэш, объединённые запросы, отказы ограничителя и автомата отключения.
+
+Пример:
+    python bench_ai.py --requests 2000 --concurrency 100 --goals 200 --error-rate 0.05 --malformed-rate 0.02
+    python bench_ai.py --rate 50 --requests 1000 --tail-rate 0.1 --tail-ms 20000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import mock_windsurf
+from ai_cache import AIResponseCache
+from ai_client import WindsurfAIClient
+from database_async import Database
+from metrics import metrics
+
+GOALS = (
+    "Хочу похудеть на {n} кг",
+    "Прочитать {n} книг",
+    "Научиться программировать на Python",
+    "Выучить {n} английских слов",
+    "Бросить курить",
+    "Медитировать каждый день",
+    "Пробежать {n} км",
+    "Накопить денег на отпуск",
+)
+
+
+class NullCache:
+    """Кэш, который ничего не хранит (--no-cache)"""
+
+    async def get(self, key):
+        return None
+
+    async def put(self, key, value, latency):
+        pass
+
+    def report(self) -> Dict[str, Any]:
+        return {}
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _ai_metrics() -> Dict[str, float]:
+    """Счётчики и гейджи клиента AI"""
+    return {k: v for k, v in metrics.snapshot().items() if k.startswith("ai_") and not isinstance(v, dict)}
+
+
+async def call(client: WindsurfAIClient, op: str, goal: str, stream: bool, results: Dict[str, list]) -> None:
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        if op == "quest":
+            progress = _noop_progress if stream else None
+            value = await client.generate_quest(goal, on_progress=progress)
+        else:
+            value = await client.get_motivation(goal, 3, 10)
+        if not value:
+            outcome = "none"
+    except Exception as e:
+        outcome = f"exception:{type(e).__name__}"
+    results.setdefault(op, []).append((time.perf_counter() - started, outcome))
+
+
+async def _noop_progress(fields) -> None:
+    pass
+
+
+async def main_async(args) -> None:
+    mock = None
+    url = args.url
+    if not url:
+        mock = mock_windsurf.from_args(args)
+        url = await mock.start()
+
+    client = WindsurfAIClient()
+    client.api_url = url
+    client.api_key = client.api_key or "mock"
+    if args.cache:
+        database = Database(os.path.join(args.dir, "bench_ai.db"))
+        await database.init_db()
+        client.cache = AIResponseCache(database=database)
+    else:
+        client.cache = NullCache()
+    await client.start()
+
+    rnd = random.Random(args.seed)
+    goals = [rnd.choice(GOALS).format(n=i + 1) for i in range(args.goals)]
+    plan = [
+        ("motivation" if rnd.random() < args.motivation_share else "quest", rnd.choice(goals))
+        for _ in range(args.requests)
+    ]
+    results: Dict[str, list] = {}
+    before = _ai_metrics()
+
+    started = time.perf_counter()
+    if args.rate:
+        # Открытая модель: запросы приходят с заданной частотой независимо от ответов
+        tasks = []
+        for i, (op, goal) in enumerate(plan):
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(call(client, op, goal, args.client_stream, results)))
+        await asyncio.gather(*tasks)
+    else:
+        # Закрытая модель: concurrency пользователей, каждый ждёт ответа перед следующим запросом
+        queue = iter(plan)
+
+        async def worker():
+            for op, goal in queue:
+                await call(client, op, goal, args.client_stream, results)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - started
+
+    after = _ai_metrics()
+    connections = dict(client.stats)
+    cache = client.cache.report()
+    await client.close()
+    server = dict(mock.stats) if mock else {}
+    if mock:
+        await mock.stop()
+
+    load = f"частота {args.rate}/с" if args.rate else f"конкурентность {args.concurrency}"
+    print(f"Запросов: {args.requests}, {load}, целей: {args.goals}, кэш: {'да' if args.cache else 'нет'}, поток: {'да' if args.client_stream else 'нет'}")
+    print(f"Время: {wall:.2f} с, пропускная способность: {args.requests / wall:.1f} запросов/с")
+    print(f"{'операция':<12}{'всего':>7}{'ответ':>7}{'None':>7}{'искл.':>7}{'p50,мс':>9}{'p95,мс':>9}{'p99,мс':>9}{'max,мс':>9}")
+    for op, items in sorted(results.items()):
+        latencies = [d for d, _ in items]
+        ok = sum(1 for _, o in items if o == "ok")
+        none = sum(1 for _, o in items if o == "none")
+        print(
+            f"{op:<12}{len(items):>7}{ok:>7}{none:>7}{len(items) - ok - none:>7}"
+            f"{_pct(latencies, 0.5) * 1000:>9.1f}{_pct(latencies, 0.95) * 1000:>9.1f}"
+            f"{_pct(latencies, 0.99) * 1000:>9.1f}{max(latencies) * 1000:>9.1f}"
+        )
+    exceptions = sorted({o for items in results.values() for _, o in items if o.startswith("exception")})
+    if exceptions:
+        print(f"Исключения из клиента: {', '.join(exceptions)}")
+    if server:
+        print(f"Сервер: {server}")
+    print(f"Соединения: {connections}")
+    if cache:
+        print(f"Кэш: {cache}")
+    print("Метрики клиента (прирост за прогон):")
+    for name, value in after.items():
+        delta = value - before.get(name, 0.0) if name.endswith("_total") else value
+        if delta:
+            print(f"  {name}: {delta:g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест AI-клиента на локальном mock Windsurf")
+    parser.add_argument("--url", help="эндпоинт chat-completions (по умолчанию встроенный mock)")
+    parser.add_argument("--requests", type=int, default=500, help="всего вызовов")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных пользователей (закрытая модель)")
+    parser.add_argument("--rate", type=float, default=0.0, help="вызовов в секунду (открытая модель; 0 — закрытая)")
+    parser.add_argument("--goals", type=int, default=100, help="различных целей (меньше — больше попаданий в кэш)")
+    parser.add_argument("--motivation-share", type=float, default=0.2, help="доля вызовов get_motivation")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="без кэша ответов")
+    parser.add_argument("--client-stream", action="store_true", help="генерация квестов с on_progress (потоковый режим)")
+    parser.add_argument("--dir", default=None, help="каталог для базы кэша (по умолчанию временный)")
+    mock_windsurf.add_arguments(parser)
+    args = parser.parse_args()
+    args.dir = args.dir or tempfile.mkdtemp(prefix="bench_ai_")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
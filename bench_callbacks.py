@@ -0,0 +1,179 @@
+"""
+Бенчмарк маршрутизации callback-запросов
+Сравнивает стоимость выбора обработчика для одного callback-запроса:
+прежняя цепочка фильтров F.data.startswith(...)/regexp (aiogram проверяет их по порядку
+регистрации до первого совпадения) и разбор callback_data с поиском в таблице действий
+CallbackRouter. Оба варианта проходят через TelegramEventObserver.trigger aiogram,
+обработчики — пустые, так что замеряется только маршрутизация.
+
+Пример:
+    python bench_callbacks.py --rounds 2000
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from aiogram import F, Router
+from aiogram.types import CallbackQuery, User
+
+from callbacks import CODES, DAILY_PRESETS, QUEST_TYPES, pack, unpack
+from handlers import callback_router
+
+# Фильтры callback_query в порядке регистрации до перехода на CallbackRouter
+OLD_FILTERS = [
+    F.data.startswith("quest_"),
+    F.data.startswith("daily_days_toggle_"),
+    F.data.startswith("daily_days_preset_"),
+    F.data == "daily_days_next",
+    F.data.startswith("daily_time_"),
+    F.data.startswith("daily_done_"),
+    F.data.startswith("daily_undo_"),
+    F.data.startswith("complete_"),
+    F.data.startswith("delete_"),
+    F.data.regexp(r"^edit_\d+$"),
+    F.data.startswith("edit_title_"),
+    F.data.startswith("edit_target_"),
+    F.data.startswith("edit_deadline_"),
+    F.data.startswith("edit_type_menu_"),
+    F.data.startswith("edit_type_"),
+    F.data.startswith("edit_comment_"),
+    F.data == "back_to_menu",
+    F.data == "main_menu",
+    F.data == "create_quest_inline",
+    F.data == "mode_regular",
+    F.data == "mode_daily",
+    F.data == "stats",
+    F.data == "help",
+    F.data == "cancel",
+    F.data.startswith("meditate_"),
+    F.data == "lists_menu",
+    F.data == "my_lists",
+    F.data == "list_templates",
+    F.data == "create_list_inline",
+    F.data.startswith("list_"),
+    F.data.startswith("add_item_"),
+    F.data.startswith("toggle_item_"),
+    F.data.startswith("del_item_"),
+    F.data.startswith("delete_list_"),
+    F.data.startswith("share_list_"),
+    F.data.startswith("copy_list_"),
+    F.data.startswith("cancel_meditation_"),
+    F.data == "tz_setup_now",
+    F.data == "tz_setup_skip",
+    F.data == "my_quests_inline",
+    F.data.in_(["custom_progress_yes", "custom_progress_no"]),
+    F.data == "skip_comment",
+    F.data == "deadline_today",
+    F.data == "deadline_time_skip",
+    F.data == "deadline_skip_all",
+]
+
+
+def legacy_data(action: str, args: Tuple[int, ...]) -> str:
+    """callback_data того же нажатия в прежнем формате"""
+    if action == "daily_days_preset":
+        return f"daily_days_preset_{DAILY_PRESETS[args[0]]}"
+    if action == "daily_time":
+        return f"daily_time_{args[0] // 60:02d}:{args[0] % 60:02d}"
+    if action == "edit_type":
+        return f"edit_type_{QUEST_TYPES[args[0]]}_{args[1]}"
+    if action == "custom_progress":
+        return "custom_progress_yes" if args[0] else "custom_progress_no"
+    return "_".join([action, *map(str, args)])
+
+
+def samples() -> List[Tuple[str, str, str]]:
+    """(действие, старый callback_data, новый callback_data) для каждого обработчика"""
+    out = []
+    for code, (_, _, arity) in callback_router.handlers.items():
+        action = CODES[code]
+        args = tuple([1] * arity) if action in ("daily_days_preset", "custom_progress", "edit_type") else tuple(range(95, 95 + arity))
+        if action == "daily_time":
+            args = (9 * 60,)
+        old, new = legacy_data(action, args), pack(action, *args)
+        # Старый формат разбирается в то же действие с теми же аргументами
+        assert unpack(old) == unpack(new) == (code, args), (old, new)
+        out.append((action, old, new))
+    return out
+
+
+def callback(data: str) -> CallbackQuery:
+    return CallbackQuery(id="1", from_user=User(id=1, is_bot=False, first_name="bench"), chat_instance="1", data=data)
+
+
+async def _handled(callback: CallbackQuery, *args) -> None:
+    pass
+
+
+def old_router() -> Router:
+    router = Router()
+    for flt in OLD_FILTERS:
+        router.callback_query.register(_handled, flt)
+    return router
+
+
+def new_router() -> Router:
+    router = Router()
+    router.callback_query.register(callback_router.dispatch)
+    return router
+
+
+async def measure(router: Router, events: List[CallbackQuery], rounds: int) -> float:
+    """Среднее время маршрутизации одного callback-запроса, мкс"""
+    observer = router.callback_query
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for event in events:
+            await observer.trigger(event, state=None)
+    return (time.perf_counter() - started) / (rounds * len(events)) * 1e6
+
+
+async def main_async(args) -> None:
+    cases = samples()
+    # Пустые обработчики вместо настоящих: та же таблица, без обращений к базе и Telegram
+    table = callback_router.handlers
+    saved = dict(table)
+    for code, (_, plan, arity) in saved.items():
+        table[code] = (_handled, plan, arity)
+    try:
+        old, new = old_router(), new_router()
+        old_events = [callback(o) for _, o, _ in cases]
+        new_events = [callback(n) for _, _, n in cases]
+        await measure(old, old_events, 10)
+        await measure(new, new_events, 10)
+        results: Dict[str, float] = {
+            "цепочка фильтров": await measure(old, old_events, args.rounds),
+            "таблица действий": await measure(new, new_events, args.rounds),
+            "таблица, старый формат": await measure(new, old_events, args.rounds),
+        }
+        per_action = []
+        if args.per_action:
+            for (action, o, n), old_event, new_event in zip(cases, old_events, new_events):
+                per_action.append((action, await measure(old, [old_event], args.rounds), await measure(new, [new_event], args.rounds)))
+    finally:
+        table.update(saved)
+
+    data_bytes = sum(len(o.encode()) for _, o, _ in cases), sum(len(n.encode()) for _, _, n in cases)
+    print(f"Действий: {len(cases)}, фильтров в старой цепочке: {len(OLD_FILTERS)}, повторов: {args.rounds}")
+    print(f"Средний размер callback_data: было {data_bytes[0] / len(cases):.1f} байт, стало {data_bytes[1] / len(cases):.1f} байт")
+    for name, value in results.items():
+        print(f"  {name:<24}{value:>8.2f} мкс/запрос")
+    print(f"Ускорение: ×{results['цепочка фильтров'] / results['таблица действий']:.1f}")
+    if per_action:
+        print(f"{'действие':<22}{'фильтры,мкс':>13}{'таблица,мкс':>13}")
+        for action, old_us, new_us in per_action:
+            print(f"{action:<22}{old_us:>13.2f}{new_us:>13.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутизации callback-запросов")
+    parser.add_argument("--rounds", type=int, default=1000, help="проходов по всем действиям")
+    parser.add_argument("--per-action", action="store_true", help="время по каждому действию")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
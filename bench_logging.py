@@ -0,0 +1,128 @@
+"""
+Бенчмарк логирования: влияние файлового sink на цикл событий
+Для каждого режима (синхронный файловый sink loguru, loguru enqueue, поток-писатель,
+поток-писатель + JSON) имитирует обработчики, которые пишут в лог, и параллельно
+измеряет задержку цикла событий.
+Печатает пропускную способность, время вызова logger.info и отставание цикла.
+
+Пример:
+    python bench_logging.py --lines 50000 --slow-write-ms 2
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from loguru import logger
+
+from logging_setup import FILE_FORMAT, RotatingFile, add_file_sink
+
+
+class SlowFile:
+    """Файловый sink с искусственной задержкой записи (медленный диск)"""
+
+    def __init__(self, path: str, delay: float):
+        self.file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+
+    def write(self, message: str) -> None:
+        time.sleep(self.delay)
+        self.file.write(message)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _ticker(lags: list, stop: asyncio.Event, period: float = 0.001) -> None:
+    """Замер отставания цикла событий: насколько позже положенного просыпается корутина"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(period)
+        lags.append(loop.time() - started - period)
+
+
+def add_sink(mode: str, path: str, args) -> int:
+    """Sink файла логов в режиме mode"""
+    max_bytes = int(args.rotation_mb * 1024 * 1024)
+    if mode in ("sync", "enqueue"):
+        # Прежняя схема: файловый sink loguru, запись в вызывающем потоке или через очередь loguru
+        sink = SlowFile(path, args.slow_write_ms / 1000) if args.slow_write_ms else path
+        options = {} if args.slow_write_ms else {"rotation": max_bytes, "retention": 3}
+        return logger.add(sink, level="INFO", format=FILE_FORMAT, enqueue=mode == "enqueue", **options)
+    target = SlowFile(path, args.slow_write_ms / 1000) if args.slow_write_ms else RotatingFile(path, max_bytes, 3)
+    return add_file_sink(target, json_logs=mode == "thread+json")
+
+
+async def run_mode(mode: str, args) -> dict:
+    path = os.path.join(args.dir, f"{mode.replace('+', '_')}.log")
+    logger.remove()
+    sink_id = add_sink(mode, path, args)
+
+    calls, lags = [], []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    started = time.perf_counter()
+    for i in range(args.lines):
+        t0 = time.perf_counter()
+        logger.info(f"update {i} handled: user_id={i % 1000} quest_id={i} status=ok")
+        calls.append(time.perf_counter() - t0)
+        # Обработчики уступают цикл событий между операциями
+        if i % args.batch == 0:
+            await asyncio.sleep(0)
+    handler_time = time.perf_counter() - started
+    stop.set()
+    await ticker
+    drain_started = time.perf_counter()
+    await logger.complete()
+    logger.remove(sink_id)
+    drain = time.perf_counter() - drain_started
+    return {
+        "mode": mode,
+        "rate": args.lines / handler_time,
+        "call_p50": _pct(calls, 0.5) * 1e6,
+        "call_p99": _pct(calls, 0.99) * 1e6,
+        "call_max": max(calls) * 1e6,
+        "lag_p99": _pct(lags, 0.99) * 1000,
+        "lag_max": max(lags or [0]) * 1000,
+        "drain": drain,
+    }
+
+
+async def main_async(args) -> None:
+    results = [await run_mode(mode, args) for mode in ("sync", "enqueue", "thread", "thread+json")]
+    print(f"Строк на режим: {args.lines}, ротация: {args.rotation_mb} МБ, задержка записи: {args.slow_write_ms} мс")
+    print(f"{'режим':<14}{'строк/с':>10}{'вызов p50,мкс':>15}{'p99,мкс':>10}{'max,мкс':>10}{'лаг цикла p99,мс':>18}{'max,мс':>9}{'дозапись,с':>12}")
+    for r in results:
+        print(
+            f"{r['mode']:<14}{r['rate']:>10.0f}{r['call_p50']:>15.1f}{r['call_p99']:>10.1f}{r['call_max']:>10.0f}"
+            f"{r['lag_p99']:>18.2f}{r['lag_max']:>9.1f}{r['drain']:>12.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк файлового логирования и задержки цикла событий")
+    parser.add_argument("--lines", type=int, default=20000, help="строк на режим")
+    parser.add_argument("--batch", type=int, default=10, help="строк между уступками циклу событий")
+    parser.add_argument("--rotation-mb", type=float, default=1.0, help="порог ротации файла, МБ (частая ротация — худший случай)")
+    parser.add_argument("--slow-write-ms", type=float, default=0.0, help="искусственная задержка записи строки, мс")
+    parser.add_argument("--dir", default=None, help="каталог для файлов логов (по умолчанию временный)")
+    args = parser.parse_args()
+    args.dir = args.dir or tempfile.mkdtemp(prefix="bench_logging_")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Бенчмарк движка напоминаний на симулированных часах
+Генерирует синтетическую базу (пользователи, квесты с дедлайнами, ежедневные задачи),
+прогоняет симулированные сутки через ReminderEngine с фейковым Bot и печатает
+CPU на цикл, число обращений к БД на цикл, пиковую память и распределение задержек доставки.
+
+Пример:
+    python bench_reminders.py --users 100000 --deadlines 50000 --dailies 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from database_async import Database
+from metrics import metrics
+from reminder import ReminderEngine, MINUTE
+
+# Популярные варианты времени из клавиатуры создания ежедневной задачи
+PRESET_TIMES = ("09:00", "12:00", "18:00")
+TZ_OFFSETS = (-300, -180, 0, 60, 120, 180, 240, 300, 360, 420, 480, 540, 600)
+
+
+class FakeBot:
+    """Заглушка aiogram Bot: считает вызовы API вместо отправки в Telegram"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class SimulatedClock:
+    """Управляемые часы UTC для движка"""
+
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+async def generate_db(path: str, users: int, deadlines: int, dailies: int, day_start: datetime, seed: int) -> None:
+    """Синтетическая база: дедлайны равномерно по симулируемым суткам, ежедневные — с пиками на популярном времени"""
+    rnd = random.Random(seed)
+    await Database(path).init_db()
+    created_at = (day_start - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    con = sqlite3.connect(path)
+    con.executemany(
+        "INSERT INTO users (user_id, username, tz_offset_minutes, tz_prompted) VALUES (?, ?, ?, TRUE)",
+        ((uid, f"user{uid}", rnd.choice(TZ_OFFSETS)) for uid in range(1, users + 1)),
+    )
+
+    def deadline_rows():
+        for _ in range(deadlines):
+            deadline = day_start + timedelta(minutes=rnd.randrange(0, 26 * 60))
+            yield (rnd.randint(1, users), "Квест", "custom", 0, deadline.strftime("%Y-%m-%d %H:%M:%S"), created_at)
+
+    con.executemany(
+        "INSERT INTO quests (user_id, title, quest_type, target_value, deadline, created_at, has_date, has_time) "
+        "VALUES (?, ?, ?, ?, ?, ?, TRUE, TRUE)",
+        deadline_rows(),
+    )
+
+    def daily_rows():
+        for _ in range(dailies):
+            if rnd.random() < 0.6:
+                rt = rnd.choice(PRESET_TIMES)
+            else:
+                rt = f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}"
+            days = "" if rnd.random() < 0.5 else "1,2,3,4,5"
+            yield (rnd.randint(1, users), "Ежедневная", "custom", 0, created_at, days, rt)
+
+    con.executemany(
+        "INSERT INTO quests (user_id, title, quest_type, target_value, created_at, is_daily, repeat_days, daily_reminder_time) "
+        "VALUES (?, ?, ?, ?, ?, TRUE, ?, ?)",
+        daily_rows(),
+    )
+    con.commit()
+    con.close()
+
+
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args) -> None:
+    day_start = datetime(2030, 1, 7, tzinfo=timezone.utc)  # понедельник
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_reminders_"), "quests.db")
+    if not args.reuse_db:
+        if os.path.exists(path):
+            os.remove(path)
+        started = time.perf_counter()
+        await generate_db(path, args.users, args.deadlines, args.dailies, day_start, args.seed)
+        print(f"База сгенерирована за {time.perf_counter() - started:.1f} с: {path}")
+
+    database = Database(path)
+    database.trace_statements = True
+    clock = SimulatedClock(day_start)
+    bot = FakeBot(latency=args.api_latency)
+    engine = ReminderEngine(bot, database=database, digest=args.digest, clock=clock)
+    engine.last_minute = day_start - MINUTE
+
+    cpu_per_tick, wall_per_tick, statements_per_tick, connections_per_tick = [], [], [], []
+    if args.tracemalloc:
+        tracemalloc.start()
+    total_started = time.perf_counter()
+    for minute in range(0, args.minutes, args.tick_every):
+        # Цикл стартует чуть позже границы минуты, как реальный тикер
+        clock.now = day_start + minute * MINUTE + timedelta(seconds=args.tick_offset)
+        stats_before = dict(database.stats)
+        cpu_started = time.process_time()
+        wall_started = time.perf_counter()
+        await engine.tick()
+        wall_per_tick.append(time.perf_counter() - wall_started)
+        cpu_per_tick.append(time.process_time() - cpu_started)
+        statements_per_tick.append(database.stats["statements"] - stats_before["statements"])
+        connections_per_tick.append(database.stats["connections"] - stats_before["connections"])
+    total = time.perf_counter() - total_started
+    peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    latency = metrics.histogram("reminder_latency_seconds")
+    print()
+    print(f"Пользователей: {args.users}, дедлайнов: {args.deadlines}, ежедневных: {args.dailies}")
+    print(f"Симулировано минут: {args.minutes}, циклов: {len(cpu_per_tick)} (каждые {args.tick_every} мин), дайджест: {args.digest}")
+    print(f"Реальное время прогона: {total:.1f} с")
+    print(f"Вызовов Telegram API: {bot.calls}, напоминаний доставлено: {latency.count}")
+    print()
+    print("                      avg        p50        p95        max")
+    for name, values, fmt in (
+        ("CPU на цикл, мс", [v * 1000 for v in cpu_per_tick], "{:>10.2f}"),
+        ("Wall на цикл, мс", [v * 1000 for v in wall_per_tick], "{:>10.2f}"),
+        ("SQL на цикл", statements_per_tick, "{:>10.1f}"),
+        ("Соединений на цикл", connections_per_tick, "{:>10.1f}"),
+    ):
+        avg = sum(values) / len(values) if values else 0.0
+        row = "".join(fmt.format(v) for v in (avg, _pct(values, 0.5), _pct(values, 0.95), max(values or [0])))
+        print(f"{name:<20}{row}")
+    print()
+    if peak is not None:
+        print(f"Пиковая память (tracemalloc): {peak / 1024 / 1024:.1f} МБ")
+    print("Задержка доставки напоминаний (с):")
+    snap = latency.snapshot()
+    print(f"  avg={snap['avg']:.2f} p50<={snap['p50']} p95<={snap['p95']} max={snap['max']:.2f}")
+    lower = 0
+    for bound, count in zip(list(latency.buckets) + [float("inf")], latency.counts):
+        if count:
+            print(f"  ({lower}, {bound}]: {count}")
+        lower = bound
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк движка напоминаний на симулированных часах")
+    parser.add_argument("--users", type=int, default=1000, help="число пользователей")
+    parser.add_argument("--deadlines", type=int, default=1000, help="число квестов с дедлайнами")
+    parser.add_argument("--dailies", type=int, default=1000, help="число ежедневных задач")
+    parser.add_argument("--minutes", type=int, default=24 * 60, help="сколько минут симулировать")
+    parser.add_argument("--tick-every", type=int, default=1, help="интервал между циклами, мин (>1 — медленный планировщик)")
+    parser.add_argument("--tick-offset", type=float, default=0.05, help="задержка старта цикла после границы минуты, с")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="искусственная задержка send_message, с")
+    parser.add_argument("--digest", action="store_true", help="режим дайджеста")
+    parser.add_argument("--db", help="путь к синтетической базе (по умолчанию во временном каталоге)")
+    parser.add_argument("--reuse-db", action="store_true", help="не генерировать базу заново")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false", help="не измерять пиковую память")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
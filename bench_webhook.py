@@ -0,0 +1,309 @@
+"""
+Сквозная задержка обновлений: long polling и webhook без сети
+Поднимает в том же процессе mock Bot API (getUpdates, setWebhook, sendMessage, …),
+бота с обработчиками из handlers.py и временной базой, затем прогоняет одни и те же
+обновления двумя способами: через очередь getUpdates (polling) и POST-запросами на
+локальный эндпоинт webhook с секретом. Задержка — от отправки обновления до первого
+ответа бота в этот чат (sendMessage, editMessageText, answerCallbackQuery), как её видит
+пользователь. Каждый пользователь отправляет следующее обновление после ответа на предыдущее.
+Обновления — записанные (JSON Lines, по одному Update на строку) или синтетические.
+С --workers N обработчики работают в N рабочих процессах (workers.py), а этот процесс
+только принимает обновления и распределяет их по user_id.
+
+Пример:
+    python bench_webhook.py --users 50 --rounds 20
+    python bench_webhook.py --updates recorded.jsonl --mode webhook
+    python bench_webhook.py --users 200 --rounds 10 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession, web
+from loguru import logger
+
+from callbacks import pack
+from config import config
+from database_async import db
+from metrics import metrics
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+# Ответы бота, которые пользователь видит как реакцию на обновление
+REPLY_METHODS = {"sendmessage", "editmessagetext", "editmessagereplymarkup", "answercallbackquery", "sendphoto", "senddocument"}
+
+
+class MockBotAPI:
+    """Bot API в памяти: очередь getUpdates и учёт ответов бота по чатам"""
+
+    def __init__(self):
+        self.updates: List[Dict[str, Any]] = []
+        self.arrived = asyncio.Event()
+        self.calls: Dict[str, int] = defaultdict(int)
+        # Ожидающие ответа: чат -> future; callback_query_id -> чат
+        self.waiting: Dict[int, asyncio.Future] = {}
+        self.callback_chats: Dict[str, int] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    def push(self, update: Dict[str, Any]) -> None:
+        self.updates.append(update)
+        self.arrived.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if method == "getupdates":
+            return self._ok(await self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0)))
+        if method == "getme":
+            return self._ok({"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method in REPLY_METHODS:
+            chat_id = params.get("chat_id")
+            chat = int(chat_id) if chat_id else self.callback_chats.get(params.get("callback_query_id", ""))
+            future = self.waiting.get(chat)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+            if method == "answercallbackquery":
+                return self._ok(True)
+            return self._ok({
+                "message_id": int(params.get("message_id") or 1),
+                "date": int(time.time()),
+                "chat": {"id": chat or 0, "type": "private"},
+                "text": params.get("text", ""),
+            })
+        return self._ok(True)
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+
+def synthetic_updates(users: int, rounds: int) -> Dict[int, List[Dict[str, Any]]]:
+    """Для каждого пользователя: /start, «📋 Квесты», кнопки «Мои квесты» и главного меню"""
+    script = [("text", "/start"), ("text", "📋 Квесты"), ("data", pack("my_quests_inline")), ("data", pack("main_menu"))]
+    out = {}
+    for user_id in range(1, users + 1):
+        out[user_id] = [{kind: value, "user": user_id} for _ in range(rounds) for kind, value in script]
+    return out
+
+
+def recorded_updates(path: str) -> Dict[int, List[Dict[str, Any]]]:
+    """Записанные обновления по пользователям (порядок внутри пользователя сохраняется)"""
+    out: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            event = update.get("message") or update.get("callback_query") or {}
+            user = (event.get("from") or {}).get("id")
+            if user is not None:
+                out[user].append({"raw": update, "user": user})
+    return dict(out)
+
+
+def build_update(item: Dict[str, Any], update_id: int) -> Tuple[Dict[str, Any], int, Optional[str]]:
+    """Update для отправки: (update, чат, callback_query_id); записанные получают новый update_id и дату"""
+    now = int(time.time())
+    user = {"id": item["user"], "is_bot": False, "first_name": f"u{item['user']}"}
+    if "raw" in item:
+        update = json.loads(json.dumps(item["raw"]))
+        update["update_id"] = update_id
+        if "message" in update:
+            update["message"]["date"] = now
+            return update, update["message"]["chat"]["id"], None
+        callback = update["callback_query"]
+        callback["id"] = str(update_id)
+        chat = (callback.get("message") or {}).get("chat", {}).get("id", item["user"])
+        return update, chat, callback["id"]
+    chat = {"id": item["user"], "type": "private"}
+    if "text" in item:
+        return {"update_id": update_id, "message": {"message_id": update_id, "date": now, "chat": chat, "from": user, "text": item["text"]}}, item["user"], None
+    message = {"message_id": 1, "date": now, "chat": chat, "from": {"id": 123456, "is_bot": True, "first_name": "bench"}, "text": "menu"}
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user, "chat_instance": "1", "data": item["data"], "message": message}}, item["user"], str(update_id)
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_users(api: MockBotAPI, scripts: Dict[int, List[Dict[str, Any]]], send, timeout: float, first_id: int) -> Tuple[List[float], int, float]:
+    """Каждый пользователь отправляет свои обновления по одному, дожидаясь ответа; (задержки, без ответа, длительность)"""
+    latencies: List[float] = []
+    lost = 0
+    next_id = first_id
+
+    async def user_loop(items: List[Dict[str, Any]]) -> None:
+        nonlocal lost, next_id
+        loop = asyncio.get_running_loop()
+        for item in items:
+            update, chat, callback_id = build_update(item, next_id)
+            next_id += 1
+            future = api.waiting[chat] = loop.create_future()
+            if callback_id:
+                api.callback_chats[callback_id] = chat
+            sent = time.perf_counter()
+            await send(update)
+            try:
+                latencies.append(await asyncio.wait_for(future, timeout) - sent)
+            except asyncio.TimeoutError:
+                lost += 1
+            finally:
+                api.waiting.pop(chat, None)
+                api.callback_chats.pop(callback_id, None)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_loop(items) for items in scripts.values()))
+    return latencies, lost, time.perf_counter() - started
+
+
+async def bench_polling(dp, bot: Bot, api: MockBotAPI, scripts, args) -> Tuple[List[float], int, float]:
+    polling = asyncio.create_task(dp.start_polling(
+        bot, handle_signals=False, close_bot_session=False, handle_as_tasks=not args.workers, polling_timeout=10, transport="polling",
+    ))
+
+    async def send(update: Dict[str, Any]) -> None:
+        api.push(update)
+
+    try:
+        return await run_users(api, scripts, send, args.timeout, first_id=1)
+    finally:
+        await dp.stop_polling()
+        await polling
+
+
+async def bench_webhook(dp, bot: Bot, api: MockBotAPI, scripts, args) -> Tuple[List[float], int, float]:
+    from webhook import create_webhook_app
+
+    runner = web.AppRunner(create_webhook_app(dp, bot, path="/webhook", secret_token=SECRET), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/webhook"
+    try:
+        async with ClientSession() as http:
+            # Запрос без секрета отклоняется
+            async with http.post(url, json={"update_id": 0}, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as resp:
+                assert resp.status == 401, resp.status
+
+            async def send(update: Dict[str, Any]) -> None:
+                async with http.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                    resp.raise_for_status()
+
+            return await run_users(api, scripts, send, args.timeout, first_id=10_000_000)
+    finally:
+        await runner.cleanup()
+
+
+async def main_async(args) -> None:
+    # Вывод логов в консоль сам по себе стоит миллисекунды на обновление — оставляем только предупреждения
+    logger.remove()
+    logger.add(lambda msg: print(msg, end=""), level="WARNING")
+    db.db_path = os.path.join(args.dir, "quests.db")
+    await db.init_db()
+    config.FSM_STORAGE = "memory"
+    if not args.throttle:
+        config.THROTTLE_WRITE_BURST = config.THROTTLE_NAV_BURST = config.THROTTLE_MESSAGE_BURST = 0
+    from main import create_dispatcher
+    from middlewares import APICallCounter
+
+    api = MockBotAPI()
+    api_runner = web.AppRunner(api.app(), access_log=None)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", 0).start()
+    api_url = f"http://127.0.0.1:{api_runner.addresses[0][1]}"
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    bot.session.middleware(APICallCounter())
+    pool = None
+    if args.workers:
+        from aiogram import Dispatcher
+        from workers import ForwardToWorkers, WorkerPool
+
+        # Рабочие процессы читают настройки из окружения (spawn)
+        os.environ.update({
+            "BOT_TOKEN": TOKEN, "TELEGRAM_API_URL": api_url, "DATABASE_PATH": db.db_path, "FSM_STORAGE": "memory",
+            "LOG_LEVEL": "WARNING", "LOG_FILE": os.path.join(args.dir, "bot.log"), "METRICS_PORT": "0",
+        })
+        if not args.throttle:
+            os.environ.update({"THROTTLE_WRITE_BURST": "0", "THROTTLE_NAV_BURST": "0", "THROTTLE_MESSAGE_BURST": "0"})
+        pool = WorkerPool(args.workers, "bench")
+        dp = Dispatcher()
+        dp.update.outer_middleware(ForwardToWorkers(pool))
+        await pool.start()
+        await pool.wait_ready(120)
+    else:
+        dp = create_dispatcher()
+    scripts = recorded_updates(args.updates) if args.updates else synthetic_updates(args.users, args.rounds)
+    total = sum(len(items) for items in scripts.values())
+
+    results = {}
+    try:
+        modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+        for mode in modes:
+            run = bench_polling if mode == "polling" else bench_webhook
+            results[mode] = await run(dp, bot, api, scripts, args)
+    finally:
+        if pool is not None:
+            await pool.stop()
+        await bot.session.close()
+        await api_runner.cleanup()
+
+    print(f"Пользователей: {len(scripts)}, обновлений на режим: {total}, рабочих процессов: {args.workers}, база: {db.db_path}")
+    print(f"{'режим':<10}{'обн/с':>8}{'p50,мс':>9}{'p95,мс':>9}{'p99,мс':>9}{'max,мс':>9}{'без ответа':>12}")
+    for mode, (latencies, lost, elapsed) in results.items():
+        ms = [v * 1000 for v in latencies]
+        print(
+            f"{mode:<10}{len(latencies) / elapsed:>8.0f}{_pct(ms, 0.5):>9.1f}{_pct(ms, 0.95):>9.1f}"
+            f"{_pct(ms, 0.99):>9.1f}{max(ms, default=0):>9.1f}{lost:>12}"
+        )
+    if not args.workers:
+        print("Задержка внутри процесса (update_latency_seconds):")
+    for labels, hist in metrics.family("update_latency_seconds"):
+        if hist.count:
+            print(f"  {labels.get('transport'):<10}среднее {hist.sum / hist.count * 1000:.1f} мс, p95 ≤ {hist.quantile(0.95) * 1000:.0f} мс")
+    print(f"Вызовы mock Bot API: getUpdates {api.calls['getupdates']}, всего {sum(api.calls.values())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозная задержка обновлений: long polling и webhook на mock Bot API")
+    parser.add_argument("--mode", choices=("both", "polling", "webhook"), default="both")
+    parser.add_argument("--users", type=int, default=20, help="пользователей (синтетические обновления)")
+    parser.add_argument("--rounds", type=int, default=10, help="повторов сценария на пользователя")
+    parser.add_argument("--updates", help="записанные обновления, JSON Lines (вместо синтетических)")
+    parser.add_argument("--timeout", type=float, default=5.0, help="ожидание ответа на обновление, с")
+    parser.add_argument("--throttle", action="store_true", help="не отключать антифлуд")
+    parser.add_argument("--workers", type=int, default=0, help="рабочих процессов (0 — обработка в этом процессе)")
+    parser.add_argument("--dir", default=None, help="каталог для базы (по умолчанию временный)")
+    args = parser.parse_args()
+    args.dir = args.dir or tempfile.mkdtemp(prefix="bench_webhook_")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Формат callback_data и маршрутизация callback-запросов
+callback_data — короткий код действия и целые аргументы в base36 через «:»
+(«q:2n» — карточка квеста 95). Все callback-запросы принимает один обработчик роутера:
+он разбирает строку и находит обработчик действия одним поиском в словаре, без перебора
+фильтров F.data.startswith(...). Кнопки старого формата в ранее отправленных сообщениях
+(«quest_95», «edit_title_95») разбираются по именам действий
+"""
+
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram.types import CallbackQuery
+from loguru import logger
+
+SEP = ":"
+
+# Действие -> код в callback_data. Имена действий без аргументов совпадают со старыми
+# callback_data, имена действий с аргументами — со старыми префиксами
+ACTIONS: Dict[str, str] = {
+    # Меню
+    "main_menu": "m",
+    "back_to_menu": "b",
+    "my_quests_inline": "mq",
+    "create_quest_inline": "cq",
+    "mode_regular": "mr",
+    "mode_daily": "md",
+    "stats": "st",
+    "help": "h",
+    "cancel": "x",
+    "noop": "n",
+    # Квест
+    "quest": "q",
+    "progress": "p",
+    "complete": "c",
+    "delete": "d",
+    "edit": "e",
+    "edit_title": "et",
+    "edit_target": "eg",
+    "edit_deadline": "ed",
+    "edit_type_menu": "em",
+    "edit_type": "ey",
+    "edit_comment": "ec",
+    "meditate": "me",
+    "cancel_meditation": "mx",
+    # Создание квеста
+    "custom_progress": "cp",
+    "skip_comment": "sc",
+    "deadline_today": "dy",
+    "deadline_time_skip": "ds",
+    "deadline_skip_all": "da",
+    # Ежедневные задачи
+    "daily_days_toggle": "dt",
+    "daily_days_preset": "dp",
+    "daily_days_next": "dn",
+    "daily_time": "tm",
+    "daily_time_none": "t0",
+    "daily_time_custom": "tc",
+    "daily_done": "dd",
+    "daily_undo": "du",
+    # Списки
+    "lists_menu": "l",
+    "my_lists": "ml",
+    "list_templates": "lt",
+    "create_list_inline": "lc",
+    "list": "li",
+    "add_item": "ai",
+    "toggle_item": "ti",
+    "del_item": "di",
+    "delete_list": "dl",
+    "share_list": "sl",
+    "copy_list": "yl",
+    # Часовой пояс
+    "tz_setup_now": "zn",
+    "tz_setup_skip": "zs",
+}
+CODES: Dict[str, str] = {code: name for name, code in ACTIONS.items()}
+assert len(CODES) == len(ACTIONS), "коды действий должны быть уникальны"
+
+# Действия, которые пишут в базу (ограничиваются строже навигации, см. middlewares.Throttle)
+WRITE_ACTIONS = frozenset(ACTIONS[name] for name in (
+    "complete", "delete", "edit_type", "custom_progress", "skip_comment", "deadline_time_skip",
+    "deadline_skip_all", "meditate", "cancel_meditation", "daily_time", "daily_time_none",
+    "daily_done", "daily_undo", "toggle_item", "del_item", "delete_list", "tz_setup_skip",
+))
+
+# Действия, у которых в старом формате были номера, не нужные обработчику
+# («noop_<item_id>» — подпись пункта списка, «share_list_<list_id>»): номера отбрасываются
+LEGACY_NO_ARGS = frozenset(("noop", "share_list", "copy_list"))
+
+# Перечислимые аргументы передаются номером в кортеже
+DAILY_PRESETS = ("all", "weekdays", "weekend")
+QUEST_TYPES = ("physical", "intellectual", "mental", "custom")
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(n: int) -> str:
+    if n < 0:
+        return "-" + _b36(-n)
+    if n < 36:
+        return _DIGITS[n]
+    out = []
+    while n:
+        n, r = divmod(n, 36)
+        out.append(_DIGITS[r])
+    return "".join(reversed(out))
+
+
+def pack(action: str, *args: int) -> str:
+    """callback_data для действия: pack("edit_title", 95) → "et:2n" """
+    code = ACTIONS[action]
+    if not args:
+        return code
+    return code + SEP + SEP.join(_b36(int(a)) for a in args)
+
+
+def unpack(data: Optional[str]) -> Tuple[Optional[str], Tuple[int, ...]]:
+    """Код действия и аргументы; (None, ()) для нераспознанной строки"""
+    if not data:
+        return None, ()
+    code, _, rest = data.partition(SEP)
+    if code in CODES:
+        if not rest:
+            return code, ()
+        try:
+            return code, tuple(int(part, 36) for part in rest.split(SEP))
+        except ValueError:
+            return None, ()
+    return _unpack_legacy(data)
+
+
+def _unpack_legacy(data: str) -> Tuple[Optional[str], Tuple[int, ...]]:
+    """Старый формат: имя действия целиком или имя и аргументы через «_»"""
+    if data in ACTIONS:
+        return ACTIONS[data], ()
+    # Перечислимые аргументы старого формата
+    if data.startswith("daily_days_preset_"):
+        preset = data[len("daily_days_preset_"):]
+        return (ACTIONS["daily_days_preset"], (DAILY_PRESETS.index(preset),)) if preset in DAILY_PRESETS else (None, ())
+    if data.startswith("daily_time_"):
+        try:
+            hh, mm = data[len("daily_time_"):].split(":")
+            return ACTIONS["daily_time"], (int(hh) * 60 + int(mm),)
+        except ValueError:
+            return None, ()
+    if data in ("custom_progress_yes", "custom_progress_no"):
+        return ACTIONS["custom_progress"], (int(data.endswith("yes")),)
+    if data.startswith("edit_type_") and not data.startswith("edit_type_menu_"):
+        parts = data.split("_")
+        if len(parts) == 4 and parts[2] in QUEST_TYPES and parts[3].isdigit():
+            return ACTIONS["edit_type"], (QUEST_TYPES.index(parts[2]), int(parts[3]))
+        return None, ()
+    # Имя действия — самый длинный префикс, за которым идут только числа
+    parts = data.split("_")
+    for cut in range(len(parts) - 1, 0, -1):
+        name = "_".join(parts[:cut])
+        if name in ACTIONS and all(p.isdigit() for p in parts[cut:]):
+            if name in LEGACY_NO_ARGS:
+                return ACTIONS[name], ()
+            return ACTIONS[name], tuple(int(p) for p in parts[cut:])
+    return None, ()
+
+
+Handler = Callable[..., Awaitable[None]]
+
+# Параметры обработчика, которые берутся из данных aiogram (FSMContext, профиль из UserContext), а не из callback_data
+CONTEXT_PARAMS = ("state", "profile")
+
+
+class CallbackRouter:
+    """Таблица обработчиков callback-запросов по коду действия"""
+
+    def __init__(self):
+        # код -> (обработчик, порядок параметров после callback: имя из CONTEXT_PARAMS или None для аргумента, число аргументов)
+        self.handlers: Dict[str, Tuple[Handler, Tuple[Optional[str], ...], int]] = {}
+
+    def action(self, name: str) -> Callable[[Handler], Handler]:
+        """
+        Регистрация обработчика действия
+
+        Обработчик получает CallbackQuery, объявленные параметры state и profile
+        и целые аргументы из callback_data: async def cb_edit_title(callback, state, quest_id)
+        """
+        code = ACTIONS[name]
+
+        def decorator(handler: Handler) -> Handler:
+            if code in self.handlers:
+                raise ValueError(f"Обработчик действия {name} уже зарегистрирован")
+            params = list(inspect.signature(handler).parameters)[1:]
+            plan = tuple(p if p in CONTEXT_PARAMS else None for p in params)
+            self.handlers[code] = (handler, plan, plan.count(None))
+            return handler
+
+        return decorator
+
+    def resolve(self, data: Optional[str]) -> Optional[Handler]:
+        """Обработчик, который получит callback_data (для метрик по обработчикам)"""
+        entry = self.handlers.get(unpack(data)[0])
+        return entry[0] if entry else None
+
+    async def dispatch(self, callback: CallbackQuery, **data: Any) -> None:
+        """Единственный обработчик callback_query роутера"""
+        code, args = unpack(callback.data)
+        entry = self.handlers.get(code)
+        if entry is None:
+            logger.debug(f"Необработанный callback: {callback.data!r}")
+            await callback.answer()
+            return
+        handler, plan, arity = entry
+        if len(args) != arity:
+            await callback.answer("Ошибка ID")
+            return
+        if arity == len(plan):
+            await handler(callback, *args)
+            return
+        values = iter(args)
+        await handler(callback, *(data.get(p) if p else next(values) for p in plan))
@@ -16,16 +16,108 @@ class Config:
     
     # Telegram Bot Token
     BOT_TOKEN: str = os.getenv('BOT_TOKEN', '')
+    # Адрес Bot API (пусто — api.telegram.org; локальный Bot API server или mock для тестов)
+    TELEGRAM_API_URL: str = os.getenv('TELEGRAM_API_URL', '')
+    
+    # Получение обновлений: polling (long polling getUpdates) или webhook (встроенный HTTP-сервер)
+    BOT_MODE: str = os.getenv('BOT_MODE', 'polling').lower()
+    # Webhook: публичный адрес (https://host[:port], пусто — setWebhook не вызывается,
+    # webhook настроен заранее), путь, адрес и порт сервера, секрет для заголовка
+    # X-Telegram-Bot-Api-Secret-Token и сколько ждать обработки принятых обновлений при остановке, с
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '').rstrip('/')
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_HOST: str = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_DRAIN_SECONDS: float = float(os.getenv('WEBHOOK_DRAIN_SECONDS', '30'))
     
     # Windsurf AI настройки
     WINDSURF_API_KEY: str = os.getenv('WINDSURF_API_KEY', '')
     WINDSURF_API_URL: str = os.getenv('WINDSURF_API_URL', 'https://api.windsurf.ai/v1/chat/completions')
+    # Пул соединений с AI API: максимум одновременных соединений, keep-alive (с) и время жизни DNS-кэша (с)
+    AI_POOL_LIMIT: int = int(os.getenv('AI_POOL_LIMIT', '20'))
+    AI_KEEPALIVE_SECONDS: float = float(os.getenv('AI_KEEPALIVE_SECONDS', '60'))
+    AI_DNS_CACHE_SECONDS: int = int(os.getenv('AI_DNS_CACHE_SECONDS', '300'))
+    # Кэш сгенерированных квестов: время жизни (ч), записей в памяти и в SQLite
+    AI_CACHE_TTL_HOURS: float = float(os.getenv('AI_CACHE_TTL_HOURS', '168'))
+    AI_CACHE_MEMORY_SIZE: int = int(os.getenv('AI_CACHE_MEMORY_SIZE', '500'))
+    AI_CACHE_DB_SIZE: int = int(os.getenv('AI_CACHE_DB_SIZE', '10000'))
+    # После неудачного запроса к AI одинаковые запросы не повторяются столько секунд
+    AI_FAILURE_COOLDOWN_SECONDS: float = float(os.getenv('AI_FAILURE_COOLDOWN_SECONDS', '15'))
+    # Потоковая генерация квеста: сообщение-заглушка обновляется по мере ответа AI,
+    # не чаще одного раза в AI_STREAM_EDIT_INTERVAL секунд
+    AI_STREAM: bool = os.getenv('AI_STREAM', 'true').lower() in ('1', 'true', 'yes')
+    AI_STREAM_EDIT_INTERVAL: float = float(os.getenv('AI_STREAM_EDIT_INTERVAL', '1.5'))
+    # Лимит одновременных запросов к AI, очередь ожидания свободного слота и время ожидания (с)
+    AI_MAX_CONCURRENCY: int = int(os.getenv('AI_MAX_CONCURRENCY', '8'))
+    AI_MAX_QUEUE: int = int(os.getenv('AI_MAX_QUEUE', '32'))
+    AI_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv('AI_QUEUE_TIMEOUT_SECONDS', '10'))
+    # Автомат отключения AI: размыкается, когда среди последних AI_BREAKER_WINDOW запросов
+    # (не меньше AI_BREAKER_MIN_CALLS) доля ошибок и ответов дольше AI_BREAKER_SLOW_SECONDS
+    # достигла AI_BREAKER_FAILURE_RATE; через AI_BREAKER_OPEN_SECONDS пропускает пробный запрос
+    AI_BREAKER_WINDOW: int = int(os.getenv('AI_BREAKER_WINDOW', '20'))
+    AI_BREAKER_MIN_CALLS: int = int(os.getenv('AI_BREAKER_MIN_CALLS', '5'))
+    AI_BREAKER_FAILURE_RATE: float = float(os.getenv('AI_BREAKER_FAILURE_RATE', '0.5'))
+    AI_BREAKER_SLOW_SECONDS: float = float(os.getenv('AI_BREAKER_SLOW_SECONDS', '15'))
+    AI_BREAKER_OPEN_SECONDS: float = float(os.getenv('AI_BREAKER_OPEN_SECONDS', '30'))
+    # Квота AI-запросов на пользователя: подряд без ожидания и пополнение в минуту (0 — без квоты)
+    AI_USER_BURST: int = int(os.getenv('AI_USER_BURST', '3'))
+    AI_USER_REQUESTS_PER_MINUTE: float = float(os.getenv('AI_USER_REQUESTS_PER_MINUTE', '2'))
+    # Сколько секунд ждать начала ответа AI (при потоковой генерации — паузы между частями),
+    # прежде чем выдать квест локального генератора (0 — ждать без ограничения);
+    # без ключа, при разомкнутом автомате или исчерпанной квоте локальный квест выдаётся сразу
+    AI_LATENCY_BUDGET_SECONDS: float = float(os.getenv('AI_LATENCY_BUDGET_SECONDS', '12'))
     
     # База данных
     DATABASE_PATH: str = os.getenv('DATABASE_PATH', 'quests.db')
+    # Пул соединений процесса с базой и ожидание блокировки записи другим соединением или процессом, с
+    DB_POOL_SIZE: int = int(os.getenv('DB_POOL_SIZE', '4'))
+    DB_BUSY_TIMEOUT: float = float(os.getenv('DB_BUSY_TIMEOUT', '5'))
+    # Хранилище диалогов FSM: sqlite (переживает перезапуск) или memory
+    FSM_STORAGE: str = os.getenv('FSM_STORAGE', 'sqlite').lower()
+    # Диалог без активности удаляется через FSM_TTL_HOURS; изменения пишутся в базу раз в FSM_FLUSH_INTERVAL секунд
+    FSM_TTL_HOURS: float = float(os.getenv('FSM_TTL_HOURS', '24'))
+    FSM_FLUSH_INTERVAL: float = float(os.getenv('FSM_FLUSH_INTERVAL', '2'))
+    # Предел числа диалогов в памяти (сверх него вытесняются самые давно неактивные)
+    # и период очистки с обновлением метрик, с
+    FSM_MAX_DIALOGS: int = int(os.getenv('FSM_MAX_DIALOGS', '50000'))
+    FSM_SWEEP_INTERVAL: float = float(os.getenv('FSM_SWEEP_INTERVAL', '60'))
+    
+    # Обработка обновлений: обновления одного чата — по очереди, разных чатов — параллельно,
+    # не больше UPDATE_WORKERS одновременно
+    UPDATE_WORKERS: int = int(os.getenv('UPDATE_WORKERS', '32'))
+    # Отсев повторно доставленных обновлений: сколько последних update_id держать в памяти,
+    # сколько часов их помнить (Telegram хранит недоставленные обновления сутки) и период записи в базу, с
+    DEDUP_CAPACITY: int = int(os.getenv('DEDUP_CAPACITY', '100000'))
+    DEDUP_TTL_HOURS: float = float(os.getenv('DEDUP_TTL_HOURS', '24'))
+    DEDUP_FLUSH_INTERVAL: float = float(os.getenv('DEDUP_FLUSH_INTERVAL', '1'))
+    # Рабочие процессы (0 — всё в одном процессе): приёмник передаёт обновления процессу по user_id % WORKERS
+    WORKERS: int = int(os.getenv('WORKERS', '0'))
+    # Антифлуд: ведро токенов на пользователя для каждого класса действий — кнопки с записью
+    # в базу, кнопки навигации и сообщения (подряд / в минуту; подряд 0 — без ограничения)
+    THROTTLE_WRITE_BURST: int = int(os.getenv('THROTTLE_WRITE_BURST', '5'))
+    THROTTLE_WRITE_PER_MINUTE: float = float(os.getenv('THROTTLE_WRITE_PER_MINUTE', '30'))
+    THROTTLE_NAV_BURST: int = int(os.getenv('THROTTLE_NAV_BURST', '10'))
+    THROTTLE_NAV_PER_MINUTE: float = float(os.getenv('THROTTLE_NAV_PER_MINUTE', '120'))
+    THROTTLE_MESSAGE_BURST: int = int(os.getenv('THROTTLE_MESSAGE_BURST', '8'))
+    THROTTLE_MESSAGE_PER_MINUTE: float = float(os.getenv('THROTTLE_MESSAGE_PER_MINUTE', '30'))
+    
+    # Метрики: порт HTTP-эндпоинта /metrics в формате Prometheus (0 — выключен)
+    # и пользователи, которым доступна команда /metrics (id через запятую)
+    METRICS_PORT: int = int(os.getenv('METRICS_PORT', '0'))
+    ADMIN_IDS: frozenset = frozenset(int(x) for x in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if x)
     
     # Логирование
     LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE: str = os.getenv('LOG_FILE', 'bot.log')
+    # Ротация файла логов: размер одного файла (МБ) и число хранимых архивов (bot.log.1 … bot.log.N)
+    LOG_FILE_MAX_MB: int = int(os.getenv('LOG_FILE_MAX_MB', '10'))
+    LOG_FILE_BACKUPS: int = int(os.getenv('LOG_FILE_BACKUPS', '7'))
+    # Файл логов в формате JSON Lines (одна запись — одна строка JSON)
+    LOG_JSON: bool = os.getenv('LOG_JSON', 'false').lower() in ('1', 'true', 'yes')
+    # RT-логи в Telegram: окно отправки (с) и ёмкость буфера (строк, старые вытесняются)
+    LOG_STREAM_INTERVAL: float = float(os.getenv('LOG_STREAM_INTERVAL', '3'))
+    LOG_STREAM_MAX_LINES: int = int(os.getenv('LOG_STREAM_MAX_LINES', '1000'))
     
     # Типы квестов
     QUEST_TYPES = {
@@ -36,7 +128,25 @@ class Config:
     }
     # Timezone offset in minutes relative to UTC for user-local computations
     TZ_OFFSET_MINUTES: int = int(os.getenv('TZ_OFFSET_MINUTES', '0'))
-    
+
+    # Напоминания
+    # Дайджест: напоминания одного чата за цикл объединяются (длинный дайджест — несколькими сообщениями)
+    REMINDER_DIGEST: bool = os.getenv('REMINDER_DIGEST', 'false').lower() in ('1', 'true', 'yes')
+    # Сколько пропущенных минут обрабатывать после медленного цикла или перезапуска (не более суток)
+    REMINDER_MAX_CATCHUP_MINUTES: int = int(os.getenv('REMINDER_MAX_CATCHUP_MINUTES', '1440'))
+    # Включённые политики напоминаний: hour_before, day_before, overdue, daily
+    REMINDER_POLICIES: list = [p.strip() for p in os.getenv('REMINDER_POLICIES', 'hour_before,overdue,daily').split(',') if p.strip()]
+    # Шардирование напоминаний между экземплярами по user_id % REMINDER_SHARD_COUNT
+    REMINDER_SHARD_COUNT: int = max(1, int(os.getenv('REMINDER_SHARD_COUNT', '1')))
+    # Предпочтительный шард этого экземпляра (пусто — без предпочтения); чужие шарды забираются с задержкой
+    REMINDER_SHARD_INDEX: str = os.getenv('REMINDER_SHARD_INDEX', '')
+
+    # Несколько экземпляров бота: фоновые задачи выполняет держатель аренды в SQLite
+    # Идентификатор экземпляра (по умолчанию имя хоста и PID)
+    INSTANCE_ID: str = os.getenv('INSTANCE_ID', '')
+    # Срок аренды, с: резервный экземпляр подхватывает задачи не позже чем через это время после падения лидера
+    LEASE_TTL_SECONDS: float = float(os.getenv('LEASE_TTL_SECONDS', '10'))
+
     @classmethod
     def validate(cls) -> bool:
         """
@@ -48,7 +158,17 @@ class Config:
         if not cls.BOT_TOKEN:
             logger.error("❌ BOT_TOKEN не установлен! Проверьте файл .env")
             return False
-        
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            logger.error(f"❌ BOT_MODE={cls.BOT_MODE}: ожидается polling или webhook")
+            return False
+        shard_index = cls.REMINDER_SHARD_INDEX.strip()
+        if shard_index and not (shard_index.isdigit() and int(shard_index) < cls.REMINDER_SHARD_COUNT):
+            logger.error(
+                f"❌ REMINDER_SHARD_INDEX={shard_index}: ожидается число от 0 до {cls.REMINDER_SHARD_COUNT - 1} "
+                f"(REMINDER_SHARD_COUNT={cls.REMINDER_SHARD_COUNT})"
+            )
+            return False
+
         logger.info("✅ Конфигурация загружена успешно")
         logger.info(f"📊 База данных: {cls.DATABASE_PATH}")
         logger.info(f"🔧 Уровень логирования: {cls.LOG_LEVEL}")
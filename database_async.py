@@ -1,14 +1,58 @@
 """
 Асинхронный модуль для работы с базой данных SQLite
-Управляет квестами пользователей с валидацией данных
+Управляет квестами пользователей с валидацией данных.
+Соединения берутся из пула процесса (до DB_POOL_SIZE, журнал WAL): читатели не ждут
+писателя, несколько процессов (main.py с WORKERS) работают с одним файлом базы
 """
 
+import asyncio
+import json
 import re
+import time
 import aiosqlite
-from datetime import datetime
-from typing import Optional, Tuple, List
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple, List, Dict
 from loguru import logger
 from config import config
+from metrics import metrics
+
+# Обращения к БД в текущем контексте (обработчике обновления): [соединения, секунды]; None — не учитываются
+DB_USAGE: ContextVar[Optional[list]] = ContextVar("db_usage", default=None)
+
+DB_POOL_OPEN = metrics.gauge("db_pool_connections", "Открытые соединения пула БД")
+DB_POOL_WAIT = metrics.histogram("db_pool_wait_seconds", "Ожидание свободного соединения пула БД")
+
+
+class UserProfile:
+    """Строка users: профиль пользователя, загружаемый один раз на обновление (middlewares.UserContext)"""
+
+    __slots__ = ("user_id", "username", "tz_offset_minutes", "tz_prompted", "log_subscribed", "log_level", "log_module", "created")
+
+    def __init__(
+        self,
+        user_id: int,
+        username: Optional[str] = None,
+        tz_offset_minutes: Optional[int] = None,
+        tz_prompted: bool = False,
+        log_subscribed: bool = False,
+        log_level: str = "INFO",
+        log_module: Optional[str] = None,
+        created: bool = False,
+    ):
+        self.user_id = user_id
+        self.username = username
+        self.tz_offset_minutes = tz_offset_minutes
+        self.tz_prompted = bool(tz_prompted)
+        self.log_subscribed = bool(log_subscribed)
+        self.log_level = log_level or "INFO"
+        self.log_module = log_module
+        # Пользователь создан при загрузке этого обновления
+        self.created = created
+
+    def __repr__(self) -> str:
+        return f"UserProfile(user_id={self.user_id}, tz_offset_minutes={self.tz_offset_minutes}, tz_prompted={self.tz_prompted})"
 
 
 class Database:
@@ -22,11 +66,122 @@ class Database:
             db_path: Путь к файлу базы данных (по умолчанию из config)
         """
         self.db_path = db_path or config.DATABASE_PATH
+        # Учёт обращений к БД: соединения, SQL-операторы (если включён trace_statements) и суммарное время
+        self.stats = {"connections": 0, "statements": 0, "seconds": 0.0}
+        self.trace_statements = False
+        # Пул соединений: свободные соединения, число открытых, цикл событий пула
+        self.pool_size = max(1, config.DB_POOL_SIZE)
+        self._idle: List[aiosqlite.Connection] = []
+        self._opened = 0
+        self._released: Optional[asyncio.Condition] = None
+        self._pool_loop = None
+        # Соединение, которое держит текущая задача: вложенные обращения используют его, а не второе из пула
+        self._held: ContextVar[Optional[tuple]] = ContextVar(f"db_held_{id(self)}", default=None)
+        # Подписчики RT-логов в памяти {user_id: (минимальный уровень, модуль или None)}:
+        # загружаются один раз и обновляются set_log_subscription
+        self.log_subscribers: Optional[Dict[int, Tuple[str, Optional[str]]]] = None
         logger.info(f"📊 Инициализация базы данных: {self.db_path}")
+
+    @asynccontextmanager
+    async def _connect(self):
+        """Соединение с БД из пула — единая точка учёта обращений"""
+        started = time.perf_counter()
+        self.stats["connections"] += 1
+        task = asyncio.current_task()
+        held = self._held.get()
+        try:
+            if held is not None and held[1] is task:
+                # Вложенное обращение в той же задаче (например, _today_local_date внутри транзакции)
+                yield held[0]
+                return
+            conn = await self._acquire()
+            token = self._held.set((conn, task))
+            try:
+                yield conn
+            finally:
+                self._held.reset(token)
+                await self._release(conn)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats["seconds"] += elapsed
+            usage = DB_USAGE.get()
+            if usage is not None:
+                usage[0] += 1
+                usage[1] += elapsed
+
+    def _count_statement(self, _sql: str) -> None:
+        self.stats["statements"] += 1
+
+    async def _open(self) -> aiosqlite.Connection:
+        conn = aiosqlite.connect(self.db_path, timeout=config.DB_BUSY_TIMEOUT)
+        # Поток соединения пула не должен задерживать выход из процесса, если close() не вызван
+        conn.daemon = True
+        await conn
+        # WAL: чтение не блокируется записью (в том числе из других процессов);
+        # synchronous=NORMAL в WAL не теряет согласованность, только последние транзакции при сбое ОС
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT * 1000)}")
+        return conn
+
+    async def _acquire(self) -> aiosqlite.Connection:
+        """Свободное соединение пула; новое, пока открыто меньше pool_size; иначе ждём освобождения"""
+        loop = asyncio.get_running_loop()
+        if self._pool_loop is not loop:
+            # Пул привязан к циклу событий (asyncio.run в скриптах создаёт новый)
+            self._idle, self._opened, self._pool_loop = [], 0, loop
+            self._released = asyncio.Condition()
+        if not self._idle and self._opened >= self.pool_size:
+            waited = time.perf_counter()
+            async with self._released:
+                await self._released.wait_for(lambda: self._idle or self._opened < self.pool_size)
+            DB_POOL_WAIT.observe(time.perf_counter() - waited)
+        if self._idle:
+            conn = self._idle.pop()
+        else:
+            self._opened += 1
+            DB_POOL_OPEN.set(self._opened)
+            try:
+                conn = await self._open()
+            except BaseException:
+                self._opened -= 1
+                DB_POOL_OPEN.set(self._opened)
+                raise
+        await conn.set_trace_callback(self._count_statement if self.trace_statements else None)
+        return conn
+
+    async def _release(self, conn: aiosqlite.Connection) -> None:
+        broken = False
+        try:
+            # Незавершённая транзакция (исключение до commit) не переходит к следующему владельцу
+            if conn.in_transaction:
+                await conn.rollback()
+        except Exception:
+            # Соединение в неизвестном состоянии — закрываем, вместо него откроется новое
+            broken = True
+        if broken:
+            self._opened -= 1
+            DB_POOL_OPEN.set(self._opened)
+            try:
+                await conn.close()
+            except Exception:
+                pass
+        else:
+            self._idle.append(conn)
+        async with self._released:
+            self._released.notify()
+
+    async def close(self) -> None:
+        """Закрыть свободные соединения пула (при остановке)"""
+        idle, self._idle = self._idle, []
+        self._opened -= len(idle)
+        DB_POOL_OPEN.set(self._opened)
+        for conn in idle:
+            await conn.close()
     
     async def init_db(self):
         """Создание таблиц в базе данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Таблица пользователей
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -59,6 +214,11 @@ class Database:
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         has_date BOOLEAN DEFAULT FALSE,
                         has_time BOOLEAN DEFAULT FALSE,
+                        is_daily BOOLEAN DEFAULT FALSE,
+                        repeat_days TEXT,
+                        streak INTEGER DEFAULT 0,
+                        last_done_date TEXT,
+                        daily_reminder_time TEXT,
                         FOREIGN KEY (user_id) REFERENCES users (user_id)
                     )
                 ''')
@@ -121,6 +281,10 @@ class Database:
                     await db.execute("ALTER TABLE users ADD COLUMN tz_prompted BOOLEAN DEFAULT FALSE")
                 if 'log_subscribed' not in cols_u:
                     await db.execute("ALTER TABLE users ADD COLUMN log_subscribed BOOLEAN DEFAULT FALSE")
+                if 'log_level' not in cols_u:
+                    await db.execute("ALTER TABLE users ADD COLUMN log_level TEXT DEFAULT 'INFO'")
+                if 'log_module' not in cols_u:
+                    await db.execute("ALTER TABLE users ADD COLUMN log_module TEXT")
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка миграции users: {e}")
 
@@ -186,6 +350,81 @@ class Database:
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка проверки схемы list_items: {e}")
 
+            # Индексы для выборки кандидатов в напоминания
+            try:
+                await db.execute('CREATE INDEX IF NOT EXISTS idx_quests_deadline ON quests (completed, deadline)')
+                await db.execute('CREATE INDEX IF NOT EXISTS idx_quests_daily_time ON quests (daily_reminder_time)')
+                await db.execute('CREATE INDEX IF NOT EXISTS idx_users_tz ON users (tz_offset_minutes)')
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка создания индексов напоминаний: {e}")
+
+            # Отметки фоновых планировщиков (последняя обработанная минута)
+            try:
+                await db.execute('''
+                    CREATE TABLE IF NOT EXISTS scheduler_marks (
+                        job TEXT PRIMARY KEY,
+                        last_minute TEXT NOT NULL
+                    )
+                ''')
+            except Exception as e:
+                logger.error(f"❌ Ошибка создания таблицы scheduler_marks: {e}")
+
+            # Аренды фоновых задач (выбор лидера между экземплярами бота)
+            try:
+                await db.execute('''
+                    CREATE TABLE IF NOT EXISTS leases (
+                        name TEXT PRIMARY KEY,
+                        holder TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        heartbeat_at REAL NOT NULL
+                    )
+                ''')
+            except Exception as e:
+                logger.error(f"❌ Ошибка создания таблицы leases: {e}")
+
+            # Кэш ответов AI (ключ — нормализованная цель)
+            try:
+                await db.execute('''
+                    CREATE TABLE IF NOT EXISTS ai_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_used REAL NOT NULL,
+                        latency REAL DEFAULT 0,
+                        hits INTEGER DEFAULT 0
+                    )
+                ''')
+                await db.execute('CREATE INDEX IF NOT EXISTS idx_ai_cache_last_used ON ai_cache (last_used)')
+            except Exception as e:
+                logger.error(f"❌ Ошибка создания таблицы ai_cache: {e}")
+
+            # Состояния диалогов FSM (отложенная запись из fsm_storage.SQLiteStorage)
+            try:
+                await db.execute('''
+                    CREATE TABLE IF NOT EXISTS fsm_state (
+                        key TEXT PRIMARY KEY,
+                        state TEXT,
+                        data TEXT NOT NULL DEFAULT '{}',
+                        updated_at REAL NOT NULL
+                    )
+                ''')
+                await db.execute('CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated_at)')
+            except Exception as e:
+                logger.error(f"❌ Ошибка создания таблицы fsm_state: {e}")
+
+            # Номера обработанных обновлений (отсев повторов, dedup.SeenUpdates)
+            try:
+                await db.execute('''
+                    CREATE TABLE IF NOT EXISTS seen_updates (
+                        update_id INTEGER PRIMARY KEY,
+                        seen_at REAL NOT NULL
+                    )
+                ''')
+                await db.execute('CREATE INDEX IF NOT EXISTS idx_seen_updates_seen_at ON seen_updates (seen_at)')
+            except Exception as e:
+                logger.error(f"❌ Ошибка создания таблицы seen_updates: {e}")
+
             await db.commit()
             logger.info("✅ База данных инициализирована")
     
@@ -228,7 +467,7 @@ class Database:
             user_id: ID пользователя Telegram
             username: Имя пользователя
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 'INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)',
                 (user_id, username)
@@ -236,9 +475,33 @@ class Database:
             await db.commit()
             logger.debug(f"👤 Пользователь {username} (ID: {user_id}) добавлен/обновлен")
 
+    async def get_or_create_user(self, user_id: int, username: str) -> UserProfile:
+        """
+        Профиль пользователя; если пользователя нет — он создаётся
+
+        Одно чтение строки users (и вставка только для нового пользователя)
+
+        Args:
+            user_id: ID пользователя Telegram
+            username: Имя пользователя (для нового пользователя)
+        """
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "SELECT username, tz_offset_minutes, COALESCE(tz_prompted, FALSE), COALESCE(log_subscribed, FALSE), "
+                "COALESCE(log_level, 'INFO'), log_module FROM users WHERE user_id = ?",
+                (user_id,)
+            )
+            row = await cursor.fetchone()
+            if row is not None:
+                return UserProfile(user_id, *row)
+            await db.execute('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', (user_id, username))
+            await db.commit()
+        logger.debug(f"👤 Пользователь {username} (ID: {user_id}) добавлен")
+        return UserProfile(user_id, username, created=True)
+
     async def get_user_timezone(self, user_id: int) -> Tuple[Optional[int], bool]:
         """Получить смещение таймзоны и признак, что пользователя уже спрашивали"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute('SELECT tz_offset_minutes, COALESCE(tz_prompted, FALSE) FROM users WHERE user_id = ?', (user_id,))
             row = await cursor.fetchone()
             if not row:
@@ -246,31 +509,208 @@ class Database:
             return row[0], bool(row[1])
 
     async def set_user_timezone(self, user_id: int, offset_minutes: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute('UPDATE users SET tz_offset_minutes = ?, tz_prompted = TRUE WHERE user_id = ?', (offset_minutes, user_id))
             await db.commit()
 
     async def set_user_tz_prompted(self, user_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute('UPDATE users SET tz_prompted = TRUE WHERE user_id = ?', (user_id,))
             await db.commit()
 
-    async def set_log_subscription(self, user_id: int, subscribed: bool) -> None:
-        """Включить/выключить подписку на RT-логи для пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('UPDATE users SET log_subscribed = ? WHERE user_id = ?', (int(bool(subscribed)), user_id))
+    async def set_log_subscription(
+        self,
+        user_id: int,
+        subscribed: bool,
+        level: str = "INFO",
+        module: Optional[str] = None
+    ) -> None:
+        """
+        Включить/выключить подписку на RT-логи для пользователя
+        
+        Args:
+            user_id: ID пользователя
+            subscribed: Подписан ли пользователь
+            level: Минимальный уровень логов (DEBUG, INFO, WARNING, ERROR)
+            module: Присылать только логи модулей с этим префиксом имени (None — все)
+        """
+        async with self._connect() as db:
+            await db.execute(
+                'UPDATE users SET log_subscribed = ?, log_level = ?, log_module = ? WHERE user_id = ?',
+                (int(bool(subscribed)), level, module, user_id)
+            )
             await db.commit()
+        if self.log_subscribers is not None:
+            if subscribed:
+                self.log_subscribers[user_id] = (level, module)
+            else:
+                self.log_subscribers.pop(user_id, None)
 
-    async def get_log_subscribers(self) -> List[int]:
-        """Получить user_id всех подписчиков логов"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('SELECT user_id FROM users WHERE COALESCE(log_subscribed, FALSE) = TRUE')
+    async def load_log_subscribers(self) -> Dict[int, Tuple[str, Optional[str]]]:
+        """Перечитать подписчиков RT-логов из БД (при старте и для синхронизации между экземплярами)"""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "SELECT user_id, COALESCE(log_level, 'INFO'), log_module FROM users "
+                "WHERE COALESCE(log_subscribed, FALSE) = TRUE"
+            )
             rows = await cursor.fetchall()
-            return [r[0] for r in rows]
+        self.log_subscribers = {r[0]: (r[1], r[2]) for r in rows}
+        return self.log_subscribers
+
+    async def get_log_subscribers(self) -> List[int]:
+        """Получить user_id всех подписчиков логов (из памяти, БД читается только при первом вызове)"""
+        if self.log_subscribers is None:
+            await self.load_log_subscribers()
+        return list(self.log_subscribers)
+
+    async def get_scheduler_mark(self, job: str) -> Optional[str]:
+        """Последняя обработанная минута фоновой задачи ('YYYY-MM-DD HH:MM:00', UTC)"""
+        async with self._connect() as db:
+            cursor = await db.execute('SELECT last_minute FROM scheduler_marks WHERE job = ?', (job,))
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def set_scheduler_mark(self, job: str, last_minute: str) -> None:
+        """Сохранить последнюю обработанную минуту фоновой задачи"""
+        async with self._connect() as db:
+            await db.execute(
+                'INSERT INTO scheduler_marks (job, last_minute) VALUES (?, ?) '
+                'ON CONFLICT(job) DO UPDATE SET last_minute = excluded.last_minute',
+                (job, last_minute)
+            )
+            await db.commit()
+
+    async def try_acquire_lease(self, name: str, holder: str, ttl: float, takeover_delay: float = 0.0) -> bool:
+        """
+        Захватить или продлить аренду фоновой задачи (одна атомарная операция)
+        
+        Args:
+            name: Имя аренды
+            holder: Идентификатор экземпляра
+            ttl: Срок аренды в секундах
+            takeover_delay: Сколько секунд аренда должна быть просрочена, прежде чем её заберёт другой экземпляр
+            
+        Returns:
+            bool: True если аренда принадлежит holder
+        """
+        now = time.time()
+        async with self._connect() as db:
+            await db.execute(
+                'INSERT INTO leases (name, holder, expires_at, heartbeat_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at, '
+                'heartbeat_at = excluded.heartbeat_at '
+                'WHERE leases.holder = excluded.holder OR leases.expires_at < ?',
+                (name, holder, now + ttl, now, now - takeover_delay)
+            )
+            await db.commit()
+            cursor = await db.execute('SELECT holder FROM leases WHERE name = ?', (name,))
+            row = await cursor.fetchone()
+            return bool(row) and row[0] == holder
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        """Освободить аренду, если она принадлежит holder"""
+        async with self._connect() as db:
+            await db.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+            await db.commit()
+
+    async def get_ai_cache(self, key: str, now: float) -> Optional[Tuple[float, dict, float]]:
+        """
+        Ответ AI из кэша
+        
+        Returns:
+            Optional[Tuple[float, dict, float]]: (expires_at, ответ, исходная задержка генерации) или None
+        """
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'SELECT value, expires_at, latency FROM ai_cache WHERE key = ? AND expires_at > ?',
+                (key, now)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            await db.execute('UPDATE ai_cache SET last_used = ?, hits = hits + 1 WHERE key = ?', (now, key))
+            await db.commit()
+        try:
+            return row[1], json.loads(row[0]), row[2] or 0.0
+        except ValueError:
+            return None
+
+    async def put_ai_cache(self, key: str, value: dict, now: float, expires_at: float, latency: float) -> None:
+        """Сохранить ответ AI в кэш"""
+        async with self._connect() as db:
+            await db.execute(
+                'INSERT INTO ai_cache (key, value, created_at, expires_at, last_used, latency) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, created_at = excluded.created_at, '
+                'expires_at = excluded.expires_at, last_used = excluded.last_used, latency = excluded.latency',
+                (key, json.dumps(value, ensure_ascii=False), now, expires_at, now, latency)
+            )
+            await db.commit()
+
+    async def prune_ai_cache(self, now: float, max_rows: int) -> int:
+        """Удалить просроченные записи кэша AI и самые давно использованные сверх max_rows"""
+        async with self._connect() as db:
+            cursor = await db.execute('DELETE FROM ai_cache WHERE expires_at <= ?', (now,))
+            removed = cursor.rowcount or 0
+            cursor = await db.execute(
+                'DELETE FROM ai_cache WHERE key IN ('
+                'SELECT key FROM ai_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (max_rows,)
+            )
+            removed += cursor.rowcount or 0
+            await db.commit()
+            return removed
+
+    async def load_fsm_states(
+        self, since: float, owns: Optional[Callable[[str], bool]] = None
+    ) -> List[Tuple[str, Optional[str], str, float]]:
+        """
+        Состояния диалогов FSM, обновлённые не раньше since; более старые удаляются
+
+        Args:
+            since: Граница устаревания (unix)
+            owns: Отбор ключей этого процесса (шард рабочего процесса); чужие строки не читаются и не удаляются
+        """
+        async with self._connect() as db:
+            cur = await db.execute('SELECT key, state, data, updated_at FROM fsm_state ORDER BY updated_at')
+            rows = [row for row in await cur.fetchall() if owns is None or owns(row[0])]
+            stale = [(row[0],) for row in rows if row[3] < since]
+            if stale:
+                await db.executemany('DELETE FROM fsm_state WHERE key = ?', stale)
+                await db.commit()
+            return [row for row in rows if row[3] >= since]
+
+    async def save_fsm_states(self, upserts: List[Tuple[str, Optional[str], str, float]], deletes: List[str]) -> None:
+        """Записать пачку изменений состояний FSM одной транзакцией"""
+        async with self._connect() as db:
+            if upserts:
+                await db.executemany(
+                    'INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, '
+                    'updated_at = excluded.updated_at',
+                    upserts
+                )
+            if deletes:
+                await db.executemany('DELETE FROM fsm_state WHERE key = ?', [(k,) for k in deletes])
+            await db.commit()
+
+    async def load_seen_updates(self, since: float) -> List[Tuple[int, float]]:
+        """Номера обновлений, отмеченные не раньше since, по возрастанию; более старые удаляются"""
+        async with self._connect() as db:
+            await db.execute('DELETE FROM seen_updates WHERE seen_at < ?', (since,))
+            await db.commit()
+            cur = await db.execute('SELECT update_id, seen_at FROM seen_updates ORDER BY update_id')
+            return await cur.fetchall()
+
+    async def save_seen_updates(self, rows: List[Tuple[int, float]], prune_before: float) -> None:
+        """Записать пачку номеров обновлений и удалить отмеченные раньше prune_before — одной транзакцией"""
+        async with self._connect() as db:
+            await db.executemany('INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)', rows)
+            await db.execute('DELETE FROM seen_updates WHERE seen_at < ?', (prune_before,))
+            await db.commit()
 
     async def get_all_user_ids(self) -> List[int]:
         """Получить user_id всех пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute('SELECT user_id FROM users')
             rows = await cur.fetchall()
             return [r[0] for r in rows]
@@ -361,7 +801,7 @@ class Database:
                     if any(re.fullmatch(p, c) for p in date_like) or (deadline and c == str(deadline)):
                         comment = None
             logger.info(f"[DB] create_quest normalized -> user_id={user_id}, title='{title}', type='{quest_type}', target={target_value}, deadline='{deadline}', comment='{comment}', has_date={has_date}, has_time={has_time}")
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 cursor = await db.execute(
                     '''INSERT INTO quests (user_id, title, quest_type, target_value, deadline, comment, has_date, has_time) 
                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
@@ -385,7 +825,7 @@ class Database:
         Returns:
             List[tuple]: Список квестов
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 'SELECT quest_id, user_id, title, quest_type, target_value, current_value, completed, deadline, comment, created_at, has_date, has_time '
                 'FROM quests WHERE user_id = ? AND completed = FALSE ORDER BY created_at DESC',
@@ -396,7 +836,7 @@ class Database:
 
     async def get_user_regular_quests(self, user_id: int) -> List[tuple]:
         """Активные НЕ ежедневные квесты"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 'SELECT quest_id, user_id, title, quest_type, target_value, current_value, completed, deadline, comment, created_at, has_date, has_time '
                 'FROM quests WHERE user_id = ? AND completed = FALSE AND COALESCE(is_daily, FALSE) = FALSE ORDER BY created_at DESC',
@@ -410,7 +850,7 @@ class Database:
         - Нормализовать дедлайны с только датой -> 'YYYY-MM-DD 00:00:00'
         - Исправить баг 'вчера + время' на дату создания '00:00:00'
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             total = 0
             # 1) Удаляем комментарии, похожие на дату, или совпадающие с дедлайном
             # Используем GLOB/LIKE из-за отсутствия REGEXP в SQLite по умолчанию
@@ -472,7 +912,7 @@ class Database:
         Returns:
             Optional[tuple]: Данные квеста или None
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 'SELECT quest_id, user_id, title, quest_type, target_value, current_value, completed, deadline, comment, created_at, has_date, has_time '
                 'FROM quests WHERE quest_id = ? AND user_id = ?',
@@ -498,7 +938,7 @@ class Database:
         Returns:
             Optional[tuple]: Обновленный квест или None
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Получаем целевое значение
             cursor = await db.execute(
                 'SELECT target_value FROM quests WHERE quest_id = ? AND user_id = ?',
@@ -549,7 +989,7 @@ class Database:
         Returns:
             Optional[tuple]: Обновленный квест или None
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 'UPDATE quests SET completed = TRUE, current_value = target_value WHERE quest_id = ? AND user_id = ?',
                 (quest_id, user_id)
@@ -576,7 +1016,7 @@ class Database:
         Returns:
             bool: True если квест удален
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 'DELETE FROM quests WHERE quest_id = ? AND user_id = ?',
                 (quest_id, user_id)
@@ -720,7 +1160,7 @@ class Database:
         query = f'UPDATE quests SET {", ".join(updates)} WHERE quest_id = ? AND user_id = ?'
         
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 await db.execute(query, params)
                 await db.commit()
                 
@@ -743,7 +1183,7 @@ class Database:
         Returns:
             List[tuple]: Список квестов с дедлайнами
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 'SELECT quest_id, user_id, title, quest_type, target_value, current_value, completed, deadline, comment, created_at, has_date, has_time '
                 'FROM quests WHERE deadline IS NOT NULL AND completed = FALSE'
@@ -751,9 +1191,66 @@ class Database:
             quests = await cursor.fetchall()
             return quests
 
+    async def get_reminder_snapshot(
+        self,
+        window_start: datetime,
+        window_end: datetime,
+        horizon: datetime,
+        shard_index: int = 0,
+        shard_count: int = 1
+    ) -> Tuple[List[tuple], List[tuple]]:
+        """
+        Единый запрос кандидатов для движка напоминаний (одно соединение на цикл)
+        
+        Args:
+            window_start: Начало окна обработки (не включительно), UTC
+            window_end: Конец окна обработки (включительно), UTC
+            horizon: Самый дальний дедлайн, который может сработать в окне, UTC
+            shard_index: Номер шарда (только user_id % shard_count == shard_index)
+            shard_count: Число шардов
+            
+        Returns:
+            Tuple[List[tuple], List[tuple]]: (квесты с дедлайнами, ежедневные задачи)
+            Дедлайны: (quest_id, user_id, title, deadline, created_at, tz_offset_minutes)
+            Ежедневные: (quest_id, user_id, title, repeat_days, last_done_date, daily_reminder_time, tz_offset_minutes)
+        """
+        ws = window_start.strftime("%Y-%m-%d %H:%M:%S")
+        hz = horizon.strftime("%Y-%m-%d %H:%M:%S")
+        shard_sql, shard_args = '', ()
+        if shard_count > 1:
+            shard_sql, shard_args = ' AND q.user_id % ? = ?', (shard_count, shard_index)
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'SELECT q.quest_id, q.user_id, q.title, q.deadline, q.created_at, COALESCE(u.tz_offset_minutes, 0) '
+                'FROM quests q LEFT JOIN users u ON u.user_id = q.user_id '
+                'WHERE q.completed = FALSE AND q.deadline IS NOT NULL AND q.deadline <= ? '
+                'AND (q.deadline > ? OR q.created_at > ?) AND COALESCE(q.has_date, TRUE) = TRUE' + shard_sql,
+                (hz, ws, ws) + shard_args
+            )
+            deadline_rows = await cursor.fetchall()
+            # Время напоминаний, попадающее в окно, для каждого встречающегося часового пояса
+            cursor = await db.execute('SELECT DISTINCT COALESCE(tz_offset_minutes, 0) FROM users')
+            offsets = {int(r[0] or 0) for r in await cursor.fetchall()} | {0}
+            minutes = int((window_end - window_start).total_seconds() // 60)
+            times = set()
+            for off in offsets:
+                for i in range(1, minutes + 1):
+                    times.add((window_start + timedelta(minutes=i + off)).strftime("%H:%M"))
+            daily_rows = []
+            if times:
+                placeholders = ",".join("?" for _ in times)
+                cursor = await db.execute(
+                    'SELECT q.quest_id, q.user_id, q.title, q.repeat_days, q.last_done_date, q.daily_reminder_time, COALESCE(u.tz_offset_minutes, 0) '
+                    'FROM quests q LEFT JOIN users u ON u.user_id = q.user_id '
+                    f'WHERE COALESCE(q.is_daily, FALSE) = TRUE AND q.daily_reminder_time IN ({placeholders})' + shard_sql,
+                    tuple(times) + shard_args
+                )
+                daily_rows = await cursor.fetchall()
+            return deadline_rows, daily_rows
+
     # ===== Daily tasks helpers =====
     async def get_user_daily_quests(self, user_id: int) -> List[tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 'SELECT quest_id, user_id, title, quest_type, target_value, current_value, completed, deadline, comment, created_at, has_date, has_time, is_daily, repeat_days, streak, last_done_date, daily_reminder_time '
                 'FROM quests WHERE user_id = ? AND COALESCE(is_daily, FALSE) = TRUE ORDER BY created_at DESC',
@@ -790,7 +1287,7 @@ class Database:
             return datetime.utcnow().strftime('%Y-%m-%d')
 
     async def is_done_today(self, user_id: int, quest_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute('SELECT last_done_date FROM quests WHERE quest_id = ? AND user_id = ? AND COALESCE(is_daily, FALSE) = TRUE', (quest_id, user_id))
             row = await cur.fetchone()
             if not row:
@@ -800,7 +1297,7 @@ class Database:
             return bool(last_done) and str(last_done) == today
 
     async def mark_daily_done_for_today(self, user_id: int, quest_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as con:
+        async with self._connect() as con:
             # Получим предыдущую дату и последовательность
             cur = await con.execute('SELECT last_done_date, streak, repeat_days FROM quests WHERE quest_id = ? AND user_id = ? AND COALESCE(is_daily, FALSE) = TRUE', (quest_id, user_id))
             row = await cur.fetchone()
@@ -829,7 +1326,7 @@ class Database:
             return True
 
     async def undo_daily_for_today(self, user_id: int, quest_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as con:
+        async with self._connect() as con:
             cur = await con.execute('SELECT last_done_date, streak FROM quests WHERE quest_id = ? AND user_id = ? AND COALESCE(is_daily, FALSE) = TRUE', (quest_id, user_id))
             row = await cur.fetchone()
             if not row:
@@ -845,13 +1342,13 @@ class Database:
             return True
 
     async def is_quest_daily(self, quest_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute('SELECT COALESCE(is_daily, FALSE) FROM quests WHERE quest_id = ?', (quest_id,))
             row = await cur.fetchone()
             return bool(row and row[0])
 
     async def get_daily_meta(self, quest_id: int) -> Optional[tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute('SELECT repeat_days, streak, last_done_date, daily_reminder_time, user_id FROM quests WHERE quest_id = ?', (quest_id,))
             return await cur.fetchone()
 
@@ -861,7 +1358,7 @@ class Database:
         if not is_valid:
             return None, error_msg
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 cur = await db.execute(
                     'INSERT INTO lists (user_id, title, is_template) VALUES (?, ?, ?)',
                     (user_id, title, int(bool(is_template)))
@@ -875,7 +1372,7 @@ class Database:
             return None, "Ошибка при создании списка"
 
     async def get_user_lists(self, user_id: int) -> List[tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 'SELECT list_id, user_id, title, created_at, is_template FROM lists WHERE user_id = ? AND COALESCE(is_template, FALSE) = FALSE ORDER BY created_at DESC',
                 (user_id,)
@@ -883,14 +1380,14 @@ class Database:
             return await cur.fetchall()
 
     async def get_templates(self) -> List[tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 'SELECT list_id, user_id, title, created_at, is_template FROM lists WHERE COALESCE(is_template, FALSE) = TRUE ORDER BY created_at DESC'
             )
             return await cur.fetchall()
 
     async def get_list(self, user_id: int, list_id: int) -> Optional[tuple]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 'SELECT list_id, user_id, title, created_at, is_template FROM lists WHERE list_id = ?',
                 (list_id,)
@@ -904,7 +1401,7 @@ class Database:
             return row
 
     async def delete_list(self, user_id: int, list_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Проверим владельца
             cur = await db.execute('SELECT user_id FROM lists WHERE list_id = ?', (list_id,))
             owner = await cur.fetchone()
@@ -927,7 +1424,7 @@ class Database:
         if not lst or lst[1] != user_id:
             return None, "Список не найден"
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 cur = await db.execute(
                     'INSERT INTO list_items (list_id, text, completed) VALUES (?, ?, FALSE)',
                     (list_id, text)
@@ -945,7 +1442,7 @@ class Database:
         lst = await self.get_list(user_id, list_id)
         if not lst:
             return []
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 'SELECT item_id, list_id, text, completed, created_at FROM list_items WHERE list_id = ? ORDER BY created_at ASC',
                 (list_id,)
@@ -953,7 +1450,7 @@ class Database:
             return await cur.fetchall()
 
     async def toggle_list_item(self, user_id: int, item_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Найдем список и проверим владельца
             cur = await db.execute('SELECT list_id, completed FROM list_items WHERE item_id = ?', (item_id,))
             row = await cur.fetchone()
@@ -969,7 +1466,7 @@ class Database:
             return True
 
     async def delete_list_item(self, user_id: int, item_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute('SELECT list_id FROM list_items WHERE item_id = ?', (item_id,))
             row = await cur.fetchone()
             if not row:
@@ -985,7 +1482,7 @@ class Database:
 
     async def duplicate_list_to_user(self, src_list_id: int, src_owner_id: int, dest_user_id: int, new_title: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
         # Проверяем, что источник доступен: либо шаблон, либо принадлежит src_owner_id
-        async with aiosqlite.connect(self.db_path) as con:
+        async with self._connect() as con:
             cur = await con.execute('SELECT title, is_template, user_id FROM lists WHERE list_id = ?', (src_list_id,))
             src = await cur.fetchone()
             if not src:
@@ -0,0 +1,141 @@
+"""
+Учёт обработанных update_id: повторно доставленное обновление не обрабатывается
+Telegram может прислать обновление ещё раз — после перезапуска (getUpdates без
+подтверждённого offset) или при повторной доставке webhook. Номера недавних обновлений
+хранятся в памяти (множество с ограниченным размером, проверка за O(1)); всё, что
+вытеснено из множества, считается старым по нижней границе. Новые номера пачками
+записываются в таблицу seen_updates в фоне и загружаются при запуске, поэтому повтор
+после перезапуска тоже отбрасывается (кроме обновлений последних DEDUP_FLUSH_INTERVAL
+секунд перед аварийной остановкой)
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from config import config
+from database_async import db
+from metrics import metrics
+
+# Досрочная запись, когда новых номеров накопилось столько
+FLUSH_BATCH = 500
+
+UPDATES_SEEN = metrics.gauge("updates_seen", "Номера обновлений в памяти для отсева повторов")
+UPDATES_DUPLICATE = metrics.counter("updates_duplicate_total", "Повторно доставленные обновления, отброшенные до обработки")
+
+
+class SeenUpdates:
+    """Недавние update_id: память с ограничением размера и отложенная запись в SQLite"""
+
+    def __init__(
+        self,
+        database=None,
+        capacity: Optional[int] = None,
+        ttl: Optional[float] = None,
+        flush_interval: Optional[float] = None,
+        clock=time.time,
+    ):
+        """
+        Args:
+            database: База данных (по умолчанию глобальная db)
+            capacity: Сколько последних номеров держать в памяти (по умолчанию config.DEDUP_CAPACITY)
+            ttl: Сколько помнить номера, с (по умолчанию config.DEDUP_TTL_HOURS)
+            flush_interval: Период фоновой записи, с (по умолчанию config.DEDUP_FLUSH_INTERVAL)
+            clock: Источник времени (для тестов)
+        """
+        self.database = database or db
+        self.capacity = capacity or config.DEDUP_CAPACITY
+        self.ttl = ttl or config.DEDUP_TTL_HOURS * 3600
+        self.flush_interval = flush_interval or config.DEDUP_FLUSH_INTERVAL
+        self.clock = clock
+        self.ids: Set[int] = set()
+        # Номера в порядке поступления: первые вытесняются при переполнении
+        self.order: Deque[int] = deque()
+        # Номера не больше floor вытеснены из памяти и считаются обработанными
+        self.floor = -1
+        self.last_seen = 0.0
+        # Новые номера для записи в базу (только после start)
+        self.pending: List[Tuple[int, float]] = []
+        self.persist = False
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, update_id: int) -> bool:
+        """Отметить обновление; False — такое уже было"""
+        now = self.clock()
+        if self.last_seen and now - self.last_seen > self.ttl:
+            # После долгого простоя Telegram может начать нумерацию заново — старая граница не действует
+            self.floor = -1
+        if update_id <= self.floor or update_id in self.ids:
+            UPDATES_DUPLICATE.inc()
+            return False
+        self._remember(update_id)
+        self.last_seen = now
+        if self.persist:
+            self.pending.append((update_id, now))
+            if len(self.pending) >= FLUSH_BATCH:
+                self.wakeup.set()
+        return True
+
+    def _remember(self, update_id: int) -> None:
+        self.ids.add(update_id)
+        self.order.append(update_id)
+        while len(self.order) > self.capacity:
+            old = self.order.popleft()
+            self.ids.discard(old)
+            self.floor = max(self.floor, old)
+        UPDATES_SEEN.set(len(self.ids))
+
+    async def start(self) -> None:
+        """Загрузить недавние номера и запустить фоновую запись (после init_db)"""
+        rows = await self.database.load_seen_updates(self.clock() - self.ttl)
+        for update_id, seen_at in rows:
+            if update_id not in self.ids:
+                self._remember(update_id)
+            self.last_seen = max(self.last_seen, seen_at)
+        self.persist = True
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        logger.info(f"🔁 Номеров обновлений загружено: {len(rows)}")
+
+    async def close(self) -> None:
+        """Остановить фоновую запись и дописать оставшиеся номера"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Записать новые номера одной транзакцией (и удалить устаревшие); возвращает число номеров"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        try:
+            await self.database.save_seen_updates(batch, self.clock() - self.ttl)
+        except BaseException:
+            # Не удалось записать — повторим со следующей пачкой
+            self.pending = batch + self.pending
+            raise
+        return len(batch)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"Seen updates flush error: {e}")
+                await asyncio.sleep(1)
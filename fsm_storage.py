@@ -0,0 +1,309 @@
+"""
+Хранилища состояний диалогов (FSM) aiogram
+MemoryTTLStorage держит диалоги в памяти с ограничением: диалог без активности дольше
+TTL удаляется, общее число диалогов ограничено (вытесняются давно неактивные),
+периодическая очистка обновляет метрики числа диалогов и занимаемой памяти.
+SQLiteStorage поверх неё копит изменения и записывает их в таблицу fsm_state пачками
+в фоне (отложенная запись), без обращения к диску на каждый state.update_data.
+При запуске незавершённые диалоги загружаются из базы, поэтому перезапуск бота их не теряет;
+рабочий процесс (workers.py) загружает и удаляет только диалоги своего шарда
+"""
+
+import asyncio
+import json
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from loguru import logger
+
+from config import config
+from database_async import db
+from metrics import metrics
+
+# Досрочная запись, когда изменённых диалогов накопилось столько
+FLUSH_BATCH = 200
+# Накладные расходы на запись в OrderedDict (узел связного списка и слот хэш-таблицы), байт
+ENTRY_OVERHEAD = 100
+
+FSM_DIALOGS = metrics.gauge("fsm_dialogs", "Диалоги FSM в памяти")
+FSM_DIALOGS_BYTES = metrics.gauge("fsm_dialogs_bytes", "Приблизительный объём памяти диалогов FSM, байт")
+FSM_EXPIRED = metrics.counter("fsm_expired_total", "Диалоги FSM, удалённые по бездействию")
+FSM_EVICTED = metrics.counter("fsm_evicted_total", "Диалоги FSM, вытесненные при превышении FSM_MAX_DIALOGS")
+FSM_FLUSHES = metrics.counter("fsm_flushes_total", "Пачки изменений FSM, записанные в SQLite")
+FSM_ROWS_WRITTEN = metrics.counter("fsm_rows_written_total", "Строки fsm_state, записанные или удалённые")
+
+
+def approx_size(obj: Any) -> int:
+    """Приблизительный размер объекта с вложенными dict/list/tuple/set, байт (верхняя оценка: общие строки считаются в каждой записи)"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(v) for v in obj)
+    return size
+
+
+def key_user_id(key: str) -> Optional[int]:
+    """user_id из ключа DefaultKeyBuilder (…:chat_id[:thread_id]:user_id:destiny)"""
+    try:
+        return int(key.rsplit(":", 2)[-2])
+    except (IndexError, ValueError):
+        return None
+
+
+class FSMRecord:
+    """Состояние и данные одного диалога"""
+
+    __slots__ = ("state", "data", "touched", "saved")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, touched: float = 0.0):
+        self.state = state
+        self.data = data or {}
+        self.touched = touched
+        # Время активности, записанное на диск (SQLiteStorage)
+        self.saved = touched
+
+    def size(self, key: str) -> int:
+        return ENTRY_OVERHEAD + sys.getsizeof(self) + approx_size(key) + approx_size(self.state) + approx_size(self.data)
+
+
+class MemoryTTLStorage(BaseStorage):
+    """FSM в памяти: TTL бездействия, предел числа диалогов и периодическая очистка"""
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_dialogs: Optional[int] = None,
+        sweep_interval: Optional[float] = None,
+        clock=time.time,
+    ):
+        """
+        Args:
+            ttl: Время жизни диалога без активности, с (по умолчанию config.FSM_TTL_HOURS)
+            max_dialogs: Предел числа диалогов (по умолчанию config.FSM_MAX_DIALOGS)
+            sweep_interval: Период очистки и обновления метрик, с (по умолчанию config.FSM_SWEEP_INTERVAL)
+            clock: Источник времени (для тестов)
+        """
+        self.ttl = ttl or config.FSM_TTL_HOURS * 3600
+        self.max_dialogs = max_dialogs or config.FSM_MAX_DIALOGS
+        self.sweep_interval = sweep_interval or config.FSM_SWEEP_INTERVAL
+        self.clock = clock
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        # Диалоги в порядке последней активности: первые — самые давние
+        self.records: "OrderedDict[str, FSMRecord]" = OrderedDict()
+        self.tick_interval = self.sweep_interval
+        self.swept = 0.0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Запустить периодическую очистку"""
+        self.swept = self.clock()
+        self.account()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    # ----- BaseStorage -----
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        k = self.key_builder.build(key)
+        record = self.records.get(k)
+        if record is None:
+            if state is None:
+                return
+            record = self._insert(k)
+        record.state = state
+        self._changed(k, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._touch(self.key_builder.build(key))
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self.key_builder.build(key)
+        record = self.records.get(k)
+        if record is None:
+            if not data:
+                return
+            record = self._insert(k)
+        record.data = data.copy()
+        self._changed(k, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._touch(self.key_builder.build(key))
+        return record.data.copy() if record else {}
+
+    async def close(self) -> None:
+        """Остановить фоновую задачу"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+            self.task = None
+
+    # ----- Учёт диалогов -----
+    def _touch(self, key: str) -> Optional[FSMRecord]:
+        record = self.records.get(key)
+        if record is not None:
+            record.touched = self.clock()
+            self.records.move_to_end(key)
+        return record
+
+    def _insert(self, key: str) -> FSMRecord:
+        """Новый диалог; при превышении предела вытесняются самые давно неактивные"""
+        record = self.records[key] = FSMRecord()
+        while len(self.records) > self.max_dialogs:
+            old_key, _ = self.records.popitem(last=False)
+            self._mark(old_key)
+            FSM_EVICTED.inc()
+        FSM_DIALOGS.set(len(self.records))
+        return record
+
+    def _changed(self, key: str, record: FSMRecord) -> None:
+        record.touched = self.clock()
+        self.records.move_to_end(key)
+        # Завершённый диалог (state.clear()) не хранится
+        if record.state is None and not record.data:
+            del self.records[key]
+            FSM_DIALOGS.set(len(self.records))
+        self._mark(key)
+
+    def _mark(self, key: str) -> None:
+        """Диалог изменён или удалён (для хранилищ с записью на диск)"""
+
+    def expire(self) -> int:
+        """Удалить диалоги без активности дольше ttl"""
+        deadline = self.clock() - self.ttl
+        expired = 0
+        while self.records:
+            key, record = next(iter(self.records.items()))
+            if record.touched >= deadline:
+                break
+            del self.records[key]
+            self._mark(key)
+            expired += 1
+        if expired:
+            FSM_EXPIRED.inc(expired)
+            FSM_DIALOGS.set(len(self.records))
+        return expired
+
+    def account(self) -> int:
+        """Обновить метрики числа диалогов и занимаемой памяти; возвращает объём, байт"""
+        total = sum(record.size(key) for key, record in self.records.items())
+        FSM_DIALOGS.set(len(self.records))
+        FSM_DIALOGS_BYTES.set(total)
+        return total
+
+    async def tick(self) -> None:
+        """Шаг фоновой задачи: очистка раз в sweep_interval"""
+        if self.clock() - self.swept >= self.sweep_interval:
+            self.expire()
+            self.account()
+            self.swept = self.clock()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.tick_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                await self.tick()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"FSM storage error: {e}")
+                await asyncio.sleep(1)
+
+
+class SQLiteStorage(MemoryTTLStorage):
+    """FSM в памяти с отложенной пакетной записью в SQLite"""
+
+    def __init__(self, database=None, flush_interval: Optional[float] = None, shard: Optional[Tuple[int, int]] = None, **kwargs):
+        """
+        Args:
+            database: База данных (по умолчанию глобальная db)
+            flush_interval: Период фоновой записи, с (по умолчанию config.FSM_FLUSH_INTERVAL)
+            shard: (номер, число) рабочего процесса: загружаются только диалоги пользователей
+                с user_id % число == номер (workers.py распределяет обновления так же)
+            **kwargs: Параметры MemoryTTLStorage (ttl, max_dialogs, sweep_interval, clock)
+        """
+        super().__init__(**kwargs)
+        self.database = database or db
+        self.shard = shard
+        self.flush_interval = flush_interval or config.FSM_FLUSH_INTERVAL
+        self.tick_interval = self.flush_interval
+        # Ключи диалогов, изменённых после последней записи (удалённые — тоже)
+        self.dirty: Set[str] = set()
+
+    async def start(self) -> None:
+        """Загрузить незавершённые диалоги и запустить фоновую запись (после init_db)"""
+        rows = await self.database.load_fsm_states(self.clock() - self.ttl, self.owns if self.shard else None)
+        for key, state, data, updated_at in rows:
+            try:
+                self.records[key] = FSMRecord(state, json.loads(data), updated_at)
+            except ValueError:
+                continue
+        while len(self.records) > self.max_dialogs:
+            self._mark(self.records.popitem(last=False)[0])
+        await super().start()
+        logger.info(f"💾 FSM: восстановлено диалогов: {len(self.records)}")
+
+    def owns(self, key: str) -> bool:
+        """Диалог принадлежит шарду этого процесса (ключ без user_id — шарду 0)"""
+        index, count = self.shard
+        user_id = key_user_id(key)
+        return (user_id if user_id is not None else 0) % count == index
+
+    async def close(self) -> None:
+        """Остановить фоновую запись и дописать оставшиеся изменения"""
+        await super().close()
+        await self.flush()
+
+    def _mark(self, key: str) -> None:
+        self.dirty.add(key)
+        if len(self.dirty) >= FLUSH_BATCH and self.wakeup is not None:
+            self.wakeup.set()
+
+    def _touch(self, key: str) -> Optional[FSMRecord]:
+        """Чтение продлевает диалог; на диск — не чаще раза в ttl/2, иначе после перезапуска он устареет"""
+        record = super()._touch(key)
+        if record is not None and record.touched - record.saved > self.ttl / 2:
+            self._mark(key)
+        return record
+
+    async def tick(self) -> None:
+        await super().tick()
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Записать накопленные изменения одной транзакцией; возвращает число строк"""
+        if not self.dirty:
+            return 0
+        keys, self.dirty = self.dirty, set()
+        upserts, deletes, saved = [], [], []
+        for key in keys:
+            record = self.records.get(key)
+            if record is None:
+                deletes.append(key)
+            else:
+                upserts.append((key, record.state, json.dumps(record.data, ensure_ascii=False, default=str), record.touched))
+                saved.append((record, record.touched))
+        try:
+            await self.database.save_fsm_states(upserts, deletes)
+        except BaseException:
+            # Не удалось записать — повторим со следующей пачкой
+            self.dirty |= keys
+            raise
+        for record, touched in saved:
+            record.saved = touched
+        FSM_FLUSHES.inc()
+        FSM_ROWS_WRITTEN.inc(len(keys))
+        return len(keys)
@@ -11,18 +11,27 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+import html
+import time
 from datetime import datetime, timedelta
 from datetime_utils import (
     comment_should_be_saved,
 )
 from loguru import logger
 
-from database_async import db
+from database_async import UserProfile, db
 from ai_client import ai_client
+from callbacks import CallbackRouter, DAILY_PRESETS, QUEST_TYPES, pack
+from local_quests import local_quests
 from config import config
+from log_stream import LEVELS as LOG_LEVELS
+from middlewares import handler_report
 
 # Создаем роутер для обработчиков
 router = Router()
+# Обработчики inline-кнопок: один callback_query-обработчик и таблица действий
+callback_router = CallbackRouter()
+router.callback_query.register(callback_router.dispatch)
 
 # Активные сессии медитации: {(user_id, quest_id): {"start": datetime, "task": asyncio.Task}}
 MEDITATION_SESSIONS = {}
@@ -123,19 +132,19 @@ def build_daily_days_keyboard(selected: list[int]) -> InlineKeyboardMarkup:
     row = []
     for i in range(1, 8):
         label = ("✅ " if i in selected else "⬜ ") + names[i]
-        row.append(InlineKeyboardButton(text=label, callback_data=f"daily_days_toggle_{i}"))
+        row.append(InlineKeyboardButton(text=label, callback_data=pack("daily_days_toggle", i)))
         if i % 4 == 0:
             rows.append(row)
             row = []
     if row:
         rows.append(row)
     rows.append([
-        InlineKeyboardButton(text="📅 Каждый день", callback_data="daily_days_preset_all"),
-        InlineKeyboardButton(text="🏢 Будни", callback_data="daily_days_preset_weekdays"),
-        InlineKeyboardButton(text="🌅 Выходные", callback_data="daily_days_preset_weekend"),
+        InlineKeyboardButton(text="📅 Каждый день", callback_data=pack("daily_days_preset", DAILY_PRESETS.index("all"))),
+        InlineKeyboardButton(text="🏢 Будни", callback_data=pack("daily_days_preset", DAILY_PRESETS.index("weekdays"))),
+        InlineKeyboardButton(text="🌅 Выходные", callback_data=pack("daily_days_preset", DAILY_PRESETS.index("weekend"))),
     ])
-    rows.append([InlineKeyboardButton(text="Далее ➡️", callback_data="daily_days_next")])
-    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="create_quest_inline")])
+    rows.append([InlineKeyboardButton(text="Далее ➡️", callback_data=pack("daily_days_next"))])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=pack("create_quest_inline"))])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 async def start_daily_days_selection(message: Message, state: FSMContext):
@@ -148,40 +157,35 @@ def get_quest_detail_keyboard(quest_id: int, completed: bool, quest_type: str, t
     keyboard = []
     # Скрываем обновление прогресса для custom без шкалы и для медитации
     if not completed and not (quest_type == "custom" and int(target_value or 0) == 0) and quest_type != "mental":
-        keyboard.append([InlineKeyboardButton(text="📈 Обновить прогресс", callback_data=f"progress_{quest_id}")])
+        keyboard.append([InlineKeyboardButton(text="📈 Обновить прогресс", callback_data=pack("progress", quest_id))])
     if not completed:
-        keyboard.append([InlineKeyboardButton(text="✅ Завершить", callback_data=f"complete_{quest_id}")])
-    keyboard.append([InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_{quest_id}")])
-    keyboard.append([InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{quest_id}")])
+        keyboard.append([InlineKeyboardButton(text="✅ Завершить", callback_data=pack("complete", quest_id))])
+    keyboard.append([InlineKeyboardButton(text="✏️ Редактировать", callback_data=pack("edit", quest_id))])
+    keyboard.append([InlineKeyboardButton(text="🗑 Удалить", callback_data=pack("delete", quest_id))])
     if quest_type == "mental":
-        keyboard.append([InlineKeyboardButton(text="▶️ Начать медитацию", callback_data=f"meditate_{quest_id}")])
-    keyboard.append([InlineKeyboardButton(text="🔙 К списку", callback_data="my_quests_inline")])
+        keyboard.append([InlineKeyboardButton(text="▶️ Начать медитацию", callback_data=pack("meditate", quest_id))])
+    keyboard.append([InlineKeyboardButton(text="🔙 К списку", callback_data=pack("my_quests_inline"))])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 def get_daily_detail_keyboard(quest_id: int, done_today: bool) -> InlineKeyboardMarkup:
     keyboard = []
     if not done_today:
-        keyboard.append([InlineKeyboardButton(text="✅ Выполнить сегодня", callback_data=f"daily_done_{quest_id}")])
+        keyboard.append([InlineKeyboardButton(text="✅ Выполнить сегодня", callback_data=pack("daily_done", quest_id))])
     else:
-        keyboard.append([InlineKeyboardButton(text="↩️ Отменить выполнение", callback_data=f"daily_undo_{quest_id}")])
-    keyboard.append([InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_{quest_id}")])
-    keyboard.append([InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{quest_id}")])
-    keyboard.append([InlineKeyboardButton(text="🔙 К списку", callback_data="my_quests_inline")])
+        keyboard.append([InlineKeyboardButton(text="↩️ Отменить выполнение", callback_data=pack("daily_undo", quest_id))])
+    keyboard.append([InlineKeyboardButton(text="✏️ Редактировать", callback_data=pack("edit", quest_id))])
+    keyboard.append([InlineKeyboardButton(text="🗑 Удалить", callback_data=pack("delete", quest_id))])
+    keyboard.append([InlineKeyboardButton(text="🔙 К списку", callback_data=pack("my_quests_inline"))])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-@router.callback_query(F.data.startswith("quest_"))
-async def cb_quest_detail(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[1])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("quest")
+async def cb_quest_detail(callback: CallbackQuery, profile: UserProfile, quest_id: int):
     user_id = callback.from_user.id
     quest = await db.get_quest(user_id, quest_id)
     if not quest:
         await callback.answer("Квест не найден")
         return
-    tz_off, _ = await db.get_user_timezone(user_id)
+    tz_off = profile.tz_offset_minutes
     text = format_quest_text(quest, tz_off)
     completed = bool(quest[6])
     quest_type = quest[3]
@@ -203,13 +207,8 @@ async def cb_quest_detail(callback: CallbackQuery):
     await callback.answer()
 
 # ===== Daily: days selection =====
-@router.callback_query(F.data.startswith("daily_days_toggle_"))
-async def cb_daily_days_toggle(callback: CallbackQuery, state: FSMContext):
-    try:
-        day = int(callback.data.split("_")[-1])
-    except Exception:
-        await callback.answer("Ошибка")
-        return
+@callback_router.action("daily_days_toggle")
+async def cb_daily_days_toggle(callback: CallbackQuery, state: FSMContext, day: int):
     data = await state.get_data()
     sel = set(data.get("daily_days") or [])
     if day in sel:
@@ -227,9 +226,9 @@ async def cb_daily_days_toggle(callback: CallbackQuery, state: FSMContext):
             pass
     await callback.answer()
 
-@router.callback_query(F.data.startswith("daily_days_preset_"))
-async def cb_daily_days_preset(callback: CallbackQuery, state: FSMContext):
-    preset = callback.data.split("_")[-1]
+@callback_router.action("daily_days_preset")
+async def cb_daily_days_preset(callback: CallbackQuery, state: FSMContext, preset_idx: int):
+    preset = DAILY_PRESETS[preset_idx] if 0 <= preset_idx < len(DAILY_PRESETS) else "weekend"
     if preset == "all":
         sel = [1,2,3,4,5,6,7]
     elif preset == "weekdays":
@@ -247,31 +246,34 @@ async def cb_daily_days_preset(callback: CallbackQuery, state: FSMContext):
             pass
     await callback.answer()
 
-@router.callback_query(F.data == "daily_days_next")
+@callback_router.action("daily_days_next")
 async def cb_daily_days_next(callback: CallbackQuery, state: FSMContext):
     await state.set_state(QuestCreation.waiting_for_daily_time)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="09:00", callback_data="daily_time_09:00"), InlineKeyboardButton(text="12:00", callback_data="daily_time_12:00"), InlineKeyboardButton(text="18:00", callback_data="daily_time_18:00")],
-        [InlineKeyboardButton(text="Без напоминания", callback_data="daily_time_none")],
-        [InlineKeyboardButton(text="Ввести своё", callback_data="daily_time_custom")],
+        [InlineKeyboardButton(text="09:00", callback_data=pack("daily_time", 9 * 60)), InlineKeyboardButton(text="12:00", callback_data=pack("daily_time", 12 * 60)), InlineKeyboardButton(text="18:00", callback_data=pack("daily_time", 18 * 60))],
+        [InlineKeyboardButton(text="Без напоминания", callback_data=pack("daily_time_none"))],
+        [InlineKeyboardButton(text="Ввести своё", callback_data=pack("daily_time_custom"))],
     ])
     await callback.message.edit_text("Во сколько напоминать?", reply_markup=kb)
     await callback.answer()
 
 # ===== Daily: time selection =====
-@router.callback_query(F.data.startswith("daily_time_"))
-async def cb_daily_time(callback: CallbackQuery, state: FSMContext):
-    tag = callback.data.split("_", 2)[-1]
-    if tag == "custom":
-        await state.set_state(QuestCreation.waiting_for_daily_time_custom)
-        await callback.message.edit_text("Введите время в формате HH:MM (например, 09:00) или отправьте 'нет' для отключения напоминаний")
-        await callback.answer()
-        return
-    reminder = None if tag == "none" else tag
-    await finalize_daily_creation(callback, state, reminder)
+@callback_router.action("daily_time")
+async def cb_daily_time(callback: CallbackQuery, state: FSMContext, profile: UserProfile, minutes: int):
+    await finalize_daily_creation(callback, state, profile, f"{minutes // 60 % 24:02d}:{minutes % 60:02d}")
+
+@callback_router.action("daily_time_none")
+async def cb_daily_time_none(callback: CallbackQuery, state: FSMContext, profile: UserProfile):
+    await finalize_daily_creation(callback, state, profile, None)
+
+@callback_router.action("daily_time_custom")
+async def cb_daily_time_custom(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(QuestCreation.waiting_for_daily_time_custom)
+    await callback.message.edit_text("Введите время в формате HH:MM (например, 09:00) или отправьте 'нет' для отключения напоминаний")
+    await callback.answer()
 
 @router.message(QuestCreation.waiting_for_daily_time_custom)
-async def process_daily_time_custom(message: Message, state: FSMContext):
+async def process_daily_time_custom(message: Message, state: FSMContext, profile: UserProfile):
     t = (message.text or "").strip().lower()
     if t in {"нет", "no", "none"}:
         reminder = None
@@ -284,9 +286,9 @@ async def process_daily_time_custom(message: Message, state: FSMContext):
         except Exception:
             await message.answer("Некорректное время. Формат HH:MM")
             return
-    await finalize_daily_creation(message, state, reminder)
+    await finalize_daily_creation(message, state, profile, reminder)
 
-async def finalize_daily_creation(event, state: FSMContext, reminder: str | None):
+async def finalize_daily_creation(event, state: FSMContext, profile: UserProfile, reminder: str | None):
     # event can be Message or CallbackQuery
     get_uid = (lambda: event.from_user.id)
     send_answer = (lambda text, **kw: (event.message.answer if hasattr(event, 'message') else event.answer)(text, **kw))
@@ -317,7 +319,7 @@ async def finalize_daily_creation(event, state: FSMContext, reminder: str | None
     await state.clear()
     # Show daily card
     quest = await db.get_quest(user_id, quest_id)
-    tz_off, _ = await db.get_user_timezone(user_id)
+    tz_off = profile.tz_offset_minutes
     text = format_quest_text(quest, tz_off)
     meta = await db.get_daily_meta(quest_id)
     repeat_days_s, streak, last_done_date, daily_reminder_time, _ = meta if meta else ("", 0, None, None, None)
@@ -327,31 +329,21 @@ async def finalize_daily_creation(event, state: FSMContext, reminder: str | None
     await send_card(text, reply_markup=kb, parse_mode="HTML")
 
 # ===== Daily actions =====
-@router.callback_query(F.data.startswith("daily_done_"))
-async def cb_daily_done(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[2])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("daily_done")
+async def cb_daily_done(callback: CallbackQuery, profile: UserProfile, quest_id: int):
     ok = await db.mark_daily_done_for_today(callback.from_user.id, quest_id)
     if not ok:
         await callback.answer("Ошибка")
         return
-    await cb_quest_detail(callback)
+    await cb_quest_detail(callback, profile, quest_id)
 
-@router.callback_query(F.data.startswith("daily_undo_"))
-async def cb_daily_undo(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[2])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("daily_undo")
+async def cb_daily_undo(callback: CallbackQuery, profile: UserProfile, quest_id: int):
     ok = await db.undo_daily_for_today(callback.from_user.id, quest_id)
     if not ok:
         await callback.answer("Ошибка")
         return
-    await cb_quest_detail(callback)
+    await cb_quest_detail(callback, profile, quest_id)
 
 def format_quest_text(quest: tuple, tz_offset_minutes: int | None = None) -> str:
     """Форматирование текста квеста с учетом наличия даты/времени"""
@@ -408,29 +400,19 @@ def format_quest_text(quest: tuple, tz_offset_minutes: int | None = None) -> str
     
     return text
 
-@router.callback_query(F.data.startswith("complete_"))
-async def cb_complete(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[1])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("complete")
+async def cb_complete(callback: CallbackQuery, profile: UserProfile, quest_id: int):
     user_id = callback.from_user.id
     quest = await db.complete_quest(user_id, quest_id)
     if quest:
         await callback.answer("🎉 Готово")
-        await cb_quest_detail(callback)
+        await cb_quest_detail(callback, profile, quest_id)
     else:
         await callback.answer("Ошибка завершения")
 
 
-@router.callback_query(F.data.startswith("delete_"))
-async def cb_delete_quest(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[1])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("delete")
+async def cb_delete_quest(callback: CallbackQuery, quest_id: int):
     user_id = callback.from_user.id
     ok = await db.delete_quest(user_id, quest_id)
     if ok:
@@ -438,7 +420,7 @@ async def cb_delete_quest(callback: CallbackQuery):
         # Обновляем список квестов
         quests = await db.get_user_quests(user_id)
         if not quests:
-            keyboard = [[InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_menu")]]
+            keyboard = [[InlineKeyboardButton(text="🔙 Назад", callback_data=pack("back_to_menu"))]]
             await callback.message.edit_text("📋 У тебя пока нет активных квестов!", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
         else:
             keyboard = []
@@ -448,42 +430,36 @@ async def cb_delete_quest(callback: CallbackQuery):
                 q_type = quest[3]
                 status_emoji = compute_status_emoji(quest[7])
                 type_emoji = {"physical": "💪", "intellectual": "📚", "mental": "🧠", "custom": "🎯"}.get(q_type, "🎯")
-                keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=f"quest_{q_id}")])
+                keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=pack("quest", q_id))])
             await callback.message.edit_text("📋 Выбери квест:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     else:
         await callback.answer("Ошибка удаления")
 
-@router.callback_query(F.data.regexp(r"^edit_\d+$"))
-async def cb_edit_menu(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[1])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("edit")
+async def cb_edit_menu(callback: CallbackQuery, quest_id: int):
     keyboard = [
-        [InlineKeyboardButton(text="📝 Название", callback_data=f"edit_title_{quest_id}")],
-        [InlineKeyboardButton(text="🔖 Тип", callback_data=f"edit_type_menu_{quest_id}")],
-        [InlineKeyboardButton(text="🎯 Цель", callback_data=f"edit_target_{quest_id}")],
-        [InlineKeyboardButton(text="📅 Дедлайн", callback_data=f"edit_deadline_{quest_id}")],
-        [InlineKeyboardButton(text="💬 Комментарий", callback_data=f"edit_comment_{quest_id}")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data=f"quest_{quest_id}")],
+        [InlineKeyboardButton(text="📝 Название", callback_data=pack("edit_title", quest_id))],
+        [InlineKeyboardButton(text="🔖 Тип", callback_data=pack("edit_type_menu", quest_id))],
+        [InlineKeyboardButton(text="🎯 Цель", callback_data=pack("edit_target", quest_id))],
+        [InlineKeyboardButton(text="📅 Дедлайн", callback_data=pack("edit_deadline", quest_id))],
+        [InlineKeyboardButton(text="💬 Комментарий", callback_data=pack("edit_comment", quest_id))],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("quest", quest_id))],
     ]
     await callback.message.edit_text("Что изменить?", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
 
-@router.callback_query(F.data.startswith("edit_title_"))
-async def cb_edit_title(callback: CallbackQuery, state: FSMContext):
-    quest_id = int(callback.data.split("_")[2])
+@callback_router.action("edit_title")
+async def cb_edit_title(callback: CallbackQuery, state: FSMContext, quest_id: int):
     await state.set_state(QuestEdit.waiting_for_title)
     await state.update_data(edit_quest_id=quest_id)
     # Сохраняем исходное сообщение для обновления карточки
     await state.update_data(orig_chat_id=callback.message.chat.id, orig_message_id=callback.message.message_id)
-    keyboard = [[InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")]]
+    keyboard = [[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))]]
     await callback.message.edit_text("Введи новое название:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
 
 @router.message(QuestEdit.waiting_for_title)
-async def process_edit_title(message: Message, state: FSMContext):
+async def process_edit_title(message: Message, state: FSMContext, profile: UserProfile):
     text = message.text.strip()
     is_valid, error_msg = db.validate_input(text, "Название")
     if not is_valid:
@@ -494,7 +470,7 @@ async def process_edit_title(message: Message, state: FSMContext):
     _, error = await db.update_quest(message.from_user.id, quest_id, title=text)
     # Обновляем карточку квеста
     data_after = await db.get_quest(message.from_user.id, quest_id)
-    tz_off, _ = await db.get_user_timezone(message.from_user.id)
+    tz_off = profile.tz_offset_minutes
     if data_after:
         txt = format_quest_text(data_after, tz_off)
         completed = bool(data_after[6])
@@ -516,9 +492,8 @@ async def process_edit_title(message: Message, state: FSMContext):
     else:
         await message.answer("✅ Название обновлено", reply_markup=get_quests_menu_keyboard())
 
-@router.callback_query(F.data.startswith("edit_target_"))
-async def cb_edit_target(callback: CallbackQuery, state: FSMContext):
-    quest_id = int(callback.data.split("_")[2])
+@callback_router.action("edit_target")
+async def cb_edit_target(callback: CallbackQuery, state: FSMContext, quest_id: int):
     user_id = callback.from_user.id
     quest = await db.get_quest(user_id, quest_id)
     if not quest:
@@ -529,26 +504,26 @@ async def cb_edit_target(callback: CallbackQuery, state: FSMContext):
     await state.update_data(orig_chat_id=callback.message.chat.id, orig_message_id=callback.message.message_id)
     if q_type == "physical":
         await state.set_state(QuestCreation.waiting_for_reps)
-        await callback.message.edit_text("Введи количество повторений в одном подходе (число):", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")]]))
+        await callback.message.edit_text("Введи количество повторений в одном подходе (число):", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))]]))
     elif q_type == "intellectual":
         await state.set_state(QuestCreation.waiting_for_pages)
-        await callback.message.edit_text("Введи количество страниц (число):", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")]]))
+        await callback.message.edit_text("Введи количество страниц (число):", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))]]))
     elif q_type == "mental":
         await state.set_state(QuestCreation.waiting_for_minutes)
-        await callback.message.edit_text("Сколько минут? (число):", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")]]))
+        await callback.message.edit_text("Сколько минут? (число):", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))]]))
     else:
         # custom: спросим, есть ли прогресс (0% или 100%)
         await state.set_state(QuestCreation.waiting_for_progress)
         text = "У квеста есть прогресс?"
         keyboard = [[
-            InlineKeyboardButton(text="Да", callback_data="custom_progress_yes"),
-            InlineKeyboardButton(text="Нет", callback_data="custom_progress_no")
-        ], [InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")]]
+            InlineKeyboardButton(text="Да", callback_data=pack("custom_progress", 1)),
+            InlineKeyboardButton(text="Нет", callback_data=pack("custom_progress", 0))
+        ], [InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))]]
         await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
 
 @router.message(QuestEdit.waiting_for_target)
-async def process_edit_target(message: Message, state: FSMContext):
+async def process_edit_target(message: Message, state: FSMContext, profile: UserProfile):
     if not message.text.isdigit():
         await message.answer("❌ Введи число")
         return
@@ -561,7 +536,7 @@ async def process_edit_target(message: Message, state: FSMContext):
     _, error = await db.update_quest(message.from_user.id, quest_id, target_value=value)
     # Обновляем карточку квеста
     data_after = await db.get_quest(message.from_user.id, quest_id)
-    tz_off, _ = await db.get_user_timezone(message.from_user.id)
+    tz_off = profile.tz_offset_minutes
     if data_after:
         txt = format_quest_text(data_after, tz_off)
         completed = bool(data_after[6])
@@ -583,23 +558,22 @@ async def process_edit_target(message: Message, state: FSMContext):
     else:
         await message.answer("✅ Цель обновлена", reply_markup=get_quests_menu_keyboard())
 
-@router.callback_query(F.data.startswith("edit_deadline_"))
-async def cb_edit_deadline(callback: CallbackQuery, state: FSMContext):
-    quest_id = int(callback.data.split("_")[2])
+@callback_router.action("edit_deadline")
+async def cb_edit_deadline(callback: CallbackQuery, state: FSMContext, quest_id: int):
     # Входим в те же шаги FSM, что и при создании дедлайна
     await state.set_state(QuestCreation.waiting_for_deadline_input)
     await state.update_data(edit_quest_id=quest_id, _editing_deadline=True)
     await state.update_data(orig_chat_id=callback.message.chat.id, orig_message_id=callback.message.message_id)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="сегодня", callback_data="deadline_today")],
-        [InlineKeyboardButton(text="пропустить", callback_data="deadline_skip_all")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")],
+        [InlineKeyboardButton(text="сегодня", callback_data=pack("deadline_today"))],
+        [InlineKeyboardButton(text="пропустить", callback_data=pack("deadline_skip_all"))],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))],
     ])
     await callback.message.edit_text("Укажи дедлайн в формате dd.mm.yy hh:mm или выбери кнопку ниже", reply_markup=kb)
     await callback.answer()
 
 @router.message(QuestCreation.waiting_for_deadline_input)
-async def process_deadline_input(message: Message, state: FSMContext):
+async def process_deadline_input(message: Message, state: FSMContext, profile: UserProfile):
     text = (message.text or "").strip()
     parts = text.split()
     if len(parts) not in (1, 2):
@@ -619,7 +593,7 @@ async def process_deadline_input(message: Message, state: FSMContext):
         except Exception:
             await message.answer("Некорректное время. Формат: hh:mm")
             return
-    tz_off, _ = await db.get_user_timezone(message.from_user.id)
+    tz_off = profile.tz_offset_minutes
     h = hh if hh is not None else 0
     m = mm if mm is not None else 0
     dt_local = datetime(local_date.year, local_date.month, local_date.day, h, m, 0)
@@ -637,7 +611,7 @@ async def process_deadline_input(message: Message, state: FSMContext):
         quest_id = data.get("edit_quest_id")
         _, error = await db.update_quest(message.from_user.id, quest_id, deadline=dt_utc_str)
         quest = await db.get_quest(message.from_user.id, quest_id)
-        tz_off2, _ = await db.get_user_timezone(message.from_user.id)
+        tz_off2 = profile.tz_offset_minutes
         if quest:
             txt_card = format_quest_text(quest, tz_off2)
             completed = bool(quest[6])
@@ -661,38 +635,34 @@ async def process_deadline_input(message: Message, state: FSMContext):
         return
     # Режим создания: продолжаем как раньше
     await state.set_state(QuestCreation.waiting_for_comment)
-    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data="skip_comment")]]
+    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data=pack("skip_comment"))]]
     await message.answer("Добавьте комментарий (введите текст сообщением)", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
 
-@router.callback_query(F.data.startswith("edit_type_menu_"))
-async def cb_edit_type_menu(callback: CallbackQuery):
-    quest_id = int(callback.data.split("_")[3])
+@callback_router.action("edit_type_menu")
+async def cb_edit_type_menu(callback: CallbackQuery, quest_id: int):
     keyboard = [
-        [InlineKeyboardButton(text="💪 Физические", callback_data=f"edit_type_physical_{quest_id}")],
-        [InlineKeyboardButton(text="📚 Чтение", callback_data=f"edit_type_intellectual_{quest_id}")],
-        [InlineKeyboardButton(text="🧠 Медитация", callback_data=f"edit_type_mental_{quest_id}")],
-        [InlineKeyboardButton(text="🎯 Произвольный", callback_data=f"edit_type_custom_{quest_id}")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data=f"edit_{quest_id}")],
+        [InlineKeyboardButton(text="💪 Физические", callback_data=pack("edit_type", QUEST_TYPES.index("physical"), quest_id))],
+        [InlineKeyboardButton(text="📚 Чтение", callback_data=pack("edit_type", QUEST_TYPES.index("intellectual"), quest_id))],
+        [InlineKeyboardButton(text="🧠 Медитация", callback_data=pack("edit_type", QUEST_TYPES.index("mental"), quest_id))],
+        [InlineKeyboardButton(text="🎯 Произвольный", callback_data=pack("edit_type", QUEST_TYPES.index("custom"), quest_id))],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("edit", quest_id))],
     ]
     await callback.message.edit_text("Выбери тип:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
 
-@router.callback_query(F.data.startswith("edit_type_"))
-async def cb_edit_type(callback: CallbackQuery, state: FSMContext):
-    # Формат: edit_type_{type}_{id}
-    parts = callback.data.split("_")
-    if len(parts) < 4 or parts[2] not in {"physical", "intellectual", "mental", "custom"}:
+@callback_router.action("edit_type")
+async def cb_edit_type(callback: CallbackQuery, state: FSMContext, profile: UserProfile, type_idx: int, quest_id: int):
+    if not 0 <= type_idx < len(QUEST_TYPES):
         await callback.answer("Некорректный тип")
         return
-    quest_type = parts[2]
-    quest_id = int(parts[3])
+    quest_type = QUEST_TYPES[type_idx]
     user_id = callback.from_user.id
     # Сохраняем orig ids, чтобы обновить карточку после изменения
     await state.update_data(orig_chat_id=callback.message.chat.id, orig_message_id=callback.message.message_id)
     _, error = await db.update_quest(user_id, quest_id, quest_type=quest_type)
     # Обновляем карточку
     quest = await db.get_quest(user_id, quest_id)
-    tz_off, _ = await db.get_user_timezone(user_id)
+    tz_off = profile.tz_offset_minutes
     if quest:
         txt = format_quest_text(quest, tz_off)
         completed = bool(quest[6])
@@ -708,18 +678,17 @@ async def cb_edit_type(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("✅ Тип обновлён")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("edit_comment_"))
-async def cb_edit_comment(callback: CallbackQuery, state: FSMContext):
-    quest_id = int(callback.data.split("_")[2])
+@callback_router.action("edit_comment")
+async def cb_edit_comment(callback: CallbackQuery, state: FSMContext, quest_id: int):
     await state.set_state(QuestEdit.waiting_for_comment)
     await state.update_data(edit_quest_id=quest_id)
     await state.update_data(orig_chat_id=callback.message.chat.id, orig_message_id=callback.message.message_id)
-    keyboard = [[InlineKeyboardButton(text="❌ Отмена", callback_data=f"quest_{quest_id}")]]
+    keyboard = [[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("quest", quest_id))]]
     await callback.message.edit_text("Введи новый комментарий или 'нет':", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
 
 @router.message(QuestEdit.waiting_for_comment)
-async def process_edit_comment(message: Message, state: FSMContext):
+async def process_edit_comment(message: Message, state: FSMContext, profile: UserProfile):
     text = message.text.strip()
     comment = None if text.lower() in ["нет", "no", "skip"] else text
     if comment:
@@ -732,7 +701,7 @@ async def process_edit_comment(message: Message, state: FSMContext):
     _, error = await db.update_quest(message.from_user.id, quest_id, comment=comment)
     # Обновляем карточку квеста
     data_after = await db.get_quest(message.from_user.id, quest_id)
-    tz_off, _ = await db.get_user_timezone(message.from_user.id)
+    tz_off = profile.tz_offset_minutes
     if data_after:
         txt = format_quest_text(data_after, tz_off)
         completed = bool(data_after[6])
@@ -754,43 +723,43 @@ async def process_edit_comment(message: Message, state: FSMContext):
     else:
         await message.answer("✅ Комментарий обновлён", reply_markup=get_quests_menu_keyboard())
 
-@router.callback_query(F.data == "back_to_menu")
+@callback_router.action("back_to_menu")
 async def cb_back_to_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text(
         "Главное меню\n\nВыбери действие:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📋 Квесты", callback_data="my_quests_inline")], [InlineKeyboardButton(text="📝 Списки", callback_data="lists_menu")]])
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📋 Квесты", callback_data=pack("my_quests_inline"))], [InlineKeyboardButton(text="📝 Списки", callback_data=pack("lists_menu"))]])
     )
     await callback.answer()
 
-@router.callback_query(F.data == "main_menu")
+@callback_router.action("main_menu")
 async def cb_main_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text(
         "Главное меню\n\nВыбери действие:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📋 Квесты", callback_data="my_quests_inline")], [InlineKeyboardButton(text="📝 Списки", callback_data="lists_menu")]])
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📋 Квесты", callback_data=pack("my_quests_inline"))], [InlineKeyboardButton(text="📝 Списки", callback_data=pack("lists_menu"))]])
     )
     await callback.answer()
 
-@router.callback_query(F.data == "create_quest_inline")
+@callback_router.action("create_quest_inline")
 async def cb_create_quest_inline(callback: CallbackQuery, state: FSMContext):
     await state.set_state(QuestCreation.waiting_for_mode)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎯 Обычный квест", callback_data="mode_regular")],
-        [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data="mode_daily")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")],
+        [InlineKeyboardButton(text="🎯 Обычный квест", callback_data=pack("mode_regular"))],
+        [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data=pack("mode_daily"))],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("main_menu"))],
     ])
     await callback.message.answer("Выберите режим:", reply_markup=kb)
     await callback.answer()
 
-@router.callback_query(F.data == "mode_regular")
+@callback_router.action("mode_regular")
 async def cb_mode_regular(callback: CallbackQuery, state: FSMContext):
     await state.update_data(is_daily=False)
     await state.set_state(QuestCreation.waiting_for_type)
     await callback.message.answer("Выбери тип квеста:", reply_markup=get_quest_type_keyboard())
     await callback.answer()
 
-@router.callback_query(F.data == "mode_daily")
+@callback_router.action("mode_daily")
 async def cb_mode_daily(callback: CallbackQuery, state: FSMContext):
     await state.update_data(is_daily=True)
     await state.set_state(QuestCreation.waiting_for_type)
@@ -803,11 +772,7 @@ async def cb_mode_daily(callback: CallbackQuery, state: FSMContext):
 
 @router.message(F.text == "🤖 AI Квест")
 async def callback_ai_quest_message(message: Message, state: FSMContext):
-    """AI генерация квеста"""
-    if not config.WINDSURF_API_KEY:
-        await message.answer("⚠️ AI функция недоступна")
-        return
-    
+    """AI генерация квеста (без ключа AI — локальный подбор по шаблонам)"""
     await state.set_state(AIQuest.waiting_for_goal)
     text = """
 🤖 <b>AI Генератор Квестов</b>
@@ -824,19 +789,75 @@ async def callback_ai_quest_message(message: Message, state: FSMContext):
     await message.answer(text, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
 
 
+class AIQuestPreview:
+    """Промежуточный вывод генерации: правка сообщения-заглушки не чаще раза в interval секунд"""
+
+    def __init__(self, placeholder: Message, interval: float | None = None):
+        self.placeholder = placeholder
+        self.interval = config.AI_STREAM_EDIT_INTERVAL if interval is None else interval
+        self.text = placeholder.text or ""
+        self.edited_at = 0.0
+        self.closed = False
+
+    @staticmethod
+    def render(fields: dict) -> str:
+        """Текст черновика квеста из уже полученных полей"""
+        lines = ["🤖 Генерирую квест..."]
+        if fields.get("title"):
+            lines.append(f"\n📝 {fields['title']}")
+        if fields.get("description"):
+            lines.append(f"\n💡 {fields['description']}")
+        tips = [tip for tip in fields.get("tips") or [] if isinstance(tip, str) and tip]
+        if tips:
+            lines.append("")
+            lines.extend(f"• {tip}" for tip in tips[:3])
+        return "\n".join(lines)
+
+    async def update(self, fields: dict) -> None:
+        """Callback on_progress для ai_client.generate_quest"""
+        if self.closed:
+            return
+        text = self.render(fields)
+        now = time.monotonic()
+        if text == self.text or now - self.edited_at < self.interval:
+            return
+        self.text = text
+        self.edited_at = now
+        try:
+            await self.placeholder.edit_text(text)
+        except Exception as e:
+            logger.debug(f"AI preview edit failed: {e}")
+
+    async def remove(self) -> None:
+        """Убрать заглушку перед финальным сообщением"""
+        # Генерация может продолжаться в фоне после истечения бюджета ожидания
+        self.closed = True
+        try:
+            await self.placeholder.delete()
+        except Exception:
+            pass
+
+
 @router.message(AIQuest.waiting_for_goal)
 async def process_ai_goal(message: Message, state: FSMContext):
     """Обработка цели для AI"""
     goal = message.text.strip()
     
-    await message.answer("🤖 Генерирую квест... Подожди немного...")
-    
-    quest_data = await ai_client.generate_quest(goal)
+    quest_data = None
+    # Без ключа или при перегрузке AI — сразу локальный квест; исчерпанная квота (кроме ответа из кэша) — тоже
+    if config.WINDSURF_API_KEY and not ai_client.retry_after():
+        placeholder = await message.answer("🤖 Генерирую квест... Подожди немного...")
+        preview = AIQuestPreview(placeholder)
+        
+        # Поля квеста появляются в заглушке по мере генерации (если включён AI_STREAM)
+        quest_data = await ai_client.generate_quest_within(
+            goal, config.AI_LATENCY_BUDGET_SECONDS, on_progress=preview.update, user_id=message.from_user.id
+        )
+        await preview.remove()
     
-    if not quest_data:
-        await message.answer("❌ Не удалось сгенерировать квест. Попробуй позже или создай квест вручную.")
-        await state.clear()
-        return
+    generated_locally = not quest_data
+    if generated_locally:
+        quest_data = local_quests.generate(goal)
     
     # Создаем квест из данных AI
     quest_id, error = await db.create_quest(
@@ -859,21 +880,24 @@ async def process_ai_goal(message: Message, state: FSMContext):
             for tip in quest_data["tips"][:3]:
                 response += f"• {tip}\n"
         
+        if generated_locally:
+            response += "\n<i>⚡ Квест подобран без AI по ключевым словам цели</i>"
+        
         await message.answer(response, reply_markup=get_quests_menu_keyboard(), parse_mode="HTML")
     
     await state.clear()
 
 
-@router.callback_query(F.data == "stats")
+@callback_router.action("stats")
 async def callback_stats(callback: CallbackQuery):
     """Статистика"""
     text = "📊 <b>Статистика</b>\n\nРаздел в разработке 🚧"
-    keyboard = [[InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]]
+    keyboard = [[InlineKeyboardButton(text="🔙 Главное меню", callback_data=pack("main_menu"))]]
     await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
     await callback.answer()
 
 
-@router.callback_query(F.data == "help")
+@callback_router.action("help")
 async def callback_help(callback: CallbackQuery):
     """Помощь"""
     text = """
@@ -892,12 +916,12 @@ async def callback_help(callback: CallbackQuery):
 🧠 Ментальные
 🎯 Произвольные
     """
-    keyboard = [[InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]]
+    keyboard = [[InlineKeyboardButton(text="🔙 Главное меню", callback_data=pack("main_menu"))]]
     await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
     await callback.answer()
 
 
-@router.callback_query(F.data == "cancel")
+@callback_router.action("cancel")
 async def callback_cancel(callback: CallbackQuery, state: FSMContext):
     """Отмена действия"""
     await state.clear()
@@ -905,17 +929,12 @@ async def callback_cancel(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "Главное меню\n\nВыбери действие:",
         reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="📋 Квесты", callback_data="my_quests_inline")], [InlineKeyboardButton(text="📝 Списки", callback_data="lists_menu")]]
+            inline_keyboard=[[InlineKeyboardButton(text="📋 Квесты", callback_data=pack("my_quests_inline"))], [InlineKeyboardButton(text="📝 Списки", callback_data=pack("lists_menu"))]]
         )
     )
 
-@router.callback_query(F.data.startswith("meditate_"))
-async def callback_meditate(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[1])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("meditate")
+async def callback_meditate(callback: CallbackQuery, quest_id: int):
     user_id = callback.from_user.id
     quest = await db.get_quest(user_id, quest_id)
     if not quest:
@@ -925,7 +944,7 @@ async def callback_meditate(callback: CallbackQuery):
     await callback.answer("Таймер запущен")
     # Сообщение с кнопкой отмены медитации
     cancel_kb = InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=f"cancel_meditation_{quest_id}")]]
+        inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("cancel_meditation", quest_id))]]
     )
     await callback.message.answer(f"🧘 Медитация начата на {minutes} мин.", reply_markup=cancel_kb)
     # Запускаем таймер и сохраняем сессию
@@ -953,7 +972,7 @@ async def callback_meditate(callback: CallbackQuery):
                 q_type2 = q[3]
                 status_emoji = compute_status_emoji(q[7])
                 type_emoji = {"physical": "💪", "intellectual": "📚", "mental": "🧠", "custom": "🎯"}.get(q_type2, "🎯")
-                keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title2}", callback_data=f"quest_{q_id2}")])
+                keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title2}", callback_data=pack("quest", q_id2))])
             await callback.message.bot.send_message(chat_id, "📋 Выбери квест:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
 
         task = asyncio.create_task(_timer(callback.message.chat.id, minutes, user_id, quest_id))
@@ -984,38 +1003,38 @@ def build_list_keyboard(list_id: int, items: list[tuple], owner_view: bool = Tru
         chk = "☑️" if bool(completed) else "⬜"
         if owner_view:
             rows.append([
-                InlineKeyboardButton(text=f"{chk}", callback_data=f"toggle_item_{item_id}_{list_id}"),
-                InlineKeyboardButton(text="🗑", callback_data=f"del_item_{item_id}_{list_id}"),
-                InlineKeyboardButton(text=text[:24] + ("…" if len(text) > 24 else ""), callback_data=f"noop_{item_id}")
+                InlineKeyboardButton(text=f"{chk}", callback_data=pack("toggle_item", item_id, list_id)),
+                InlineKeyboardButton(text="🗑", callback_data=pack("del_item", item_id, list_id)),
+                InlineKeyboardButton(text=text[:24] + ("…" if len(text) > 24 else ""), callback_data=pack("noop"))
             ])
         else:
-            rows.append([InlineKeyboardButton(text=f"{chk} {text}", callback_data=f"noop_{item_id}")])
+            rows.append([InlineKeyboardButton(text=f"{chk} {text}", callback_data=pack("noop"))])
     # Actions
     if owner_view:
-        rows.append([InlineKeyboardButton(text="➕ Добавить", callback_data=f"add_item_{list_id}")])
-        rows.append([InlineKeyboardButton(text="🗑 Удалить список", callback_data=f"delete_list_{list_id}")])
-    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="lists_menu")])
+        rows.append([InlineKeyboardButton(text="➕ Добавить", callback_data=pack("add_item", list_id))])
+        rows.append([InlineKeyboardButton(text="🗑 Удалить список", callback_data=pack("delete_list", list_id))])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=pack("lists_menu"))])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-@router.callback_query(F.data == "lists_menu")
+@callback_router.action("lists_menu")
 async def cb_lists_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📂 Мои списки", callback_data="my_lists")],
-        [InlineKeyboardButton(text="🆕 Создать список", callback_data="create_list_inline")],
-        [InlineKeyboardButton(text="📑 Шаблоны", callback_data="list_templates")],
-        [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")],
+        [InlineKeyboardButton(text="📂 Мои списки", callback_data=pack("my_lists"))],
+        [InlineKeyboardButton(text="🆕 Создать список", callback_data=pack("create_list_inline"))],
+        [InlineKeyboardButton(text="📑 Шаблоны", callback_data=pack("list_templates"))],
+        [InlineKeyboardButton(text="🔙 Главное меню", callback_data=pack("main_menu"))],
     ])
     await callback.message.edit_text("📝 Списки — выбери действие:", reply_markup=kb)
     await callback.answer()
 
-@router.callback_query(F.data == "my_lists")
+@callback_router.action("my_lists")
 async def cb_my_lists(callback: CallbackQuery):
     lists = await db.get_user_lists(callback.from_user.id)
     if not lists:
         kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🆕 Создать список", callback_data="create_list_inline")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="lists_menu")],
+            [InlineKeyboardButton(text="🆕 Создать список", callback_data=pack("create_list_inline"))],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("lists_menu"))],
         ])
         await callback.message.edit_text("У тебя пока нет списков.", reply_markup=kb)
         await callback.answer()
@@ -1023,31 +1042,31 @@ async def cb_my_lists(callback: CallbackQuery):
     rows = []
     for l in lists:
         lid, _, title, _, _ = l
-        rows.append([InlineKeyboardButton(text=f"📝 {title}", callback_data=f"list_{lid}")])
-    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="lists_menu")])
+        rows.append([InlineKeyboardButton(text=f"📝 {title}", callback_data=pack("list", lid))])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=pack("lists_menu"))])
     await callback.message.edit_text("📂 Мои списки:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
     await callback.answer()
 
-@router.callback_query(F.data == "list_templates")
+@callback_router.action("list_templates")
 async def cb_list_templates(callback: CallbackQuery):
     templates = await db.get_templates()
     if not templates:
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад", callback_data="lists_menu")]])
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад", callback_data=pack("lists_menu"))]])
         await callback.message.edit_text("Шаблоны отсутствуют.", reply_markup=kb)
         await callback.answer()
         return
     rows = []
     for l in templates:
         lid, _, title, _, _ = l
-        rows.append([InlineKeyboardButton(text=f"📑 {title}", callback_data=f"list_{lid}")])
-    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="lists_menu")])
+        rows.append([InlineKeyboardButton(text=f"📑 {title}", callback_data=pack("list", lid))])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=pack("lists_menu"))])
     await callback.message.edit_text("📑 Шаблоны:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
     await callback.answer()
 
-@router.callback_query(F.data == "create_list_inline")
+@callback_router.action("create_list_inline")
 async def cb_create_list_inline(callback: CallbackQuery, state: FSMContext):
     await state.set_state(ListCreation.waiting_for_title)
-    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data="lists_menu")]])
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("lists_menu"))]])
     await callback.message.edit_text("Введи название списка:", reply_markup=kb)
     await callback.answer()
 
@@ -1066,13 +1085,8 @@ async def process_list_title(message: Message, state: FSMContext):
     kb = build_list_keyboard(list_id, items, owner_view=True)
     await message.answer(text, reply_markup=kb, parse_mode="HTML")
 
-@router.callback_query(F.data.startswith("list_"))
-async def cb_open_list(callback: CallbackQuery):
-    try:
-        list_id = int(callback.data.split("_")[1])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("list")
+async def cb_open_list(callback: CallbackQuery, list_id: int):
     lst = await db.get_list(callback.from_user.id, list_id)
     if not lst:
         await callback.answer("Список не найден")
@@ -1084,13 +1098,8 @@ async def cb_open_list(callback: CallbackQuery):
     await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("add_item_"))
-async def cb_add_item(callback: CallbackQuery, state: FSMContext):
-    try:
-        list_id = int(callback.data.split("_")[2])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("add_item")
+async def cb_add_item(callback: CallbackQuery, state: FSMContext, list_id: int):
     # Проверим доступ
     lst = await db.get_list(callback.from_user.id, list_id)
     if not lst or lst[1] != callback.from_user.id:
@@ -1098,7 +1107,7 @@ async def cb_add_item(callback: CallbackQuery, state: FSMContext):
         return
     await state.set_state(ListItemAdd.waiting_for_text)
     await state.update_data(list_id=list_id, orig_chat_id=callback.message.chat.id, orig_message_id=callback.message.message_id)
-    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=f"list_{list_id}")]])
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data=pack("list", list_id))]])
     await callback.message.answer("Введи текст элемента:", reply_markup=kb)
     await callback.answer()
 
@@ -1129,15 +1138,8 @@ async def process_add_item(message: Message, state: FSMContext):
     else:
         await message.answer("✅ Элемент добавлен", reply_markup=get_quests_menu_keyboard())
 
-@router.callback_query(F.data.startswith("toggle_item_"))
-async def cb_toggle_item(callback: CallbackQuery):
-    try:
-        _, _, item_id_str, list_id_str = callback.data.split("_", 3)
-        item_id = int(item_id_str)
-        list_id = int(list_id_str)
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("toggle_item")
+async def cb_toggle_item(callback: CallbackQuery, item_id: int, list_id: int):
     ok = await db.toggle_list_item(callback.from_user.id, item_id)
     if not ok:
         await callback.answer("Ошибка")
@@ -1153,15 +1155,8 @@ async def cb_toggle_item(callback: CallbackQuery):
         pass
     await callback.answer()
 
-@router.callback_query(F.data.startswith("del_item_"))
-async def cb_del_item(callback: CallbackQuery):
-    try:
-        _, _, item_id_str, list_id_str = callback.data.split("_", 3)
-        item_id = int(item_id_str)
-        list_id = int(list_id_str)
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("del_item")
+async def cb_del_item(callback: CallbackQuery, item_id: int, list_id: int):
     ok = await db.delete_list_item(callback.from_user.id, item_id)
     if not ok:
         await callback.answer("Ошибка удаления")
@@ -1176,13 +1171,8 @@ async def cb_del_item(callback: CallbackQuery):
         pass
     await callback.answer("🗑 Удалено")
 
-@router.callback_query(F.data.startswith("delete_list_"))
-async def cb_delete_list(callback: CallbackQuery):
-    try:
-        list_id = int(callback.data.split("_")[2])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("delete_list")
+async def cb_delete_list(callback: CallbackQuery, list_id: int):
     ok = await db.delete_list(callback.from_user.id, list_id)
     if not ok:
         await callback.answer("Ошибка удаления")
@@ -1190,22 +1180,23 @@ async def cb_delete_list(callback: CallbackQuery):
     # Показать мои списки
     await cb_my_lists(callback)
 
-@router.callback_query(F.data.startswith("share_list_"))
+@callback_router.action("noop")
+async def cb_noop(callback: CallbackQuery):
+    """Кнопки-подписи (пункты списка, заголовки разделов): ничего не делают"""
+    await callback.answer()
+
+
+@callback_router.action("share_list")
 async def cb_share_list(callback: CallbackQuery):
     await callback.answer("Функция временно недоступна")
     return
 
-@router.callback_query(F.data.startswith("copy_list_"))
+@callback_router.action("copy_list")
 async def cb_copy_list(callback: CallbackQuery):
     await callback.answer("Функция временно недоступна")
     return
-@router.callback_query(F.data.startswith("cancel_meditation_"))
-async def cancel_meditation(callback: CallbackQuery):
-    try:
-        quest_id = int(callback.data.split("_")[2])
-    except Exception:
-        await callback.answer("Ошибка ID")
-        return
+@callback_router.action("cancel_meditation")
+async def cancel_meditation(callback: CallbackQuery, profile: UserProfile, quest_id: int):
     user_id = callback.from_user.id
     sess = MEDITATION_SESSIONS.pop((user_id, quest_id), None)
     elapsed_minutes = 0
@@ -1235,7 +1226,7 @@ async def cancel_meditation(callback: CallbackQuery):
     # Вернёмся на форму квеста
     quest = await db.get_quest(user_id, quest_id)
     if quest:
-        tz_off, _ = await db.get_user_timezone(user_id)
+        tz_off = profile.tz_offset_minutes
         text = format_quest_text(quest, tz_off)
         completed = bool(quest[6])
         quest_type = quest[3]
@@ -1256,7 +1247,6 @@ async def cancel_creation(message: Message, state: FSMContext):
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
     user = message.from_user
-    await db.add_user(user.id, user.first_name or user.username or "User")
     welcome_text = (
         f"Привет, {user.first_name}! 🚀\n\n"
         "Я — твой проводник на пути к Сверхчеловеку.\n"
@@ -1268,9 +1258,19 @@ async def cmd_start(message: Message, state: FSMContext):
 
 @router.message(Command("logs_on"))
 async def cmd_logs_on(message: Message):
-    await db.add_user(message.from_user.id, message.from_user.first_name or message.from_user.username or "User")
-    await db.set_log_subscription(message.from_user.id, True)
-    await message.answer("📡 RT-логи включены для этого чата")
+    """/logs_on [LEVEL] [module] — минимальный уровень и фильтр по модулю (префикс имени)"""
+    level, module = "INFO", None
+    for arg in (message.text or "").split()[1:]:
+        if arg.upper() in LOG_LEVELS:
+            level = arg.upper()
+        else:
+            module = arg
+    await db.set_log_subscription(message.from_user.id, True, level, module)
+    await message.answer(
+        f"📡 RT-логи включены для этого чата\n"
+        f"Уровень: {level} и выше, модуль: {module or 'все'}\n"
+        f"Пример: /logs_on WARNING reminder"
+    )
 
 
 @router.message(Command("logs_off"))
@@ -1279,6 +1279,14 @@ async def cmd_logs_off(message: Message):
     await message.answer("🛰 RT-логи выключены для этого чата")
 
 
+@router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    """/metrics — время, обращения к базе и API по обработчикам (только ADMIN_IDS)"""
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    await message.answer(f"<pre>{html.escape(handler_report())}</pre>", parse_mode="HTML")
+
+
 @router.message((F.text == "📋 Квесты") | (F.text.casefold() == "квесты"))
 async def show_my_quests(message: Message, state: FSMContext):
     try:
@@ -1297,7 +1305,7 @@ async def show_my_quests(message: Message, state: FSMContext):
         q_type = quest[3]
         status_emoji = compute_status_emoji(quest[7])
         type_emoji = {"physical": "💪", "intellectual": "📚", "mental": "🧠", "custom": "🎯"}.get(q_type, "🎯")
-        keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=f"quest_{q_id}")])
+        keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=pack("quest", q_id))])
     await message.answer("📋 Выбери квест:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
 
 
@@ -1308,31 +1316,30 @@ async def open_lists_menu(message: Message, state: FSMContext):
     except Exception:
         pass
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📂 Мои списки", callback_data="my_lists")],
-        [InlineKeyboardButton(text="🆕 Создать список", callback_data="create_list_inline")],
-        [InlineKeyboardButton(text="📑 Шаблоны", callback_data="list_templates")],
-        [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")],
+        [InlineKeyboardButton(text="📂 Мои списки", callback_data=pack("my_lists"))],
+        [InlineKeyboardButton(text="🆕 Создать список", callback_data=pack("create_list_inline"))],
+        [InlineKeyboardButton(text="📑 Шаблоны", callback_data=pack("list_templates"))],
+        [InlineKeyboardButton(text="🔙 Главное меню", callback_data=pack("main_menu"))],
     ])
     await message.answer("📝 Списки — выбери действие:", reply_markup=kb)
 
 
 @router.message(F.text == "➕ Создать квест")
-async def create_quest_menu(message: Message, state: FSMContext):
+async def create_quest_menu(message: Message, state: FSMContext, profile: UserProfile):
     # Один раз предложим установить TZ, если ещё не предлагали
-    tz_off, prompted = await db.get_user_timezone(message.from_user.id)
-    if not prompted:
+    if not profile.tz_prompted:
         kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Установить сейчас", callback_data="tz_setup_now")],
-            [InlineKeyboardButton(text="Пропустить", callback_data="tz_setup_skip")],
+            [InlineKeyboardButton(text="Установить сейчас", callback_data=pack("tz_setup_now"))],
+            [InlineKeyboardButton(text="Пропустить", callback_data=pack("tz_setup_skip"))],
         ])
         await state.update_data(_pending_creation_after_tz=True)
         await message.answer("Для точного дедлайна укажи свой часовой пояс. Сделать сейчас?", reply_markup=kb)
         return
     await state.set_state(QuestCreation.waiting_for_mode)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎯 Обычный квест", callback_data="mode_regular")],
-        [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data="mode_daily")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")],
+        [InlineKeyboardButton(text="🎯 Обычный квест", callback_data=pack("mode_regular"))],
+        [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data=pack("mode_daily"))],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("main_menu"))],
     ])
     await message.answer("Выберите режим:", reply_markup=kb)
 
@@ -1345,13 +1352,13 @@ async def cmd_set_timezone(message: Message, state: FSMContext):
     await state.set_state(TimezoneSetup.waiting_for_local_time)
     await message.answer("Отправьте ваше текущее локальное время в формате HH:MM")
 
-@router.callback_query(F.data == "tz_setup_now")
+@callback_router.action("tz_setup_now")
 async def cb_tz_setup_now(callback: CallbackQuery, state: FSMContext):
     await state.set_state(TimezoneSetup.waiting_for_local_time)
     await callback.message.answer("Отправьте ваше текущее локальное время в формате HH:MM")
     await callback.answer()
 
-@router.callback_query(F.data == "tz_setup_skip")
+@callback_router.action("tz_setup_skip")
 async def cb_tz_setup_skip(callback: CallbackQuery, state: FSMContext):
     await db.set_user_tz_prompted(callback.from_user.id)
     pending = (await state.get_data()).get("_pending_creation_after_tz")
@@ -1359,9 +1366,9 @@ async def cb_tz_setup_skip(callback: CallbackQuery, state: FSMContext):
     if pending:
         await state.set_state(QuestCreation.waiting_for_mode)
         kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🎯 Обычный квест", callback_data="mode_regular")],
-            [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data="mode_daily")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")],
+            [InlineKeyboardButton(text="🎯 Обычный квест", callback_data=pack("mode_regular"))],
+            [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data=pack("mode_daily"))],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("main_menu"))],
         ])
         await callback.message.answer("Выберите режим:", reply_markup=kb)
     else:
@@ -1392,41 +1399,41 @@ async def process_local_time(message: Message, state: FSMContext):
     if pending:
         await state.set_state(QuestCreation.waiting_for_mode)
         kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🎯 Обычный квест", callback_data="mode_regular")],
-            [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data="mode_daily")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")],
+            [InlineKeyboardButton(text="🎯 Обычный квест", callback_data=pack("mode_regular"))],
+            [InlineKeyboardButton(text="📅 Ежедневная задача", callback_data=pack("mode_daily"))],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data=pack("main_menu"))],
         ])
         await message.answer("Выберите режим:", reply_markup=kb)
 
 
-@router.callback_query(F.data == "my_quests_inline")
+@callback_router.action("my_quests_inline")
 async def cb_my_quests(callback: CallbackQuery):
     user_id = callback.from_user.id
     dailies = await db.get_user_daily_quests(user_id)
     regular = await db.get_user_regular_quests(user_id)
     if not dailies and not regular:
-        keyboard = [[InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_menu")]]
+        keyboard = [[InlineKeyboardButton(text="🔙 Назад", callback_data=pack("back_to_menu"))]]
         await callback.message.edit_text("📋 У тебя пока нет активных квестов!", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
         await callback.answer()
         return
     rows = []
     if dailies:
-        rows.append([InlineKeyboardButton(text="📅 Ежедневные задачи", callback_data="noop")])
+        rows.append([InlineKeyboardButton(text="📅 Ежедневные задачи", callback_data=pack("noop"))])
         for q in dailies:
             qid, _, title, qtype = q[0], q[1], q[2], q[3]
             status = "✅" if await db.is_done_today(user_id, qid) else "⏳"
-            rows.append([InlineKeyboardButton(text=f"{status} {title}", callback_data=f"quest_{qid}")])
+            rows.append([InlineKeyboardButton(text=f"{status} {title}", callback_data=pack("quest", qid))])
     if regular:
         if dailies:
-            rows.append([InlineKeyboardButton(text="────────", callback_data="noop")])
-        rows.append([InlineKeyboardButton(text="🎯 Обычные квесты", callback_data="noop")])
+            rows.append([InlineKeyboardButton(text="────────", callback_data=pack("noop"))])
+        rows.append([InlineKeyboardButton(text="🎯 Обычные квесты", callback_data=pack("noop"))])
         for quest in regular:
             quest_id = quest[0]
             title = quest[2]
             quest_type = quest[3]
             status_emoji = compute_status_emoji(quest[7])
             type_emoji = {"physical": "💪", "intellectual": "📚", "mental": "🧠", "custom": "🎯"}.get(quest_type, "🎯")
-            rows.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=f"quest_{quest_id}")])
+            rows.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=pack("quest", quest_id))])
     await callback.message.edit_text("📋 Выбери квест:", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
     await callback.answer()
 
@@ -1478,8 +1485,8 @@ async def process_quest_title(message: Message, state: FSMContext):
         await state.set_state(QuestCreation.waiting_for_progress)
         text = f"Название: {title}\n\nУ квеста есть прогресс?"
         keyboard = [[
-            InlineKeyboardButton(text="Да", callback_data="custom_progress_yes"),
-            InlineKeyboardButton(text="Нет", callback_data="custom_progress_no")
+            InlineKeyboardButton(text="Да", callback_data=pack("custom_progress", 1)),
+            InlineKeyboardButton(text="Нет", callback_data=pack("custom_progress", 0))
         ]]
         await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
 
@@ -1499,7 +1506,7 @@ async def process_reps(message: Message, state: FSMContext):
 
 
 @router.message(QuestCreation.waiting_for_sets)
-async def process_sets(message: Message, state: FSMContext):
+async def process_sets(message: Message, state: FSMContext, profile: UserProfile):
     if not message.text.isdigit():
         await message.answer("❌ Введи число")
         return
@@ -1517,7 +1524,7 @@ async def process_sets(message: Message, state: FSMContext):
         _, error = await db.update_quest(message.from_user.id, quest_id, target_value=target_value)
         # Обновляем карточку
         quest = await db.get_quest(message.from_user.id, quest_id)
-        tz_off, _ = await db.get_user_timezone(message.from_user.id)
+        tz_off = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off)
             completed = bool(quest[6])
@@ -1546,14 +1553,14 @@ async def process_sets(message: Message, state: FSMContext):
     else:
         await state.set_state(QuestCreation.waiting_for_deadline_input)
         kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="сегодня", callback_data="deadline_today")],
-            [InlineKeyboardButton(text="пропустить", callback_data="deadline_skip_all")],
+            [InlineKeyboardButton(text="сегодня", callback_data=pack("deadline_today"))],
+            [InlineKeyboardButton(text="пропустить", callback_data=pack("deadline_skip_all"))],
         ])
         await message.answer("Укажи дедлайн в формате dd.mm.yy hh:mm или выбери кнопку ниже", reply_markup=kb)
 
 
 @router.message(QuestCreation.waiting_for_pages)
-async def process_pages(message: Message, state: FSMContext):
+async def process_pages(message: Message, state: FSMContext, profile: UserProfile):
     if not message.text.isdigit():
         await message.answer("❌ Введи число")
         return
@@ -1567,7 +1574,7 @@ async def process_pages(message: Message, state: FSMContext):
         quest_id = data.get("edit_quest_id")
         _, error = await db.update_quest(message.from_user.id, quest_id, target_value=pages)
         quest = await db.get_quest(message.from_user.id, quest_id)
-        tz_off, _ = await db.get_user_timezone(message.from_user.id)
+        tz_off = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off)
             completed = bool(quest[6])
@@ -1591,14 +1598,14 @@ async def process_pages(message: Message, state: FSMContext):
         return
     await state.set_state(QuestCreation.waiting_for_deadline_input)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="сегодня", callback_data="deadline_today")],
-        [InlineKeyboardButton(text="пропустить", callback_data="deadline_skip_all")],
+        [InlineKeyboardButton(text="сегодня", callback_data=pack("deadline_today"))],
+        [InlineKeyboardButton(text="пропустить", callback_data=pack("deadline_skip_all"))],
     ])
     await message.answer("Укажи дедлайн в формате dd.mm.yy hh:mm или выбери кнопку ниже", reply_markup=kb)
 
 
 @router.message(QuestCreation.waiting_for_minutes)
-async def process_minutes(message: Message, state: FSMContext):
+async def process_minutes(message: Message, state: FSMContext, profile: UserProfile):
     if not message.text.isdigit():
         await message.answer("❌ Введи число")
         return
@@ -1612,7 +1619,7 @@ async def process_minutes(message: Message, state: FSMContext):
         quest_id = data.get("edit_quest_id")
         _, error = await db.update_quest(message.from_user.id, quest_id, target_value=minutes)
         quest = await db.get_quest(message.from_user.id, quest_id)
-        tz_off, _ = await db.get_user_timezone(message.from_user.id)
+        tz_off = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off)
             completed = bool(quest[6])
@@ -1636,15 +1643,14 @@ async def process_minutes(message: Message, state: FSMContext):
         return
     await state.set_state(QuestCreation.waiting_for_deadline_input)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="сегодня", callback_data="deadline_today")],
-        [InlineKeyboardButton(text="пропустить", callback_data="deadline_skip_all")],
+        [InlineKeyboardButton(text="сегодня", callback_data=pack("deadline_today"))],
+        [InlineKeyboardButton(text="пропустить", callback_data=pack("deadline_skip_all"))],
     ])
     await message.answer("Укажи дедлайн в формате dd.mm.yy hh:mm или выбери кнопку ниже", reply_markup=kb)
 
 
-@router.callback_query(F.data.in_(["custom_progress_yes", "custom_progress_no"]))
-async def cb_custom_progress(callback: CallbackQuery, state: FSMContext):
-    has_progress = callback.data.endswith("yes")
+@callback_router.action("custom_progress")
+async def cb_custom_progress(callback: CallbackQuery, state: FSMContext, profile: UserProfile, has_progress: int):
     await state.update_data(target_value=(100 if has_progress else 0))
     data = await state.get_data()
     if data.get("_editing_target"):
@@ -1652,7 +1658,7 @@ async def cb_custom_progress(callback: CallbackQuery, state: FSMContext):
         tval = 100 if has_progress else 0
         _, error = await db.update_quest(callback.from_user.id, quest_id, target_value=tval)
         quest = await db.get_quest(callback.from_user.id, quest_id)
-        tz_off, _ = await db.get_user_timezone(callback.from_user.id)
+        tz_off = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off)
             completed = bool(quest[6])
@@ -1671,17 +1677,16 @@ async def cb_custom_progress(callback: CallbackQuery, state: FSMContext):
         return
     await state.set_state(QuestCreation.waiting_for_deadline_input)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="сегодня", callback_data="deadline_today")],
-        [InlineKeyboardButton(text="пропустить", callback_data="deadline_skip_all")],
+        [InlineKeyboardButton(text="сегодня", callback_data=pack("deadline_today"))],
+        [InlineKeyboardButton(text="пропустить", callback_data=pack("deadline_skip_all"))],
     ])
     await callback.message.edit_text("Укажи дедлайн в формате dd.mm.yy hh:mm или выбери кнопку ниже", reply_markup=kb)
     await callback.answer()
 
 
-@router.callback_query(F.data == "skip_comment")
-async def cb_skip_comment(callback: CallbackQuery, state: FSMContext):
+@callback_router.action("skip_comment")
+async def cb_skip_comment(callback: CallbackQuery, state: FSMContext, profile: UserProfile):
     user = callback.from_user
-    await db.add_user(user.id, user.first_name or user.username or "User")
     data = await state.get_data()
     quest_id, error = await db.create_quest(
         user_id=user.id,
@@ -1702,7 +1707,7 @@ async def cb_skip_comment(callback: CallbackQuery, state: FSMContext):
         if quest_id:
             quest = await db.get_quest(user.id, quest_id)
             if quest:
-                tz_off, _ = await db.get_user_timezone(user.id)
+                tz_off = profile.tz_offset_minutes
                 text = format_quest_text(quest, tz_off)
                 completed = bool(quest[6])
                 quest_type = quest[3]
@@ -1723,14 +1728,14 @@ async def cb_skip_comment(callback: CallbackQuery, state: FSMContext):
                 q_type = q[3]
                 status_emoji = "⚪"
                 type_emoji = {"physical": "💪", "intellectual": "📚", "mental": "🧠", "custom": "🎯"}.get(q_type, "🎯")
-                keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {q_title}", callback_data=f"quest_{q_id}")])
+                keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {q_title}", callback_data=pack("quest", q_id))])
             await callback.message.edit_text("📋 Выбери квест:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
             await callback.message.answer("Главное меню\n\nВыбери действие:", reply_markup=get_quests_menu_keyboard())
         await callback.answer()
 
 
 @router.message(QuestCreation.waiting_for_comment)
-async def process_quest_comment(message: Message, state: FSMContext):
+async def process_quest_comment(message: Message, state: FSMContext, profile: UserProfile):
     text = message.text.strip()
     data = await state.get_data()
     comment = text if comment_should_be_saved(text, None) else None
@@ -1739,7 +1744,6 @@ async def process_quest_comment(message: Message, state: FSMContext):
         if not is_valid:
             await message.answer(f"❌ {error_msg}")
             return
-    await db.add_user(message.from_user.id, message.from_user.first_name or message.from_user.username or "User")
     quest_id, error = await db.create_quest(
         user_id=message.from_user.id,
         title=data["title"],
@@ -1759,7 +1763,7 @@ async def process_quest_comment(message: Message, state: FSMContext):
     if quest_id:
         quest = await db.get_quest(message.from_user.id, quest_id)
         if quest:
-            tz_off, _ = await db.get_user_timezone(message.from_user.id)
+            tz_off = profile.tz_offset_minutes
             text = format_quest_text(quest, tz_off)
             completed = bool(quest[6])
             quest_type = quest[3]
@@ -1780,31 +1784,31 @@ async def process_quest_comment(message: Message, state: FSMContext):
             qtype = quest[3]
             status_emoji = "⚪"
             type_emoji = {"physical": "💪", "intellectual": "📚", "mental": "🧠", "custom": "🎯"}.get(qtype, "🎯")
-            keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=f"quest_{qid}")])
+            keyboard.append([InlineKeyboardButton(text=f"{status_emoji} {type_emoji} {title}", callback_data=pack("quest", qid))])
         await message.answer("📋 Выбери квест:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
         await message.answer("Главное меню\n\nВыбери действие:", reply_markup=get_quests_menu_keyboard())
 
 
 
 
-@router.callback_query(F.data == "deadline_today")
-async def cb_deadline_today(callback: CallbackQuery, state: FSMContext):
-    tz_off, _ = await db.get_user_timezone(callback.from_user.id)
+@callback_router.action("deadline_today")
+async def cb_deadline_today(callback: CallbackQuery, state: FSMContext, profile: UserProfile):
+    tz_off = profile.tz_offset_minutes
     now_utc = datetime.utcnow()
     local_now = now_utc + timedelta(minutes=int(tz_off)) if tz_off is not None else now_utc
     logger.info(f"[DEADLINE] button today pressed, tz_off={tz_off}, local_now={local_now}")
     await state.update_data(_deadline_local_date=(local_now.year, local_now.month, local_now.day))
     await state.set_state(QuestCreation.waiting_for_deadline_time)
-    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="пропустить", callback_data="deadline_time_skip")]])
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="пропустить", callback_data=pack("deadline_time_skip"))]])
     await callback.message.edit_text("Введи время в формате hh:mm (или нажми Пропустить)", reply_markup=kb)
     await callback.answer()
 
 
-@router.callback_query(F.data == "deadline_time_skip")
-async def cb_deadline_time_skip(callback: CallbackQuery, state: FSMContext):
+@callback_router.action("deadline_time_skip")
+async def cb_deadline_time_skip(callback: CallbackQuery, state: FSMContext, profile: UserProfile):
     data = await state.get_data()
     y, m, d = data.get("_deadline_local_date")
-    tz_off, _ = await db.get_user_timezone(callback.from_user.id)
+    tz_off = profile.tz_offset_minutes
     # Сохраняем 23:59 локального дня в БД, но отображаем "без времени" через флаг has_time=False
     dt_local = datetime(y, m, d, 23, 59, 0)
     if tz_off is None:
@@ -1819,7 +1823,7 @@ async def cb_deadline_time_skip(callback: CallbackQuery, state: FSMContext):
         quest_id = data.get("edit_quest_id")
         _, error = await db.update_quest(callback.from_user.id, quest_id, deadline=dt_utc_str, has_date=True, has_time=False)
         quest = await db.get_quest(callback.from_user.id, quest_id)
-        tz_off2, _ = await db.get_user_timezone(callback.from_user.id)
+        tz_off2 = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off2)
             completed = bool(quest[6])
@@ -1837,13 +1841,13 @@ async def cb_deadline_time_skip(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     await state.set_state(QuestCreation.waiting_for_comment)
-    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data="skip_comment")]]
+    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data=pack("skip_comment"))]]
     await callback.message.edit_text("📌 Дедлайн установлен: сегодня, без времени.\n\nДобавьте комментарий (введите текст сообщением)", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
 
 
 @router.message(QuestCreation.waiting_for_deadline_time)
-async def process_deadline_time(message: Message, state: FSMContext):
+async def process_deadline_time(message: Message, state: FSMContext, profile: UserProfile):
     data = await state.get_data()
     try:
         hh, mm = map(int, (message.text or "").strip().split(":"))
@@ -1853,7 +1857,7 @@ async def process_deadline_time(message: Message, state: FSMContext):
         await message.answer("Некорректное время. Формат: hh:mm")
         return
     y, m, d = data.get("_deadline_local_date")
-    tz_off, _ = await db.get_user_timezone(message.from_user.id)
+    tz_off = profile.tz_offset_minutes
     dt_local = datetime(y, m, d, hh, mm, 0)
     if tz_off is None:
         dt_utc_str = dt_local.strftime("%Y-%m-%d %H:%M:%S")
@@ -1867,7 +1871,7 @@ async def process_deadline_time(message: Message, state: FSMContext):
         quest_id = data.get("edit_quest_id")
         _, error = await db.update_quest(message.from_user.id, quest_id, deadline=dt_utc_str)
         quest = await db.get_quest(message.from_user.id, quest_id)
-        tz_off2, _ = await db.get_user_timezone(message.from_user.id)
+        tz_off2 = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off2)
             completed = bool(quest[6])
@@ -1890,20 +1894,20 @@ async def process_deadline_time(message: Message, state: FSMContext):
             await message.answer("✅ Дедлайн обновлён", reply_markup=get_quests_menu_keyboard())
         return
     await state.set_state(QuestCreation.waiting_for_comment)
-    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data="skip_comment")]]
+    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data=pack("skip_comment"))]]
     shown_time = f"{hh:02d}:{mm:02d}"
     await message.answer(f"📌 Дедлайн установлен: сегодня, {shown_time}.\n\nДобавьте комментарий (введите текст сообщением)", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
 
 
-@router.callback_query(F.data == "deadline_skip_all")
-async def cb_deadline_skip_all(callback: CallbackQuery, state: FSMContext):
+@callback_router.action("deadline_skip_all")
+async def cb_deadline_skip_all(callback: CallbackQuery, state: FSMContext, profile: UserProfile):
     data = await state.get_data()
     await state.update_data(deadline=None, has_date=False, has_time=False)
     if data.get("_editing_deadline"):
         quest_id = data.get("edit_quest_id")
         _, error = await db.update_quest(callback.from_user.id, quest_id, deadline="")
         quest = await db.get_quest(callback.from_user.id, quest_id)
-        tz_off2, _ = await db.get_user_timezone(callback.from_user.id)
+        tz_off2 = profile.tz_offset_minutes
         if quest:
             txt = format_quest_text(quest, tz_off2)
             completed = bool(quest[6])
@@ -1921,6 +1925,6 @@ async def cb_deadline_skip_all(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     await state.set_state(QuestCreation.waiting_for_comment)
-    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data="skip_comment")]]
+    keyboard = [[InlineKeyboardButton(text="Пропустить", callback_data=pack("skip_comment"))]]
     await callback.message.edit_text("Добавьте комментарий (введите текст сообщением)", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await callback.answer()
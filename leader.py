@@ -0,0 +1,137 @@
+"""
+Выбор лидера для фоновых задач через аренду в SQLite
+Несколько экземпляров бота могут работать на одной базе: каждую фоновую задачу
+(напоминания, рассылка RT-логов) выполняет только держатель аренды,
+резервный экземпляр забирает её после истечения срока
+"""
+
+import asyncio
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+
+from config import config
+from database_async import db
+from metrics import metrics
+
+LEASES_HELD = metrics.gauge("leases_held", "Аренды фоновых задач, которыми владеет экземпляр")
+LEASE_TRANSITIONS = metrics.counter("lease_transitions_total", "Получения и потери аренды")
+
+
+def default_instance_id() -> str:
+    """Идентификатор экземпляра: INSTANCE_ID или имя хоста и PID"""
+    return config.INSTANCE_ID or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseElector:
+    """Держит аренду фоновой задачи и запускает/останавливает её при смене лидера"""
+
+    def __init__(
+        self,
+        name: str,
+        on_elected: Callable[[], Awaitable[None]],
+        on_demoted: Callable[[], Awaitable[None]],
+        database=None,
+        holder: Optional[str] = None,
+        ttl: Optional[float] = None,
+        takeover_delay: float = 0.0,
+        sleep=asyncio.sleep,
+    ):
+        """
+        Args:
+            name: Имя аренды (одна аренда — одна фоновая задача)
+            on_elected: Вызывается, когда экземпляр стал лидером
+            on_demoted: Вызывается при потере аренды и при остановке
+            database: База данных (по умолчанию глобальная db)
+            holder: Идентификатор экземпляра (по умолчанию default_instance_id())
+            ttl: Срок аренды в секундах (по умолчанию config.LEASE_TTL_SECONDS)
+            takeover_delay: Дополнительное ожидание перед захватом чужой или свободной аренды
+                (для непредпочтительных шардов, чтобы их разобрали «свои» экземпляры)
+            sleep: Функция ожидания (для тестов)
+        """
+        self.name = name
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.database = database or db
+        self.holder = holder or default_instance_id()
+        self.ttl = ttl or config.LEASE_TTL_SECONDS
+        self.takeover_delay = takeover_delay
+        self.sleep = sleep
+        # Продление трижды за срок аренды: одна неудачная попытка не приводит к смене лидера
+        self.renew_interval = self.ttl / 3
+        self.is_leader = False
+        self.renewed_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        """Запуск фоновой задачи"""
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def stop(self) -> None:
+        """Остановка: завершить задачу лидера и освободить аренду, чтобы резерв подхватил сразу"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+            self.task = None
+        if self.is_leader:
+            await self._demote()
+            try:
+                await self.database.release_lease(self.name, self.holder)
+            except Exception as e:
+                logger.warning(f"Lease '{self.name}' release error: {e}")
+
+    async def step(self) -> None:
+        """Одна попытка захвата/продления аренды"""
+        try:
+            held = await self.database.try_acquire_lease(self.name, self.holder, self.ttl, self.takeover_delay)
+            if held:
+                self.renewed_at = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Lease '{self.name}' renew error: {e}")
+            # Лидерство сохраняется, пока аренда гарантированно не истекла в БД
+            held = self.is_leader and time.monotonic() - self.renewed_at < self.ttl - self.renew_interval
+        if held and not self.is_leader:
+            await self._promote()
+        elif not held and self.is_leader:
+            await self._demote()
+
+    async def run(self) -> None:
+        """Фоновый цикл продления аренды"""
+        if self.takeover_delay:
+            await self.sleep(self.takeover_delay)
+        while True:
+            try:
+                await self.step()
+                await self.sleep(self.renew_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"Lease '{self.name}' loop error: {e}")
+                await self.sleep(self.renew_interval)
+
+    async def _promote(self) -> None:
+        self.is_leader = True
+        LEASES_HELD.set(LEASES_HELD.value + 1)
+        LEASE_TRANSITIONS.inc()
+        logger.info(f"👑 {self.holder}: получена аренда '{self.name}'")
+        try:
+            await self.on_elected()
+        except Exception as e:
+            logger.error(f"Lease '{self.name}' start error: {e}")
+
+    async def _demote(self) -> None:
+        self.is_leader = False
+        LEASES_HELD.set(max(0.0, LEASES_HELD.value - 1))
+        LEASE_TRANSITIONS.inc()
+        logger.info(f"💤 {self.holder}: аренда '{self.name}' потеряна")
+        try:
+            await self.on_demoted()
+        except Exception as e:
+            logger.error(f"Lease '{self.name}' stop error: {e}")
@@ -0,0 +1,288 @@
+"""
+Локальный генератор квестов без AI
+Цель пользователя сопоставляется с шаблонами по ключевым основам слов (индекс строится
+один раз при импорте); тип, целевое значение, описание и советы берутся из шаблона.
+Ответ детерминирован, занимает доли миллисекунды и имеет тот же формат, что и у AI
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from ai_cache import normalize_goal
+from config import config
+
+# Слово цели совпадает с ключевой основой, если начинается с неё; самые короткие основы — «кг», «км»
+MIN_STEM = 2
+# Вступления, которые не нужны в названии квеста
+_PREFIX_RE = re.compile(
+    r"^(?:я\s+)?(?:очень\s+)?(?:хочу|хотел(?:а)?\s+бы|мне\s+нужно|нужно|надо|планирую|собираюсь|мечтаю)\s+",
+    re.IGNORECASE,
+)
+_NUMBER_RE = re.compile(r"\d+")
+MAX_TARGET = 100000
+
+# Шаблоны: ключевые основы, тип, целевое значение по умолчанию, единица (1, 2, 5), описание, советы.
+# Для physical/intellectual число из цели становится целевым значением, для mental/custom — всегда 100
+TEMPLATES: List[Dict[str, Any]] = [
+    {
+        "keywords": ["похуд", "сброс", "вес", "кг", "килограм", "стройн", "жир"],
+        "quest_type": "physical",
+        "target": 5,
+        "unit": ("кг", "кг", "кг"),
+        "description": "Цель: минус {target} {unit}. Каждый день дефицит калорий и движение, раз в неделю — контрольное взвешивание.",
+        "tips": [
+            "Записывай всё, что ешь, хотя бы первые две недели",
+            "Проходи не меньше 8000 шагов в день",
+            "Взвешивайся в один и тот же день недели утром",
+            "Замени сладкие напитки водой",
+        ],
+    },
+    {
+        "keywords": ["бег", "пробеж", "бегат", "марафон", "забег", "км", "километр"],
+        "quest_type": "physical",
+        "target": 50,
+        "unit": ("км", "км", "км"),
+        "description": "Цель: {target} {unit} бега. Три пробежки в неделю в комфортном темпе, дистанцию увеличивай не больше чем на 10% в неделю.",
+        "tips": [
+            "Начинай каждую пробежку с 5 минут быстрой ходьбы",
+            "Бегай в темпе, при котором можешь говорить",
+            "Отмечай километры сразу после пробежки",
+        ],
+    },
+    {
+        "keywords": ["отжим", "присед", "подтяг", "пресс", "планк", "бёрпи", "берпи"],
+        "quest_type": "physical",
+        "target": 100,
+        "unit": ("повторение", "повторения", "повторений"),
+        "description": "Цель: {target} {unit}. Короткая тренировка каждый день, количество повторений растёт постепенно.",
+        "tips": [
+            "Делай несколько подходов в течение дня вместо одного тяжёлого",
+            "Следи за техникой, а не за скоростью",
+            "Добавляй по 1–2 повторения каждые пару дней",
+        ],
+    },
+    {
+        "keywords": ["трениров", "спорт", "зал", "фитнес", "зарядк", "качат", "мышц", "форм", "йог", "плаван", "велосипед"],
+        "quest_type": "physical",
+        "target": 30,
+        "unit": ("тренировка", "тренировки", "тренировок"),
+        "description": "Цель: {target} {unit}. Запланируй тренировки в календаре заранее и отмечай каждую выполненную.",
+        "tips": [
+            "Выбери фиксированные дни и время для тренировок",
+            "Собери сумку с формой с вечера",
+            "Начни с коротких занятий по 20–30 минут",
+            "Разминка и заминка — обязательная часть тренировки",
+        ],
+    },
+    {
+        "keywords": ["ходьб", "шаг", "прогулк", "гулят", "пешк"],
+        "quest_type": "physical",
+        "target": 10000,
+        "unit": ("шаг", "шага", "шагов"),
+        "description": "Цель: {target} {unit} в день. Добавляй прогулки в обычный распорядок — по дороге, в обед, вечером.",
+        "tips": [
+            "Выходи на одну остановку раньше",
+            "Разговаривай по телефону на ходу",
+            "Вечерняя прогулка 20 минут — уже треть нормы",
+        ],
+    },
+    {
+        "keywords": ["книг", "чтен", "чита", "прочит", "литератур", "роман"],
+        "quest_type": "intellectual",
+        "target": 12,
+        "unit": ("книга", "книги", "книг"),
+        "description": "Цель: {target} {unit}. Читай каждый день хотя бы 20 страниц и отмечай каждую дочитанную книгу.",
+        "tips": [
+            "Держи книгу под рукой: в сумке, на тумбочке, в телефоне",
+            "Читай 20 минут перед сном вместо ленты соцсетей",
+            "Бросай книгу, которая не идёт, — выбирай следующую",
+        ],
+    },
+    {
+        "keywords": ["английск", "немецк", "испанск", "французск", "итальянск", "китайск", "японск", "язык", "слов", "лексик"],
+        "quest_type": "intellectual",
+        "target": 500,
+        "unit": ("слово", "слова", "слов"),
+        "description": "Цель: {target} новых {unit}. Учи по 10–15 слов в день с интервальным повторением и используй их в речи.",
+        "tips": [
+            "Повторяй слова через день, через три дня и через неделю",
+            "Учи слова во фразах, а не по одному",
+            "Раз в неделю смотри видео или читай текст на изучаемом языке",
+            "Говори вслух, даже сам с собой",
+        ],
+    },
+    {
+        "keywords": ["программ", "python", "питон", "javascript", "код", "разработ", "алгоритм", "leetcode", "айти"],
+        "quest_type": "intellectual",
+        "target": 50,
+        "unit": ("задача", "задачи", "задач"),
+        "description": "Цель: {target} решённых {unit}. Каждый день практика: одна задача или небольшой кусок своего проекта.",
+        "tips": [
+            "Пиши код каждый день, пусть даже 30 минут",
+            "Сделай небольшой собственный проект, а не только упражнения",
+            "Разбирай чужие решения после своего",
+        ],
+    },
+    {
+        "keywords": ["курс", "учеб", "изуч", "экзамен", "учит", "выучи", "навык", "освоит", "урок", "лекци"],
+        "quest_type": "intellectual",
+        "target": 30,
+        "unit": ("занятие", "занятия", "занятий"),
+        "description": "Цель: {target} {unit}. Раздели материал на небольшие темы и проходи по одной за раз с конспектом.",
+        "tips": [
+            "Планируй учёбу на конкретное время в календаре",
+            "После каждой темы перескажи её своими словами",
+            "Раз в неделю повторяй пройденное",
+        ],
+    },
+    {
+        "keywords": ["медит", "стресс", "тревог", "спокой", "осознан", "дыхан", "нерв", "расслаб"],
+        "quest_type": "mental",
+        "description": "Ежедневная практика осознанности: 10 минут медитации или дыхательных упражнений в одно и то же время.",
+        "tips": [
+            "Начни с 5 минут и постепенно увеличивай время",
+            "Привяжи практику к привычному действию — после чистки зубов",
+            "Пользуйся таймером, чтобы не отвлекаться на часы",
+        ],
+    },
+    {
+        "keywords": ["сон", "спат", "высып", "засып", "просып", "подъём", "подъем", "ложит", "утр"],
+        "quest_type": "mental",
+        "description": "Стабильный режим сна: ложиться и вставать в одно и то же время каждый день, включая выходные.",
+        "tips": [
+            "Убирай телефон за час до сна",
+            "Ставь будильник не только на подъём, но и на отход ко сну",
+            "Проветривай спальню и держи её тёмной",
+        ],
+    },
+    {
+        "keywords": ["кури", "курен", "сигарет", "алкогол", "пьян", "выпив", "сахар", "сладк", "фастфуд", "брос", "отказ", "вредн", "зависим", "соцсет"],
+        "quest_type": "mental",
+        "description": "Отказ от вредной привычки: каждый день без срыва — шаг к цели. Отмечай прогресс и замечай триггеры.",
+        "tips": [
+            "Определи ситуации, в которых тянет к привычке, и заранее продумай замену",
+            "Расскажи о цели близким",
+            "Считай сэкономленные деньги и время",
+            "Срыв — не повод бросать: продолжай со следующего дня",
+        ],
+    },
+    {
+        "keywords": ["прокраст", "продуктив", "дисциплин", "привычк", "план", "фокус", "лень", "ленив", "успева", "тайм"],
+        "quest_type": "mental",
+        "description": "Ежедневная дисциплина: вечером план на завтра из трёх главных задач, утром — начинать с самой важной.",
+        "tips": [
+            "Разбивай большие задачи на шаги по 25 минут",
+            "Убирай телефон из поля зрения во время работы",
+            "Подводи итог дня: что сделано и что перенести",
+        ],
+    },
+    {
+        "keywords": ["вод", "питан", "овощ", "фрукт", "здоров", "завтрак", "витамин", "рацион"],
+        "quest_type": "mental",
+        "description": "Здоровое питание: каждый день вода, овощи и регулярные приёмы пищи без перекусов на ходу.",
+        "tips": [
+            "Держи бутылку воды на рабочем месте",
+            "Добавляй овощи в каждый основной приём пищи",
+            "Планируй меню на неделю и покупай продукты по списку",
+        ],
+    },
+    {
+        "keywords": ["деньг", "коп", "накоп", "сбереж", "бюджет", "финанс", "долг", "кредит", "зарпл", "доход"],
+        "quest_type": "custom",
+        "description": "Финансовая цель: учёт доходов и расходов, фиксированная сумма откладывается сразу после каждого поступления.",
+        "tips": [
+            "Записывай все траты хотя бы месяц",
+            "Откладывай 10% дохода в день зарплаты",
+            "Раз в неделю сверяй расходы с планом",
+        ],
+    },
+]
+
+DEFAULT_TEMPLATE: Dict[str, Any] = {
+    "keywords": [],
+    "quest_type": "custom",
+    "description": "Раздели цель на небольшие шаги и делай хотя бы один шаг каждый день. Отмечай прогресс в процентах.",
+    "tips": [
+        "Запиши, как будет выглядеть результат, когда цель достигнута",
+        "Определи первый шаг, который можно сделать сегодня",
+        "Раз в неделю оценивай прогресс и корректируй план",
+    ],
+}
+
+
+def plural(n: int, forms: Tuple[str, str, str]) -> str:
+    """Форма слова для числа: 1 книга, 2 книги, 5 книг"""
+    n = abs(n) % 100
+    if 11 <= n <= 19:
+        return forms[2]
+    n %= 10
+    if n == 1:
+        return forms[0]
+    if 2 <= n <= 4:
+        return forms[1]
+    return forms[2]
+
+
+def make_title(goal: str) -> str:
+    """Название из цели пользователя: без «хочу/нужно», с заглавной буквы, до 50 символов"""
+    title = _PREFIX_RE.sub("", " ".join(goal.split())).strip(" .!?")
+    if not title:
+        return "Мой квест"
+    title = title[0].upper() + title[1:]
+    if len(title) > 50:
+        title = title[:49].rstrip() + "…"
+    return title
+
+
+class LocalQuestGenerator:
+    """Подбор шаблона квеста по ключевым словам цели"""
+
+    def __init__(self, templates: Optional[List[Dict[str, Any]]] = None):
+        self.templates = templates if templates is not None else TEMPLATES
+        # Основа ключевого слова -> номера шаблонов
+        self.index: Dict[str, List[int]] = {}
+        for i, template in enumerate(self.templates):
+            if template["quest_type"] not in config.QUEST_TYPES:
+                raise ValueError(f"Неизвестный тип квеста в шаблоне: {template['quest_type']}")
+            for stem in template["keywords"]:
+                self.index.setdefault(stem.lower().replace("ё", "е"), []).append(i)
+        self.max_stem = max((len(stem) for stem in self.index), default=0)
+
+    def match(self, goal: str) -> Optional[Dict[str, Any]]:
+        """Шаблон с наибольшим числом совпавших слов (при равенстве — первый по порядку)"""
+        scores: Dict[int, int] = {}
+        for word in normalize_goal(_PREFIX_RE.sub("", goal.strip())).split():
+            matched = set()
+            for size in range(MIN_STEM, min(len(word), self.max_stem) + 1):
+                matched.update(self.index.get(word[:size], ()))
+            for i in matched:
+                scores[i] = scores.get(i, 0) + 1
+        if not scores:
+            return None
+        best = min(scores, key=lambda i: (-scores[i], i))
+        return self.templates[best]
+
+    def generate(self, goal: str) -> Dict[str, Any]:
+        """Квест в формате ответа AI: title, quest_type, target_value, description, tips"""
+        template = self.match(goal) or DEFAULT_TEMPLATE
+        quest_type = template["quest_type"]
+        if quest_type in ("physical", "intellectual"):
+            number = _NUMBER_RE.search(goal)
+            target = min(MAX_TARGET, int(number.group())) if number else template["target"]
+            target = target or template["target"]
+            unit = plural(target, template["unit"])
+            description = template["description"].format(target=target, unit=unit)
+        else:
+            target = 100
+            description = template["description"]
+        return {
+            "title": make_title(goal),
+            "quest_type": quest_type,
+            "target_value": target,
+            "description": description,
+            "tips": list(template["tips"]),
+        }
+
+
+# Индекс шаблонов строится один раз при запуске
+local_quests = LocalQuestGenerator()
@@ -0,0 +1,217 @@
+"""
+Потоковая рассылка RT-логов подписчикам
+Строки копятся в ограниченном буфере (при переполнении вытесняются самые старые)
+и отправляются одним сообщением на подписчика за окно — по времени или по объёму.
+Каждый подписчик выбирает минимальный уровень и модуль. Sink подключён к loguru только
+при наличии подписчиков и с наименьшим из их уровней: записи ниже него (например, DEBUG
+без подписчиков на DEBUG) loguru не форматирует и в sink не передаёт
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from config import config
+from database_async import db
+from metrics import metrics
+
+# Лимит Telegram — 4096 символов, оставляем запас под отметку о пропусках
+MAX_MESSAGE_CHARS = 3500
+# Длинные строки (трейсбеки) обрезаются до хвоста
+MAX_LINE_CHARS = 800
+# Не чаще одного сообщения в секунду на подписчика (лимиты Telegram)
+MIN_FLUSH_INTERVAL = 1.0
+# Как часто перечитывать подписчиков из БД (подписки через другой экземпляр бота), с
+SUBSCRIBERS_REFRESH_SECONDS = 30
+# Компактный формат строки для чата
+LINE_FORMAT = "{time:HH:mm:ss} | {level: <8} | {name}:{function} - {message}"
+
+LOG_STREAM_BUFFERED = metrics.gauge("log_stream_buffered_lines", "Строки RT-логов в буфере")
+LOG_STREAM_DROPPED = metrics.counter("log_stream_dropped_lines_total", "Строки RT-логов, вытесненные из буфера или не поместившиеся в сообщение")
+LOG_STREAM_MESSAGES = metrics.counter("log_stream_messages_total", "Отправленные сообщения с RT-логами")
+
+# Стандартные уровни loguru
+LEVELS = {"TRACE": 5, "DEBUG": 10, "INFO": 20, "SUCCESS": 25, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+def level_no(name: str) -> int:
+    """Числовой уровень по имени (неизвестный — INFO)"""
+    return LEVELS.get((name or "").upper(), LEVELS["INFO"])
+
+
+class LogStream:
+    """Буфер RT-логов и фоновая рассылка окнами"""
+
+    def __init__(
+        self,
+        bot,
+        database=None,
+        max_lines: Optional[int] = None,
+        interval: Optional[float] = None,
+        max_chars: int = MAX_MESSAGE_CHARS,
+    ):
+        """
+        Args:
+            bot: Экземпляр aiogram Bot (нужен только send_message)
+            database: База данных (по умолчанию глобальная db)
+            max_lines: Ёмкость буфера (по умолчанию config.LOG_STREAM_MAX_LINES)
+            interval: Окно по времени, с (по умолчанию config.LOG_STREAM_INTERVAL)
+            max_chars: Окно по объёму: при накоплении стольких символов окно закрывается досрочно
+        """
+        self.bot = bot
+        self.database = database or db
+        self.max_lines = max_lines or config.LOG_STREAM_MAX_LINES
+        self.interval = interval or config.LOG_STREAM_INTERVAL
+        self.max_chars = max_chars
+        # Строки (уровень, модуль, текст); sink может вызываться из другого потока
+        self.buffer: deque = deque()
+        self.buffered_chars = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.sink_id: Optional[int] = None
+        # Уровень, с которым подключён sink (None — не подключён)
+        self.sink_level: Optional[int] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    # ----- Приём строк -----
+    def sink(self, message) -> None:
+        """Sink loguru: фильтр по уровням подписчиков и запись в буфер без обращения к БД"""
+        subscribers = self.database.log_subscribers
+        if not subscribers:
+            return
+        record = message.record
+        if record["level"].no < min(level_no(level) for level, _ in subscribers.values()):
+            return
+        text = str(message).rstrip("\n")[-MAX_LINE_CHARS:]
+        with self.lock:
+            if len(self.buffer) >= self.max_lines:
+                _, _, old = self.buffer.popleft()
+                self.buffered_chars -= len(old)
+                self.dropped += 1
+                LOG_STREAM_DROPPED.inc()
+            self.buffer.append((record["level"].no, record["name"] or "", text))
+            was_below = self.buffered_chars < self.max_chars
+            self.buffered_chars += len(text) + 1
+            full = was_below and self.buffered_chars >= self.max_chars
+        # Окно по объёму: будим рассылку, как только набралось на полное сообщение
+        if full and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def sync(self) -> None:
+        """Подключить sink с наименьшим уровнем подписчиков, отключить без подписчиков"""
+        subscribers = self.database.log_subscribers
+        level = min((level_no(level) for level, _ in subscribers.values()), default=None) if subscribers else None
+        if level == self.sink_level:
+            return
+        self._remove_sink()
+        if level is not None:
+            self.sink_id = logger.add(self.sink, level=level, format=LINE_FORMAT)
+            self.sink_level = level
+
+    def _remove_sink(self) -> None:
+        if self.sink_id is not None:
+            try:
+                logger.remove(self.sink_id)
+            except ValueError:
+                pass
+        self.sink_id = None
+        self.sink_level = None
+
+    def _take(self) -> Tuple[List[tuple], int]:
+        """Забрать накопленные строки и счётчик вытесненных"""
+        with self.lock:
+            lines = list(self.buffer)
+            dropped = self.dropped
+            self.buffer.clear()
+            self.buffered_chars = 0
+            self.dropped = 0
+        return lines, dropped
+
+    # ----- Рассылка -----
+    def render(self, lines: List[tuple], dropped: int, level: str, module: Optional[str]) -> Optional[str]:
+        """Одно сообщение подписчику за окно: только строки по его фильтру, самые новые, в пределах лимита"""
+        min_no = level_no(level)
+        selected = [text for no, name, text in lines if no >= min_no and (not module or name.startswith(module))]
+        if not selected:
+            return None
+        kept: List[str] = []
+        size = 0
+        for text in reversed(selected):
+            if size + len(text) + 1 > self.max_chars:
+                break
+            kept.append(text)
+            size += len(text) + 1
+        skipped = dropped + len(selected) - len(kept)
+        if len(selected) > len(kept):
+            LOG_STREAM_DROPPED.inc(len(selected) - len(kept))
+        header = f"📟 RT-логи ({len(kept)})"
+        if skipped:
+            header += f"\n⚠️ Пропущено строк: {skipped}"
+        return header + "\n" + "\n".join(reversed(kept))
+
+    async def flush(self) -> None:
+        """Закрыть окно: отправить каждому подписчику одно сообщение"""
+        lines, dropped = self._take()
+        LOG_STREAM_BUFFERED.set(0)
+        if not lines:
+            return
+        if self.database.log_subscribers is None:
+            await self.database.load_log_subscribers()
+        for uid, (level, module) in list(self.database.log_subscribers.items()):
+            text = self.render(lines, dropped, level, module)
+            if not text:
+                continue
+            try:
+                await self.bot.send_message(uid, text)
+                LOG_STREAM_MESSAGES.inc()
+            except Exception:
+                pass
+
+    async def run(self) -> None:
+        """Фоновая рассылка: окно закрывается по таймеру или по объёму"""
+        refreshed = self.loop.time()
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                LOG_STREAM_BUFFERED.set(len(self.buffer))
+                if self.loop.time() - refreshed >= SUBSCRIBERS_REFRESH_SECONDS:
+                    await self.database.load_log_subscribers()
+                    refreshed = self.loop.time()
+                # Подписки могли измениться (/logs_on, /logs_off или другой экземпляр)
+                self.sync()
+                started = self.loop.time()
+                await self.flush()
+                await asyncio.sleep(max(0.0, MIN_FLUSH_INTERVAL - (self.loop.time() - started)))
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"log stream error: {e}")
+                await asyncio.sleep(0.5)
+
+    def start(self) -> asyncio.Task:
+        """Подключить sink к loguru (по уровням подписчиков) и запустить рассылку"""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.sync()
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def stop(self) -> None:
+        """Отключить sink и остановить рассылку"""
+        self._remove_sink()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+            self.task = None
@@ -0,0 +1,175 @@
+"""
+Настройка логирования приложения
+Консоль и файл пишутся из отдельного потока: вызов logger.* на цикле событий только
+кладёт готовую строку в ограниченную очередь, а запись на диск и ротация bot.log
+выполняются в потоке-писателе. Для файла доступен компактный формат JSON Lines (LOG_JSON)
+"""
+
+import asyncio
+import json
+import os
+import queue
+import sys
+import threading
+import traceback
+
+from loguru import logger
+
+from config import config
+
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>"
+)
+FILE_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function} - {message}"
+# Ёмкость очереди писателя: при переполнении строки отбрасываются, а не блокируют обработчики
+WRITER_QUEUE_SIZE = 10000
+
+
+def json_format(record) -> str:
+    """Одна строка JSON на запись: время, уровень, модуль, функция, строка, сообщение и трейсбек"""
+    entry = {
+        "ts": record["time"].strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
+        "level": record["level"].name,
+        "module": record["name"],
+        "func": record["function"],
+        "line": record["line"],
+        "msg": record["message"],
+    }
+    extra = {k: v for k, v in record["extra"].items() if not k.startswith("_")}
+    if extra:
+        entry["extra"] = {k: str(v) for k, v in extra.items()}
+    if record["exception"]:
+        exc_type, exc_value, exc_tb = record["exception"]
+        entry["exc"] = "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
+    record["extra"]["_json"] = json.dumps(entry, ensure_ascii=False)
+    return "{extra[_json]}\n"
+
+
+class RotatingFile:
+    """Файл с ротацией по размеру: bot.log → bot.log.1 → … → bot.log.N"""
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def write(self, text: str) -> None:
+        # Размер файла — в байтах UTF-8 (кириллица и эмодзи занимают больше одного байта)
+        size = len(text.encode("utf-8"))
+        if self.size and self.size + size > self.max_bytes:
+            self.rotate()
+        self.file.write(text)
+        self.size += size
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def rotate(self) -> None:
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = 0
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class BackgroundWriter:
+    """Sink loguru: строка кладётся в ограниченную очередь, запись — в отдельном потоке"""
+
+    def __init__(self, target, max_queue: int = WRITER_QUEUE_SIZE, name: str = "log-writer"):
+        """
+        Args:
+            target: Объект с методами write/flush (RotatingFile, sys.stderr)
+            max_queue: Ёмкость очереди
+            name: Имя потока
+        """
+        self.target = target
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def write(self, message: str) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            message = self.queue.get()
+            try:
+                if message is None:
+                    break
+                if self.dropped:
+                    with self.lock:
+                        dropped, self.dropped = self.dropped, 0
+                    self.target.write(f"... пропущено строк лога (очередь записи переполнена): {dropped}\n")
+                self.target.write(message)
+                # flush один раз на пачку накопившихся строк
+                if self.queue.empty():
+                    self.target.flush()
+            except Exception:
+                pass
+            finally:
+                self.queue.task_done()
+
+    async def complete(self) -> None:
+        """Дождаться записи всех строк из очереди (logger.complete())"""
+        await asyncio.to_thread(self.queue.join)
+
+    def stop(self) -> None:
+        """Дописать очередь и остановить поток (logger.remove())"""
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+        try:
+            self.target.flush()
+        except Exception:
+            pass
+        if self.target not in (sys.stdout, sys.stderr) and callable(getattr(self.target, "close", None)):
+            self.target.close()
+
+
+def add_file_sink(target=None, json_logs: bool = None, **kwargs) -> int:
+    """
+    Добавить файловый sink с записью из потока-писателя
+
+    Args:
+        target: Путь к файлу или объект с write/flush (по умолчанию config.LOG_FILE с ротацией)
+        json_logs: Формат JSON Lines (по умолчанию config.LOG_JSON)
+        **kwargs: Дополнительные параметры logger.add
+
+    Returns:
+        int: Идентификатор sink
+    """
+    target = target or config.LOG_FILE
+    if isinstance(target, str):
+        target = RotatingFile(target, config.LOG_FILE_MAX_MB * 1024 * 1024, config.LOG_FILE_BACKUPS)
+    json_logs = config.LOG_JSON if json_logs is None else json_logs
+    kwargs.setdefault("level", "INFO")
+    writer = BackgroundWriter(target, name="log-writer-file")
+    return logger.add(writer, format=json_format if json_logs else FILE_FORMAT, **kwargs)
+
+
+def setup_logging() -> None:
+    """Консоль и файл; оба sink пишут вне цикла событий"""
+    logger.remove()  # Удаляем стандартный обработчик
+    logger.add(
+        BackgroundWriter(sys.stderr, name="log-writer-console"),
+        format=CONSOLE_FORMAT,
+        level=config.LOG_LEVEL,
+        colorize=sys.stderr.isatty(),
+    )
+    add_file_sink()
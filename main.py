@@ -4,251 +4,190 @@
 """
 
 import asyncio
-import sys
+from typing import Optional, Tuple
+
 from loguru import logger
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
+from ai_client import ai_client
 from config import config
 from database_async import db
+from dedup import SeenUpdates
+from fsm_storage import MemoryTTLStorage, SQLiteStorage
 from handlers import router
-from datetime import datetime, timedelta, timezone
+from leader import LeaseElector
+from log_stream import LogStream
+from logging_setup import setup_logging
+from metrics import start_exporter
+from middlewares import APICallCounter, ChatSerializer, Deduplicate, HandlerMetrics, Throttle, UpdateLatency, UserContext
+from reminder import ReminderEngine, shard_job_name
+from webhook import run_webhook
+from workers import run_front
 
-# Очередь для RT-логов
-LOG_QUEUE: asyncio.Queue | None = None
 
-# Состояние напоминаний в памяти: {quest_id: {"h1": bool, "overdue": bool}}
-REMINDER_STATE = {}
-# Ежедневные напоминания: {(quest_id, date_str, hhmm): True}
-DAILY_REMINDER_STATE = {}
+def _reminder_elector(bot: Bot, index: int, count: int) -> LeaseElector:
+    """Аренда шарда напоминаний: лидер шарда запускает свой ReminderEngine"""
 
+    async def elected():
+        engine = ReminderEngine(bot, shard=(index, count))
+        bot.reminder_engines[index] = engine
+        engine.start()
 
-async def reminder_loop(bot: Bot):
-    """Фоновая задача: рассылает напоминания за час до дедлайна и по просрочке"""
-    global REMINDER_STATE, DAILY_REMINDER_STATE
-    while True:
-        try:
-            quests = await db.get_quests_with_deadlines()
-            now_utc = datetime.now(timezone.utc)
-            for q in quests:
-                # Порядок: quest_id(0), user_id(1), title(2), quest_type(3), target(4), current(5),
-                # completed(6), deadline(7), comment(8), created_at(9), has_date(10), has_time(11)
-                quest_id, user_id, title = q[0], q[1], q[2]
-                completed = bool(q[6])
-                deadline_str = q[7]
-                has_date = bool(q[10]) if len(q) > 10 else True
-                if completed or not deadline_str or not has_date:
-                    continue
-                try:
-                    dt_deadline_utc = datetime.strptime(deadline_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-                except Exception:
-                    continue
-                delta = dt_deadline_utc - now_utc
-                state = REMINDER_STATE.setdefault(quest_id, {"h1": False, "overdue": False})
-                # Напоминание за час
-                if 0 <= delta.total_seconds() <= 3600 and not state["h1"]:
-                    tz_off, _ = await db.get_user_timezone(user_id)
-                    dt_local = dt_deadline_utc + timedelta(minutes=int(tz_off or 0))
-                    time_str = dt_local.strftime("%H:%M")
-                    date_str = dt_local.strftime("%d.%m.%y")
-                    try:
-                        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                        kb = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="🔎 Открыть квест", callback_data=f"quest_{quest_id}")],
-                            [InlineKeyboardButton(text="📋 Квесты", callback_data="my_quests_inline")],
-                        ])
-                        await bot.send_message(user_id, f"🟡 Напоминание: до дедлайна квеста «{title}» остался 1 час.\nДедлайн: {date_str} {time_str}", reply_markup=kb)
-                        state["h1"] = True
-                    except Exception:
-                        pass
-                # Просрочка
-                if delta.total_seconds() < 0 and not state["overdue"]:
-                    tz_off, _ = await db.get_user_timezone(user_id)
-                    dt_local = dt_deadline_utc + timedelta(minutes=int(tz_off or 0))
-                    time_str = dt_local.strftime("%H:%M")
-                    date_str = dt_local.strftime("%d.%m.%y")
-                    try:
-                        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                        kb = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="🔎 Открыть квест", callback_data=f"quest_{quest_id}")],
-                            [InlineKeyboardButton(text="📋 Квесты", callback_data="my_quests_inline")],
-                        ])
-                        await bot.send_message(user_id, f"🔴 Просрочен дедлайн по квесту «{title}».\nДедлайн был: {date_str} {time_str}", reply_markup=kb)
-                        state["overdue"] = True
-                    except Exception:
-                        pass
-            # Daily reminders
-            try:
-                # Получим всех пользователей и проверим локальное время каждого
-                user_ids = await db.get_all_user_ids()
-                for uid in user_ids:
-                    tz_off, _ = await db.get_user_timezone(uid)
-                    dt_local = now_utc + timedelta(minutes=int(tz_off or 0))
-                    hhmm = dt_local.strftime("%H:%M")
-                    today_str = dt_local.strftime("%Y-%m-%d")
-                    # 1..7, где Пн=1
-                    weekday = int(dt_local.isoweekday())
-                    dailies = await db.get_user_daily_quests(uid)
-                    if not dailies:
-                        continue
-                    for dq in dailies:
-                        qid = dq[0]
-                        title = dq[2]
-                        daily_rt = (dq[16] if len(dq) > 16 else None)  # daily_reminder_time
-                        repeat_days = (dq[13] if len(dq) > 13 else None)
-                        if not daily_rt:
-                            continue
-                        if daily_rt != hhmm:
-                            continue
-                        # Проверка repeat_days: пусто/NULL -> каждый день
-                        ok_day = True
-                        try:
-                            if repeat_days and repeat_days.strip() != "":
-                                days = [int(p.strip()) for p in repeat_days.split(',') if p.strip()]
-                                ok_day = (weekday in days)
-                        except Exception:
-                            ok_day = True
-                        if not ok_day:
-                            continue
-                        # Проверка «ещё не выполнено сегодня»
-                        try:
-                            done_today = await db.is_done_today(uid, qid)
-                        except Exception:
-                            done_today = False
-                        if done_today:
-                            continue
-                        # Дедупликация на один и тот же день и минуту
-                        key = (qid, today_str, hhmm)
-                        if DAILY_REMINDER_STATE.get(key):
-                            continue
-                        try:
-                            from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                            kb = InlineKeyboardMarkup(inline_keyboard=[
-                                [InlineKeyboardButton(text="🔎 Открыть", callback_data=f"quest_{qid}")],
-                                [InlineKeyboardButton(text="📋 Квесты", callback_data="my_quests_inline")],
-                            ])
-                            await bot.send_message(uid, f"📅 Напоминание: {title}. Не забудьте выполнить ежедневную задачу!", reply_markup=kb)
-                            DAILY_REMINDER_STATE[key] = True
-                        except Exception:
-                            pass
-            except Exception as e:
-                logger.warning(f"Daily reminder error: {e}")
+    async def demoted():
+        engine = bot.reminder_engines.pop(index, None)
+        if engine:
+            await engine.stop()
 
-            # Пауза между циклами
-            await asyncio.sleep(60)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            logger.warning(f"Reminder loop error: {e}")
-            await asyncio.sleep(60)
+    preferred = config.REMINDER_SHARD_INDEX.strip()
+    takeover_delay = 0.0 if not preferred or int(preferred) == index else config.LEASE_TTL_SECONDS
+    return LeaseElector(shard_job_name(index, count), elected, demoted, takeover_delay=takeover_delay)
 
 
-async def on_startup(bot: Bot):
-    """Действия при запуске бота"""
-    logger.info("🚀 Запуск бота...")
-    # Инициализация базы данных
-    await db.init_db()
-    logger.info("✅ База данных готова")
-    # Запуск фоновой задачи напоминаний
-    bot.reminder_task = asyncio.create_task(reminder_loop(bot))
-    # Настройка RT-логов
-    global LOG_QUEUE
-    LOG_QUEUE = asyncio.Queue()
-    loop = asyncio.get_running_loop()
+def _log_dispatch_elector(bot: Bot) -> LeaseElector:
+    """Аренда рассылки RT-логов: подписчики получают логи одного экземпляра, без дублей"""
 
-    def _sink(message):
-        try:
-            loop.call_soon_threadsafe(LOG_QUEUE.put_nowait, str(message))
-        except Exception:
-            pass
+    async def elected():
+        await db.load_log_subscribers()
+        _start_log_dispatch(bot)
+
+    async def demoted():
+        await _stop_log_dispatch(bot)
+
+    return LeaseElector("log_dispatch", elected, demoted)
 
-    # Дополнительный sink для логов (оставляем stderr и файл как есть)
-    bot.log_sink_id = logger.add(_sink, level="INFO")
 
-    async def _log_dispatcher():
-        while True:
-            try:
-                line = await LOG_QUEUE.get()
-                subs = await db.get_log_subscribers()
-                if not subs:
-                    continue
-                # Отправляем только информативные строки, без слишком длинных
-                text = line[-800:]
-                for uid in subs:
-                    try:
-                        await bot.send_message(uid, f"📟 {text}")
-                    except Exception:
-                        pass
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.warning(f"log dispatcher error: {e}")
-                await asyncio.sleep(0.5)
+def _start_log_dispatch(bot: Bot) -> None:
+    """Запуск рассылки RT-логов подписчикам"""
+    bot.log_stream = LogStream(bot)
+    bot.log_stream.start()
 
-    bot.log_task = asyncio.create_task(_log_dispatcher())
 
+async def _stop_log_dispatch(bot: Bot) -> None:
+    """Останов рассылки RT-логов"""
+    stream = getattr(bot, "log_stream", None)
+    if stream:
+        await stream.stop()
+        bot.log_stream = None
 
-async def on_shutdown(bot: Bot):
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher):
+    """Действия при запуске бота"""
+    logger.info("🚀 Запуск бота...")
+    # Инициализация базы данных
+    await db.init_db()
+    logger.info("✅ База данных готова")
+    # Очистка диалогов FSM (для SQLite — восстановление незавершённых и фоновая запись)
+    if isinstance(dispatcher.storage, MemoryTTLStorage):
+        await dispatcher.storage.start()
+    # Номера уже обработанных обновлений (повторы после перезапуска отбрасываются)
+    seen = dispatcher.get("seen_updates")
+    if seen is not None:
+        await seen.start()
+    # Общая сессия AI-клиента (пул соединений на всё время работы)
+    if config.WINDSURF_API_KEY:
+        await ai_client.start()
+    # Фоновые задачи выполняет только держатель аренды (несколько экземпляров на одной базе)
+    bot.reminder_engines = {}
+    bot.electors = [_log_dispatch_elector(bot)]
+    for index in range(config.REMINDER_SHARD_COUNT):
+        bot.electors.append(_reminder_elector(bot, index, config.REMINDER_SHARD_COUNT))
+    for elector in bot.electors:
+        elector.start()
+    # Эндпоинт метрик для Prometheus
+    bot.metrics_runner = None
+    if config.METRICS_PORT:
+        bot.metrics_runner = await start_exporter(config.METRICS_PORT)
+        logger.info(f"📈 Метрики: http://0.0.0.0:{config.METRICS_PORT}/metrics")
+
+
+async def on_shutdown(bot: Bot, dispatcher: Dispatcher):
     """Действия при остановке бота"""
     logger.info("🛑 Остановка бота...")
-    # Убираем дополнительный sink, чтобы прекратить отправку RT-логов
-    sink_id = getattr(bot, "log_sink_id", None)
-    if sink_id is not None:
-        try:
-            logger.remove(sink_id)
-        except Exception:
-            pass
-    # Останов фоновой задачи
-    task = getattr(bot, "reminder_task", None)
-    if task:
-        task.cancel()
-        try:
-            await task
-        except Exception:
-            pass
-    # Останов лог-диспетчера
-    ltask = getattr(bot, "log_task", None)
-    if ltask:
-        ltask.cancel()
-        try:
-            await ltask
-        except Exception:
-            pass
-    # Обнуляем очередь логов
-    global LOG_QUEUE
-    LOG_QUEUE = None
+    # Дописать номера обработанных обновлений
+    seen = dispatcher.get("seen_updates")
+    if seen is not None:
+        await seen.close()
+    # Останов фоновых задач и освобождение аренд
+    for elector in getattr(bot, "electors", []):
+        await elector.stop()
+    # Закрытие сессии AI-клиента
+    await ai_client.close()
+    runner = getattr(bot, "metrics_runner", None)
+    if runner:
+        await runner.cleanup()
+
+
+def create_bot() -> Bot:
+    """Бот с учётом вызовов API; TELEGRAM_API_URL — локальный Bot API server или mock"""
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL)) if config.TELEGRAM_API_URL else None
+    bot = Bot(token=config.BOT_TOKEN, session=session)
+    bot.session.middleware(APICallCounter())
+    return bot
+
+
+def create_dispatcher(shard: Optional[Tuple[int, int]] = None) -> Dispatcher:
+    """
+    Диспетчер с хранилищем диалогов, цепочкой middleware и обработчиками (без startup/shutdown)
+
+    Args:
+        shard: (номер, число) рабочего процесса — диалоги FSM только своих пользователей
+    """
+    storage = SQLiteStorage(shard=shard) if config.FSM_STORAGE == "sqlite" else MemoryTTLStorage()
+    # Встроенный FSMContextMiddleware (dp.fsm) подключается ниже — после ChatSerializer
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    # Повторно доставленные обновления отбрасываются до всего остального (запуск и запись — в on_startup)
+    dp["seen_updates"] = SeenUpdates()
+    dp.update.outer_middleware(Deduplicate(dp["seen_updates"]))
+    # Задержка обновления от получения до конца обработки (polling и webhook)
+    dp.update.outer_middleware(UpdateLatency())
+    # Антифлуд до постановки в очередь: лишние обновления не занимают очередь чата
+    dp.update.outer_middleware(Throttle())
+    # Обновления одного чата — по очереди, разных чатов — параллельно (до UPDATE_WORKERS)
+    dp.update.outer_middleware(ChatSerializer())
+    # Состояние диалога читается уже в очереди чата: следующее обновление видит состояние,
+    # установленное предыдущим, и фильтры по состоянию не обгоняют его
+    dp.update.outer_middleware(dp.fsm)
+    # Профиль пользователя один раз на обновление — уже в очереди чата, после предыдущих изменений
+    dp.update.outer_middleware(UserContext())
+    # Метрики по обработчикам: время, обращения к базе и Telegram API, исключения
+    dp.message.middleware(HandlerMetrics("message"))
+    dp.callback_query.middleware(HandlerMetrics("callback_query"))
+    
+    # Регистрация роутера с обработчиками
+    dp.include_router(router)
+    return dp
 
 
 async def main():
     """Основная функция запуска бота"""
     
-    # Настройка логирования
-    logger.remove()  # Удаляем стандартный обработчик
-    logger.add(
-        sys.stderr,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
-        level=config.LOG_LEVEL
-    )
-    logger.add(
-        "bot.log",
-        rotation="10 MB",
-        retention="7 days",
-        level="INFO",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function} - {message}"
-    )
+    # Настройка логирования (запись в консоль и файл — из фонового потока)
+    setup_logging()
     
     # Валидация конфигурации
     if not config.validate():
         logger.error("❌ Ошибка конфигурации! Проверьте файл .env")
         return
     
-    # Создание бота и диспетчера
-    bot = Bot(token=config.BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    # Несколько рабочих процессов: этот процесс только принимает и распределяет обновления
+    if config.WORKERS > 0:
+        bot = create_bot()
+        try:
+            logger.info(f"📥 Обновления: {config.BOT_MODE}, рабочих процессов: {config.WORKERS}")
+            await run_front(bot, config.WORKERS)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            logger.info("🛑 Остановка приёмника")
+        finally:
+            await bot.session.close()
+            logger.info("👋 Бот остановлен")
+            await logger.complete()
+        return
     
-    # Регистрация роутера с обработчиками
-    dp.include_router(router)
+    # Создание бота и диспетчера
+    bot = create_bot()
+    dp = create_dispatcher()
     
     # Регистрация startup/shutdown функций
     dp.startup.register(on_startup)
@@ -258,7 +197,15 @@ async def main():
         logger.info("✅ Бот запущен и готов к работе!")
         logger.info(f"📊 База данных: {config.DATABASE_PATH}")
         logger.info(f"🤖 AI: {'Включен' if config.WINDSURF_API_KEY else 'Выключен'}")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        logger.info(f"📥 Обновления: {config.BOT_MODE}")
+        if config.BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # getUpdates не работает, пока установлен webhook (например, после запуска в режиме webhook)
+            await bot.delete_webhook()
+            await dp.start_polling(
+                bot, allowed_updates=dp.resolve_used_update_types(), handle_as_tasks=True, close_bot_session=False, transport="polling"
+            )
     except asyncio.CancelledError:
         logger.info("🛑 Остановка: polling отменен")
     except KeyboardInterrupt:
@@ -272,8 +219,11 @@ async def main():
             await dp.storage.wait_closed()
         except Exception:
             pass
+        await db.close()
         await bot.session.close()
         logger.info("👋 Бот остановлен")
+        # Дописать очередь логов перед выходом
+        await logger.complete()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""
+Метрики процесса в памяти: счётчики, гейджи и гистограммы
+Используются фоновыми задачами и обработчиками для диагностики производительности.
+Метрика может иметь метки (handler="cb_my_quests"); prometheus() отдаёт все метрики
+в текстовом формате Prometheus, start_exporter() — по HTTP
+"""
+
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, le: Optional[str] = None) -> str:
+    """{k="v",...} в формате Prometheus; le — граница корзины гистограммы"""
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Монотонно растущий счётчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str = "", labels: Labels = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Gauge:
+    """Текущее значение величины (может расти и уменьшаться)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str = "", labels: Labels = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS, labels: Labels = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 6),
+        }
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса; повторная регистрация возвращает существующую метрику"""
+
+    def __init__(self):
+        # (имя, метки) -> метрика
+        self._metrics: Dict[Tuple[str, Labels], object] = {}
+
+    def _get_or_create(self, cls, name: str, help_text: str, labels: Optional[Dict[str, str]] = None, **kwargs):
+        key = (name, _labels(labels))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = cls(name, help_text, labels=key[1], **kwargs)
+            self._metrics[key] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str = "", labels: Optional[Dict[str, str]] = None) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "", labels: Optional[Dict[str, str]] = None) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str = "",
+        buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def family(self, name: str) -> List[Tuple[Dict[str, str], object]]:
+        """Все метрики с этим именем: [(метки, метрика)]"""
+        return [(dict(labels), m) for (n, labels), m in self._metrics.items() if n == name]
+
+    def snapshot(self) -> Dict[str, object]:
+        """Текущие значения всех метрик (ключ — имя с метками)"""
+        return {name + _format_labels(labels): m.snapshot() for (name, labels), m in sorted(self._metrics.items())}
+
+    def prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        described = set()
+        for (name, labels), m in sorted(self._metrics.items()):
+            if name not in described:
+                described.add(name)
+                if m.help:
+                    lines.append(f"# HELP {name} {m.help}")
+                lines.append(f"# TYPE {name} {m.kind}")
+            if isinstance(m, Histogram):
+                cumulative = 0
+                for bound, count in zip(m.buckets, m.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, _number(bound))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, '+Inf')} {m.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_number(m.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {m.count}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_number(m.value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр метрик
+metrics = MetricsRegistry()
+
+
+async def start_exporter(port: int, host: str = "0.0.0.0", registry: MetricsRegistry = metrics):
+    """HTTP-эндпоинт /metrics в формате Prometheus; возвращает aiohttp AppRunner (runner.cleanup() — остановка)"""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.prometheus(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
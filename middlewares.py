@@ -0,0 +1,364 @@
+"""
+Middleware диспетчера aiogram
+Throttle ограничивает частоту обновлений от одного пользователя: у каждого класса действий
+(запись в базу, навигация по кнопкам, сообщения) своё ведро токенов, лишние обновления
+отбрасываются до обработки, повторные нажатия той же кнопки, пока первое не обработано,
+объединяются с ним. ChatSerializer упорядочивает обработку: обновления одного чата выполняются
+строго по очереди в порядке поступления (два быстрых нажатия одного пользователя не гонятся
+в update_quest_progress или toggle_list_item), обновления разных чатов — параллельно,
+но не больше заданного числа одновременно. UserContext загружает (и при необходимости
+создаёт) профиль пользователя один раз на обновление и передаёт его обработчикам
+параметром profile. HandlerMetrics по каждому обработчику и типу обновления считает
+время, обращения к базе, вызовы Telegram API и исключения. UpdateLatency измеряет задержку
+обновления от получения (и от отправки пользователем) до конца обработки — отдельно для
+long polling и webhook. Deduplicate отбрасывает повторно доставленные обновления
+(по update_id) до всех остальных middleware
+"""
+
+import asyncio
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery, Chat, TelegramObject, Update, User
+from loguru import logger
+
+from callbacks import WRITE_ACTIONS, CallbackRouter, unpack
+from config import config
+from database_async import DB_USAGE, UserProfile, db
+from dedup import SeenUpdates
+from metrics import metrics
+from resilience import UserQuota
+
+UPDATES_QUEUED = metrics.gauge("updates_queued", "Обновления, ожидающие своей очереди в чате или свободного обработчика")
+UPDATES_INFLIGHT = metrics.gauge("updates_inflight", "Обновления в обработке")
+UPDATE_CHATS_ACTIVE = metrics.gauge("update_chats_active", "Чаты с обновлениями в обработке или в очереди")
+UPDATE_CHAT_QUEUE_DEPTH = metrics.histogram(
+    "update_chat_queue_depth", "Очередь чата при поступлении обновления (1 — без ожидания других обновлений чата)",
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+UPDATE_WAIT_SECONDS = metrics.histogram("update_wait_seconds", "Ожидание обновления до начала обработки")
+UPDATE_HANDLE_SECONDS = metrics.histogram("update_handle_seconds", "Длительность обработки обновления")
+
+USER_PROFILES_CREATED = metrics.counter("user_profiles_created_total", "Новые пользователи, созданные при загрузке профиля")
+THROTTLE_COALESCED = metrics.counter("throttle_coalesced_total", "Повторные нажатия кнопки, объединённые с необработанным первым")
+
+TELEGRAM_API_CALLS = metrics.counter("telegram_api_calls_total", "Вызовы Telegram Bot API")
+
+# Вызовы Telegram API в текущем контексте (обработчике обновления): [число]; None — не учитываются
+API_CALLS: ContextVar[Optional[list]] = ContextVar("api_calls", default=None)
+# Корзины гистограмм числа вызовов в одном обработчике
+CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+class Throttle(BaseMiddleware):
+    """Внешний middleware dp.update: вёдра токенов на пользователя по классам действий"""
+
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None, max_users: int = 100000, clock=time.monotonic):
+        """
+        Args:
+            limits: {класс: (в минуту, подряд)}; по умолчанию из config.THROTTLE_*; подряд 0 — без ограничения
+            max_users: Сколько пользователей помнить в каждом ведре
+            clock: Источник времени (для тестов)
+        """
+        limits = limits or {
+            "write": (config.THROTTLE_WRITE_PER_MINUTE, config.THROTTLE_WRITE_BURST),
+            "nav": (config.THROTTLE_NAV_PER_MINUTE, config.THROTTLE_NAV_BURST),
+            "message": (config.THROTTLE_MESSAGE_PER_MINUTE, config.THROTTLE_MESSAGE_BURST),
+        }
+        self.quotas = {
+            cls: UserQuota(f"throttle_{cls}", per_minute=per_minute, burst=burst, max_users=max_users, clock=clock)
+            for cls, (per_minute, burst) in limits.items()
+        }
+        # (user_id, callback_data) нажатий, которые ещё в очереди или в обработке
+        self.pending: set = set()
+
+    @staticmethod
+    def classify(update: Update) -> Optional[str]:
+        """Класс действия обновления; None — без ограничения"""
+        if update.callback_query is not None:
+            code, _ = unpack(update.callback_query.data)
+            return "write" if code in WRITE_ACTIONS else "nav"
+        if update.message is not None:
+            return "message"
+        return None
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        cls = self.classify(event) if isinstance(event, Update) else None
+        quota = self.quotas.get(cls)
+        if user is None or quota is None:
+            return await handler(event, data)
+        callback = event.callback_query
+        press = (user.id, callback.data) if callback is not None else None
+        if press is not None and press in self.pending:
+            # Та же кнопка нажата ещё раз до обработки первого нажатия
+            THROTTLE_COALESCED.inc()
+            await self._answer(callback)
+            return None
+        retry_after = quota.acquire(user.id)
+        if retry_after:
+            logger.debug(f"Throttle: user {user.id} {cls}, retry in {retry_after:.1f}s")
+            if callback is not None:
+                await self._answer(callback, f"⏳ Слишком часто, подожди {max(1, round(retry_after))} с")
+            return None
+        if press is None:
+            return await handler(event, data)
+        self.pending.add(press)
+        try:
+            return await handler(event, data)
+        finally:
+            self.pending.discard(press)
+
+    @staticmethod
+    async def _answer(callback: CallbackQuery, text: Optional[str] = None) -> None:
+        """Убрать «часики» с кнопки, не выполняя действие"""
+        try:
+            await callback.answer(text)
+        except Exception as e:
+            logger.debug(f"Throttle answer failed: {e}")
+
+
+class _ChatQueue:
+    """Очередь одного чата: блокировка (asyncio.Lock пропускает ожидающих по порядку) и их число"""
+
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatSerializer(BaseMiddleware):
+    """Внешний middleware dp.update: порядок внутри чата и предел одновременных обработчиков"""
+
+    def __init__(self, max_workers: Optional[int] = None, clock=time.perf_counter):
+        """
+        Args:
+            max_workers: Предел одновременно обрабатываемых обновлений (по умолчанию config.UPDATE_WORKERS)
+            clock: Источник времени для метрик (для тестов)
+        """
+        self.max_workers = max_workers or config.UPDATE_WORKERS
+        self.clock = clock
+        self.workers = asyncio.Semaphore(self.max_workers)
+        self.chats: Dict[Any, _ChatQueue] = {}
+        self.queued = 0
+        self.inflight = 0
+
+    @staticmethod
+    def key(data: Dict[str, Any]) -> Any:
+        """Ключ очереди: чат, для событий без чата — пользователь, иначе без упорядочивания"""
+        chat: Optional[Chat] = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user: Optional[User] = data.get("event_from_user")
+        if user is not None:
+            return ("user", user.id)
+        return None
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        key = self.key(data)
+        queue = self._enter(key)
+        queued_at = self.clock()
+        waiting = True
+        try:
+            # Сначала очередь чата, затем обработчик: ждущий своей очереди чат не занимает обработчик
+            async with queue.lock if queue else nullcontext():
+                async with self.workers:
+                    started = self.clock()
+                    UPDATE_WAIT_SECONDS.observe(started - queued_at)
+                    waiting = False
+                    self._count(queued=-1, inflight=1)
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self._count(inflight=-1)
+                        UPDATE_HANDLE_SECONDS.observe(self.clock() - started)
+        finally:
+            if waiting:
+                # Отменено в очереди
+                self._count(queued=-1)
+            self._leave(key, queue)
+
+    def _count(self, queued: int = 0, inflight: int = 0) -> None:
+        self.queued += queued
+        self.inflight += inflight
+        UPDATES_QUEUED.set(self.queued)
+        UPDATES_INFLIGHT.set(self.inflight)
+
+    def _enter(self, key: Any) -> Optional[_ChatQueue]:
+        self._count(queued=1)
+        if key is None:
+            return None
+        queue = self.chats.get(key)
+        if queue is None:
+            queue = self.chats[key] = _ChatQueue()
+            UPDATE_CHATS_ACTIVE.set(len(self.chats))
+        queue.depth += 1
+        UPDATE_CHAT_QUEUE_DEPTH.observe(queue.depth)
+        return queue
+
+    def _leave(self, key: Any, queue: Optional[_ChatQueue]) -> None:
+        if queue is None:
+            return
+        queue.depth -= 1
+        if queue.depth == 0:
+            # Чат без обновлений не хранится
+            del self.chats[key]
+            UPDATE_CHATS_ACTIVE.set(len(self.chats))
+
+
+class Deduplicate(BaseMiddleware):
+    """Внешний middleware dp.update (первый в цепочке): повторно доставленное обновление не обрабатывается"""
+
+    def __init__(self, seen: SeenUpdates):
+        self.seen = seen
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if isinstance(event, Update) and not self.seen.add(event.update_id):
+            logger.debug(f"Повтор обновления {event.update_id} отброшен")
+            return None
+        return await handler(event, data)
+
+
+class UpdateLatency(BaseMiddleware):
+    """
+    Внешний middleware dp.update (первый в цепочке): задержка обновления до конца обработки
+
+    update_latency_seconds — от получения обновления процессом (ответ getUpdates или запрос
+    webhook), update_age_seconds — от даты сообщения в Telegram (точность — секунда; только
+    обновления с датой). Метка transport — из данных диспетчера (start_polling(transport=...)
+    или данные обработчика webhook)
+    """
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        received = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            labels = {"transport": data.get("transport", "unknown")}
+            metrics.histogram("update_latency_seconds", "Задержка от получения обновления до конца обработки", labels=labels).observe(
+                time.perf_counter() - received
+            )
+            sent = self.sent_at(event)
+            if sent is not None:
+                metrics.histogram("update_age_seconds", "Задержка от отправки сообщения до конца обработки", labels=labels).observe(
+                    max(0.0, time.time() - sent)
+                )
+
+    @staticmethod
+    def sent_at(update: TelegramObject) -> Optional[float]:
+        """Время отправки сообщения пользователем (unix), если оно есть в обновлении"""
+        if getattr(update, "edited_message", None) is not None and update.edited_message.edit_date:
+            return float(update.edited_message.edit_date)
+        message = getattr(update, "message", None)
+        return message.date.timestamp() if message is not None else None
+
+
+class UserContext(BaseMiddleware):
+    """Внешний middleware dp.update: профиль пользователя в data["profile"]"""
+
+    def __init__(self, database=None):
+        """
+        Args:
+            database: База данных (по умолчанию глобальная db)
+        """
+        self.database = database or db
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            profile: UserProfile = await self.database.get_or_create_user(user.id, user.first_name or user.username or "User")
+            if profile.created:
+                USER_PROFILES_CREATED.inc()
+            data["profile"] = profile
+        return await handler(event, data)
+
+
+class APICallCounter(BaseRequestMiddleware):
+    """Middleware сессии бота: учёт вызовов Telegram API (bot.session.middleware(APICallCounter()))"""
+
+    async def __call__(self, make_request, bot, method):
+        TELEGRAM_API_CALLS.inc()
+        calls = API_CALLS.get()
+        if calls is not None:
+            calls[0] += 1
+        return await make_request(bot, method)
+
+
+def handler_name(data: Dict[str, Any], event: TelegramObject) -> str:
+    """Имя функции-обработчика; для CallbackRouter — обработчик действия из callback_data"""
+    handler_object = data.get("handler")
+    callback = getattr(handler_object, "callback", None)
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, CallbackRouter):
+        callback = owner.resolve(getattr(event, "data", None))
+        if callback is None:
+            return "unknown_callback"
+    return getattr(callback, "__name__", None) or "unknown"
+
+
+class HandlerMetrics(BaseMiddleware):
+    """
+    Внутренний middleware (dp.message.middleware(HandlerMetrics("message"))): метрики по обработчику
+
+    handler_seconds, handler_db_calls, handler_db_seconds, handler_api_calls — гистограммы,
+    handler_errors_total — счётчик; метки handler (имя функции), update (тип обновления),
+    у ошибок ещё error (класс исключения)
+    """
+
+    def __init__(self, update_type: str):
+        self.update_type = update_type
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        labels = {"handler": handler_name(data, event), "update": self.update_type}
+        db_usage, api_calls = [0, 0.0], [0]
+        db_token, api_token = DB_USAGE.set(db_usage), API_CALLS.set(api_calls)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.counter("handler_errors_total", "Исключения в обработчиках", {**labels, "error": type(e).__name__}).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_USAGE.reset(db_token)
+            API_CALLS.reset(api_token)
+            metrics.histogram("handler_seconds", "Время обработчика", labels=labels).observe(elapsed)
+            metrics.histogram("handler_db_calls", "Обращения к базе за вызов обработчика", CALL_BUCKETS, labels).observe(db_usage[0])
+            metrics.histogram("handler_db_seconds", "Время обращений к базе за вызов обработчика", labels=labels).observe(db_usage[1])
+            metrics.histogram("handler_api_calls", "Вызовы Telegram API за вызов обработчика", CALL_BUCKETS, labels).observe(api_calls[0])
+
+
+def handler_report(limit: int = 20) -> str:
+    """Таблица обработчиков по суммарному времени (для /metrics)"""
+    rows: List[tuple] = []
+    errors: Dict[tuple, float] = {}
+    for labels, counter in metrics.family("handler_errors_total"):
+        key = (labels.get("handler"), labels.get("update"))
+        errors[key] = errors.get(key, 0) + counter.value
+    db_calls = {(l.get("handler"), l.get("update")): h for l, h in metrics.family("handler_db_calls")}
+    api_calls = {(l.get("handler"), l.get("update")): h for l, h in metrics.family("handler_api_calls")}
+    for labels, hist in metrics.family("handler_seconds"):
+        key = (labels.get("handler"), labels.get("update"))
+        if not hist.count:
+            continue
+        db_hist, api_hist = db_calls.get(key), api_calls.get(key)
+        rows.append((
+            hist.sum, key[0], hist.count, hist.sum / hist.count * 1000, hist.quantile(0.95) * 1000,
+            db_hist.sum / db_hist.count if db_hist and db_hist.count else 0.0,
+            api_hist.sum / api_hist.count if api_hist and api_hist.count else 0.0,
+            int(errors.get(key, 0)),
+        ))
+    if not rows:
+        return "Обработчики ещё не вызывались"
+    rows.sort(reverse=True)
+    lines = [f"{'обработчик':<24}{'вызовы':>7}{'ср,мс':>8}{'p95,мс':>8}{'БД':>5}{'API':>5}{'ошиб':>5}"]
+    for _, name, count, avg_ms, p95_ms, db_avg, api_avg, errs in rows[:limit]:
+        lines.append(f"{name[:24]:<24}{count:>7}{avg_ms:>8.1f}{p95_ms:>8.0f}{db_avg:>5.1f}{api_avg:>5.1f}{errs:>5}")
+    return "\n".join(lines)
@@ -0,0 +1,209 @@
+"""
+Локальный mock Windsurf AI: эндпоинт chat-completions для нагрузочных тестов без сети
+Задержка ответа с настраиваемым распределением и редкими «хвостами», доля ошибок HTTP,
+доля некорректного JSON и потоковый режим (SSE, как при stream=true).
+Квесты собираются локальным генератором по цели из промпта, остальные запросы
+получают короткий текст.
+
+Пример:
+    python mock_windsurf.py --port 8081 --latency-ms 800 --error-rate 0.05 --stream
+    WINDSURF_API_URL=http://127.0.0.1:8081/v1/chat/completions python main.py
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+from local_quests import local_quests
+
+_GOAL_RE = re.compile(r"Пользователь хочет:\s*(.+)")
+# Статусы ошибок, которые отдаёт mock (перегрузка, лимиты, сбой)
+ERROR_STATUSES = (500, 502, 503, 429)
+# Размер фрагмента текста в одном событии SSE, символов
+STREAM_CHUNK_CHARS = 12
+
+
+class MockWindsurf:
+    """Сервер chat-completions с управляемыми задержками и сбоями"""
+
+    def __init__(
+        self,
+        latency_ms: float = 300.0,
+        distribution: str = "lognormal",
+        spread: float = 0.5,
+        tail_rate: float = 0.0,
+        tail_ms: float = 20000.0,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        stream: bool = True,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            latency_ms: Медиана задержки ответа, мс
+            distribution: fixed, uniform (медиана ± spread·медиана) или lognormal (sigma = spread)
+            spread: Разброс задержки
+            tail_rate: Доля очень медленных ответов (задержка tail_ms)
+            tail_ms: Задержка медленного ответа, мс
+            error_rate: Доля ответов с ошибкой HTTP
+            malformed_rate: Доля ответов 200 с некорректным JSON
+            stream: Отвечать потоком SSE на запросы со stream=true
+            seed: Зерно генератора случайных чисел
+        """
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.spread = spread
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.stream = stream
+        self.rnd = random.Random(seed)
+        self.inflight = 0
+        self.stats: Dict[str, Any] = {"requests": 0, "ok": 0, "streamed": 0, "errors": 0, "malformed": 0, "max_inflight": 0}
+        self.runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запустить в текущем цикле событий; возвращает URL эндпоинта (port=0 — свободный порт)"""
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def delay(self) -> float:
+        """Задержка очередного ответа, с"""
+        if self.tail_rate and self.rnd.random() < self.tail_rate:
+            return self.tail_ms / 1000
+        median = self.latency_ms / 1000
+        if self.distribution == "uniform":
+            return max(0.0, self.rnd.uniform(median * (1 - self.spread), median * (1 + self.spread)))
+        if self.distribution == "lognormal" and median > 0:
+            return self.rnd.lognormvariate(math.log(median), self.spread)
+        return median
+
+    def content(self, payload: Dict[str, Any]) -> str:
+        """Ответ модели: квест в JSON для промпта генерации, иначе короткий текст"""
+        messages = payload.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        match = _GOAL_RE.search(prompt)
+        if match:
+            return json.dumps(local_quests.generate(match.group(1).strip()), ensure_ascii=False)
+        return "💪 Отличный темп! Ещё немного — и цель будет достигнута 🚀"
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.stats["requests"] += 1
+        self.inflight += 1
+        self.stats["max_inflight"] = max(self.stats["max_inflight"], self.inflight)
+        try:
+            try:
+                payload = await request.json()
+            except ValueError:
+                return web.json_response({"error": {"message": "invalid JSON body"}}, status=400)
+            delay = self.delay()
+            roll = self.rnd.random()
+            if roll < self.error_rate:
+                await asyncio.sleep(delay)
+                self.stats["errors"] += 1
+                status = self.rnd.choice(ERROR_STATUSES)
+                return web.json_response({"error": {"message": "mock failure", "code": status}}, status=status)
+            content = self.content(payload)
+            malformed = roll < self.error_rate + self.malformed_rate
+            if malformed:
+                self.stats["malformed"] += 1
+                # Обрыв посередине: в тексте ответа модели или во всём теле ответа
+                content = content[: len(content) // 2]
+                if self.rnd.random() < 0.5 and not payload.get("stream"):
+                    await asyncio.sleep(delay)
+                    return web.Response(text='{"choices": [{"message": {"content": ', content_type="application/json")
+            if payload.get("stream") and self.stream:
+                return await self.respond_stream(request, content, delay)
+            await asyncio.sleep(delay)
+            if not malformed:
+                self.stats["ok"] += 1
+            return web.json_response({
+                "id": f"mock-{self.stats['requests']}",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            })
+        finally:
+            self.inflight -= 1
+
+    async def respond_stream(self, request: web.Request, content: str, delay: float) -> web.StreamResponse:
+        """Поток SSE: первый фрагмент через треть задержки, остальные равномерно"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        chunks = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+        await asyncio.sleep(delay / 3)
+        step = (delay * 2 / 3) / len(chunks)
+        for chunk in chunks:
+            event = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": chunk}}]}
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(step)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        self.stats["streamed"] += 1
+        return response
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "inflight": self.inflight})
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры mock (общие для сервера и бенчмарка)"""
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="медиана задержки ответа, мс")
+    parser.add_argument("--distribution", choices=("fixed", "uniform", "lognormal"), default="lognormal", help="распределение задержки")
+    parser.add_argument("--spread", type=float, default=0.5, help="разброс: доля медианы (uniform) или sigma (lognormal)")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="доля очень медленных ответов")
+    parser.add_argument("--tail-ms", type=float, default=20000.0, help="задержка медленного ответа, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой HTTP (5xx/429)")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="доля ответов с некорректным JSON")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="игнорировать stream=true (ответ целиком)")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def from_args(args) -> MockWindsurf:
+    return MockWindsurf(
+        latency_ms=args.latency_ms,
+        distribution=args.distribution,
+        spread=args.spread,
+        tail_rate=args.tail_rate,
+        tail_ms=args.tail_ms,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        stream=args.stream,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный mock Windsurf AI (chat-completions)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+    mock = from_args(args)
+    print(f"Mock Windsurf AI: http://{args.host}:{args.port}/v1/chat/completions (статистика: /stats)")
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,525 @@
-import logging
+"""
+Единый асинхронный движок напоминаний
+Один планировщик (минутный тикер с догоняющим окном), один запрос к БД и один конвейер доставки.
+Правила напоминаний (за час, за день, просрочка, ежедневные) подключаются как политики
+"""
+
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Set
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
-class ReminderSystem:
-    def __init__(self, bot, database):
-        self.bot = bot
-        self.database = database
-        self.sent_reminders: Dict[int, Set[str]] = {}  # quest_id -> set of reminder types sent
-        self.is_running = False
-
-    async def start(self):
-        """Запуск системы напоминаний"""
-        self.is_running = True
-        logging.info("Система напоминаний запущена")
-        await self.check_reminders_loop()
-
-    async def stop(self):
-        """Остановка системы напоминаний"""
-        self.is_running = False
-        logging.info("Система напоминаний остановлена")
-
-    async def check_reminders_loop(self):
-        """Основной цикл проверки напоминаний"""
-        while self.is_running:
-            try:
-                await self.check_and_send_reminders()
-            except Exception as e:
-                logging.error(f"Ошибка в системе напоминаний: {e}")
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from loguru import logger
+
+from callbacks import pack
+from config import config
+from database_async import db
+from metrics import metrics
+
+REMINDER_JOB = "reminders"
+MINUTE = timedelta(minutes=1)
+# Ограничения одного сообщения дайджеста: текст (лимит Telegram — 4096) и кнопки квестов
+DIGEST_TEXT_LIMIT = 4000
+DIGEST_MAX_BUTTONS = 20
+
+REMINDER_TICK_SECONDS = metrics.histogram("reminder_tick_seconds", "Длительность цикла напоминаний")
+REMINDER_LAG = metrics.gauge("reminder_lag_seconds", "Отставание обработки от настенных часов")
+REMINDER_CATCHUP = metrics.counter("reminder_catchup_minutes_total", "Минуты, обработанные догоняющим окном")
+REMINDER_SENT = metrics.counter("reminder_messages_total", "Отправленные сообщения с напоминаниями")
+REMINDER_LATENCY = metrics.histogram(
+    "reminder_latency_seconds",
+    "Задержка доставки напоминания относительно момента срабатывания",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400),
+)
+
+
+def shard_job_name(index: int, count: int) -> str:
+    """Имя задачи шарда напоминаний (отметка планировщика и аренда)"""
+    return REMINDER_JOB if count <= 1 else f"{REMINDER_JOB}:{index}/{count}"
+
+
+def _utc_now() -> datetime:
+    """Текущее время UTC (часы планировщика по умолчанию)"""
+    return datetime.now(timezone.utc)
+
+
+def _floor_minute(dt: datetime) -> datetime:
+    return dt.replace(second=0, microsecond=0)
+
+
+def _ceil_minute(dt: datetime) -> datetime:
+    floored = _floor_minute(dt)
+    return floored if floored == dt else floored + MINUTE
+
+
+def _parse_utc(value: Optional[str]) -> Optional[datetime]:
+    """Строка 'YYYY-MM-DD HH:MM:SS' из БД -> aware datetime UTC"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except Exception:
+        return None
+
+
+class ReminderWindow:
+    """Интервал обработки (start, end] и текущее время цикла"""
+
+    def __init__(self, start: datetime, end: datetime, now_utc: datetime):
+        self.start = start
+        self.end = end
+        self.now_utc = now_utc
+        self._local_minutes: Dict[int, Dict[str, Tuple[str, int, datetime]]] = {}
+
+    def contains(self, moment: datetime) -> bool:
+        return self.start < moment <= self.end
+
+    def local_minutes(self, tz_off: int) -> Dict[str, Tuple[str, int, datetime]]:
+        """Минуты интервала в локальном времени: {hhmm: (date_str, weekday, минута UTC)}, Пн=1"""
+        cached = self._local_minutes.get(tz_off)
+        if cached is None:
+            cached = {}
+            count = int((self.end - self.start) / MINUTE)
+            for i in range(1, count + 1):
+                dt_utc = self.start + i * MINUTE
+                dt_local = dt_utc + timedelta(minutes=tz_off)
+                cached[dt_local.strftime("%H:%M")] = (dt_local.strftime("%Y-%m-%d"), int(dt_local.isoweekday()), dt_utc)
+            self._local_minutes[tz_off] = cached
+        return cached
+
+
+class ReminderPolicy:
+    """Базовая политика напоминаний.
+
+    Политика получает снимок кандидатов из БД и окно обработки и возвращает
+    напоминания, момент срабатывания которых попал в окно. Обращений к БД внутри политик нет.
+    """
 
-            # Проверяем каждые 5 минут
-            await asyncio.sleep(300)
+    name = ""
+    # Какие строки снимка нужны политике: "deadline" или "daily"
+    source = "deadline"
 
-    async def check_and_send_reminders(self):
-        """Проверка и отправка напоминаний"""
-        quests = self.database.get_quests_with_deadlines()
-        now = datetime.now()
+    def collect(self, rows: List[tuple], window: ReminderWindow) -> List[dict]:
+        raise NotImplementedError
 
-        for quest in quests:
-            quest_id = quest[0]
-            user_id = quest[1]
-            title = quest[2]
-            deadline_str = quest[7]
 
-            if not deadline_str:
+class _DeadlinePolicy(ReminderPolicy):
+    """Общая логика политик по дедлайну.
+
+    Строка снимка: (quest_id, user_id, title, deadline, created_at, tz_offset_minutes)
+    """
+
+    source = "deadline"
+    emoji = ""
+
+    def trigger_at(self, deadline: datetime, tz_off: int) -> Optional[datetime]:
+        raise NotImplementedError
+
+    def is_due(self, deadline: datetime, window: ReminderWindow) -> bool:
+        raise NotImplementedError
+
+    def expires_at(self, deadline: datetime, tz_off: int) -> Optional[datetime]:
+        """Момент, после которого напоминание теряет смысл (None — без ограничения)"""
+        return None
+
+    def render(self, title: str, date_str: str, time_str: str) -> Tuple[str, str]:
+        raise NotImplementedError
+
+    def collect(self, rows: List[tuple], window: ReminderWindow) -> List[dict]:
+        result = []
+        for quest_id, user_id, title, deadline_str, created_str, tz_off in rows:
+            deadline = _parse_utc(deadline_str)
+            if deadline is None or not self.is_due(deadline, window):
+                continue
+            tz_off = int(tz_off or 0)
+            trigger = self.trigger_at(deadline, tz_off)
+            if trigger is None:
+                continue
+            # Квест, созданный внутри окна, срабатывает не раньше момента создания
+            created = _parse_utc(created_str)
+            if created is not None:
+                trigger = max(trigger, _ceil_minute(created))
+            if not window.contains(trigger):
                 continue
+            expires = self.expires_at(deadline, tz_off)
+            if expires is not None and trigger >= expires:
+                continue
+            dt_local = deadline + timedelta(minutes=tz_off)
+            text, line = self.render(title, dt_local.strftime("%d.%m.%y"), dt_local.strftime("%H:%M"))
+            result.append({
+                "key": (self.name, quest_id),
+                "due": trigger,
+                "chat_id": user_id,
+                "quest_id": quest_id,
+                "title": title,
+                "emoji": self.emoji,
+                "open_text": "🔎 Открыть квест",
+                "text": text,
+                "line": line,
+            })
+        return result
+
+
+class HourBeforePolicy(_DeadlinePolicy):
+    """За час до дедлайна"""
+
+    name = "hour_before"
+    emoji = "🟡"
+
+    def trigger_at(self, deadline, tz_off):
+        return deadline - timedelta(hours=1)
+
+    def is_due(self, deadline, window):
+        return 0 <= (deadline - window.now_utc).total_seconds() <= 3600
+
+    def render(self, title, date_str, time_str):
+        return (
+            f"🟡 Напоминание: до дедлайна квеста «{title}» остался 1 час.\nДедлайн: {date_str} {time_str}",
+            f"🟡 «{title}» — дедлайн через час ({date_str} {time_str})",
+        )
+
+
+class DayBeforePolicy(_DeadlinePolicy):
+    """В начале дня, предшествующего дню дедлайна (по локальному времени пользователя)"""
+
+    name = "day_before"
+    emoji = "⏰"
+
+    def trigger_at(self, deadline, tz_off):
+        local_deadline = deadline + timedelta(minutes=tz_off)
+        local_midnight = local_deadline.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        return local_midnight - timedelta(minutes=tz_off)
+
+    def is_due(self, deadline, window):
+        # Последний час перед дедлайном покрывает hour_before
+        return (deadline - window.now_utc).total_seconds() > 3600
+
+    def expires_at(self, deadline, tz_off):
+        # Квест, созданный в день дедлайна, напоминания «за день» не получает
+        local_deadline = deadline + timedelta(minutes=tz_off)
+        return local_deadline.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(minutes=tz_off)
+
+    def render(self, title, date_str, time_str):
+        return (
+            f"⏰ Напоминание: завтра дедлайн квеста «{title}».\nДедлайн: {date_str} {time_str}",
+            f"⏰ «{title}» — дедлайн завтра ({date_str} {time_str})",
+        )
+
 
+class OverduePolicy(_DeadlinePolicy):
+    """Дедлайн просрочен"""
+
+    name = "overdue"
+    emoji = "🔴"
+
+    def trigger_at(self, deadline, tz_off):
+        return deadline
+
+    def is_due(self, deadline, window):
+        return deadline <= window.now_utc
+
+    def render(self, title, date_str, time_str):
+        return (
+            f"🔴 Просрочен дедлайн по квесту «{title}».\nДедлайн был: {date_str} {time_str}",
+            f"🔴 «{title}» — просрочен ({date_str} {time_str})",
+        )
+
+
+class DailyPolicy(ReminderPolicy):
+    """Ежедневные задачи в выбранное время и дни недели.
+
+    Строка снимка: (quest_id, user_id, title, repeat_days, last_done_date, daily_reminder_time, tz_offset_minutes)
+    """
+
+    name = "daily"
+    source = "daily"
+
+    def collect(self, rows, window):
+        result = []
+        for qid, uid, title, repeat_days, last_done_date, daily_rt, tz_off in rows:
+            if not daily_rt:
+                continue
+            local_minutes = window.local_minutes(int(tz_off or 0))
+            if daily_rt not in local_minutes:
+                continue
+            day_str, weekday, due = local_minutes[daily_rt]
+            # Проверка repeat_days: пусто/NULL -> каждый день
             try:
-                # Парсим дедлайн
-                try:
-                    deadline = datetime.strptime(deadline_str, "%Y-%m-%d %H:%M:%S")
-                except ValueError:
-                    deadline = datetime.strptime(deadline_str, "%Y-%m-%d")
-                    deadline = deadline.replace(hour=23, minute=59, second=59)
-
-                # Инициализируем множество отправленных напоминаний для этого квеста
-                if quest_id not in self.sent_reminders:
-                    self.sent_reminders[quest_id] = set()
-
-                # Проверяем, нужно ли отправить напоминание
-                time_until_deadline = deadline - now
-
-                # Напоминание за день до дедлайна (если задача на несколько дней)
-                deadline_date = deadline.date()
-                today_date = now.date()
-
-                # Если дедлайн сегодня
-                if deadline_date == today_date:
-                    # Напоминание за час до дедлайна
-                    if timedelta(minutes=55) <= time_until_deadline <= timedelta(hours=1, minutes=5):
-                        if "hour_before" not in self.sent_reminders[quest_id]:
-                            await self.send_reminder(user_id, title, "за час до дедлайна", deadline)
-                            self.sent_reminders[quest_id].add("hour_before")
-
-                # Если дедлайн завтра
-                elif deadline_date == (today_date + timedelta(days=1)):
-                    # Напоминание за день
-                    if "day_before" not in self.sent_reminders[quest_id]:
-                        # Отправляем в начале дня дедлайна (с 00:00 до 01:00)
-                        if now.hour == 0:
-                            await self.send_reminder(user_id, title, "за день до дедлайна", deadline)
-                            self.sent_reminders[quest_id].add("day_before")
-
-                # Если квест просрочен, удаляем из отслеживания
-                if time_until_deadline < timedelta(0):
-                    if quest_id in self.sent_reminders:
-                        del self.sent_reminders[quest_id]
+                if repeat_days and repeat_days.strip() != "":
+                    days = [int(p.strip()) for p in repeat_days.split(',') if p.strip()]
+                    if weekday not in days:
+                        continue
+            except Exception:
+                pass
+            # Проверка «ещё не выполнено в этот день»
+            if last_done_date and str(last_done_date) == day_str:
+                continue
+            result.append({
+                "key": (self.name, qid, day_str, daily_rt),
+                "due": due,
+                "chat_id": uid,
+                "quest_id": qid,
+                "title": title,
+                "emoji": "📅",
+                "open_text": "🔎 Открыть",
+                "text": f"📅 Напоминание: {title}. Не забудьте выполнить ежедневную задачу!",
+                "line": f"📅 «{title}» — ежедневная задача",
+            })
+        return result
 
-            except Exception as e:
-                logging.error(f"Ошибка обработки напоминания для квеста {quest_id}: {e}")
 
-    async def send_reminder(self, user_id, quest_title, reminder_type, deadline):
-        """Отправка напоминания пользователю"""
-        try:
-            deadline_str = deadline.strftime("%d.%m.%Y %H:%M") if deadline.hour != 0 or deadline.minute != 0 else deadline.strftime("%d.%m.%Y")
-            message = f"⏰ Напоминание {reminder_type}!\n\n🎯 Квест: {quest_title}\n📅 Дедлайн: {deadline_str}"
+# Доступные политики по имени (config.REMINDER_POLICIES)
+POLICIES = {
+    policy.name: policy
+    for policy in (HourBeforePolicy, DayBeforePolicy, OverduePolicy, DailyPolicy)
+}
+
+
+def build_policies(names: List[str]) -> List[ReminderPolicy]:
+    """Создать политики по списку имён; неизвестные имена пропускаются с предупреждением"""
+    policies = []
+    for name in names:
+        cls = POLICIES.get(name.strip())
+        if cls is None:
+            if name.strip():
+                logger.warning(f"⚠️ Неизвестная политика напоминаний: {name}")
+            continue
+        policies.append(cls())
+    return policies
+
+
+def _quest_keyboard(quest_id: int, open_text: str) -> InlineKeyboardMarkup:
+    """Клавиатура одиночного напоминания"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=open_text, callback_data=pack("quest", quest_id))],
+        [InlineKeyboardButton(text="📋 Квесты", callback_data=pack("my_quests_inline"))],
+    ])
+
+
+def _digest_keyboard(items: List[dict]) -> InlineKeyboardMarkup:
+    """Компактная клавиатура дайджеста: по две кнопки квестов в ряду"""
+    rows = []
+    row = []
+    for item in items:
+        title = item["title"]
+        label = f"{item['emoji']} {title[:20]}{'…' if len(title) > 20 else ''}"
+        row.append(InlineKeyboardButton(text=label, callback_data=pack("quest", item["quest_id"])))
+        if len(row) == 2:
+            rows.append(row)
+            row = []
+    if row:
+        rows.append(row)
+    rows.append([InlineKeyboardButton(text="📋 Квесты", callback_data=pack("my_quests_inline"))])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def _digest_chunks(items: List[dict]) -> List[List[dict]]:
+    """Разбить напоминания чата на сообщения в пределах DIGEST_TEXT_LIMIT и DIGEST_MAX_BUTTONS"""
+    chunks: List[List[dict]] = []
+    chunk: List[dict] = []
+    # Заголовок «🔔 Напоминания (N):» и пустая строка
+    size = 32
+    for item in items:
+        line = len(item["line"]) + 1
+        if chunk and (size + line > DIGEST_TEXT_LIMIT or len(chunk) >= DIGEST_MAX_BUTTONS):
+            chunks.append(chunk)
+            chunk, size = [], 32
+        chunk.append(item)
+        size += line
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
 
-            await self.bot.send_message(chat_id=user_id, text=message)
-            logging.info(f"Отправлено напоминание пользователю {user_id} для квеста '{quest_title}'")
+class ReminderEngine:
+    """Движок напоминаний: планировщик, снимок кандидатов и доставка"""
+
+    def __init__(
+        self,
+        bot,
+        database=None,
+        policies: Optional[List[ReminderPolicy]] = None,
+        digest: Optional[bool] = None,
+        clock=_utc_now,
+        sleep=asyncio.sleep,
+        shard: Tuple[int, int] = (0, 1),
+    ):
+        """
+        Args:
+            bot: Экземпляр aiogram Bot (нужен только send_message)
+            database: База данных (по умолчанию глобальная db)
+            policies: Политики напоминаний (по умолчанию из config.REMINDER_POLICIES)
+            digest: Режим дайджеста (по умолчанию config.REMINDER_DIGEST)
+            clock: Источник текущего времени UTC (для тестов и бенчмарков)
+            sleep: Функция ожидания (для тестов и бенчмарков)
+            shard: (номер, число шардов) — движок обрабатывает только user_id % число == номер
+        """
+        self.bot = bot
+        self.database = database or db
+        self.policies = policies if policies is not None else build_policies(config.REMINDER_POLICIES)
+        self.digest = config.REMINDER_DIGEST if digest is None else digest
+        self.clock = clock
+        self.sleep = sleep
+        self.shard_index, self.shard_count = shard
+        # У каждого шарда своя отметка последней обработанной минуты
+        self.job = shard_job_name(self.shard_index, self.shard_count)
+        self.max_catchup = MINUTE * max(1, min(config.REMINDER_MAX_CATCHUP_MINUTES, 24 * 60))
+        # Ключи уже отправленных напоминаний
+        self.sent: set = set()
+        # Неотправленные напоминания (ошибка отправки): повторяются в следующих окнах
+        self.retry: Dict[tuple, dict] = {}
+        self.last_minute: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    # ----- Планировщик -----
+    def start(self) -> asyncio.Task:
+        """Запуск фоновой задачи"""
+        self.task = asyncio.create_task(self.run())
+        logger.info(f"⏰ Движок напоминаний запущен ({self.job}): {', '.join(p.name for p in self.policies)}")
+        return self.task
+
+    async def stop(self) -> None:
+        """Остановка фоновой задачи"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+            self.task = None
+
+    async def load_mark(self) -> None:
+        """Загрузка последней обработанной минуты из БД"""
+        try:
+            self.last_minute = _parse_utc(await self.database.get_scheduler_mark(self.job))
         except Exception as e:
-            logging.error(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
+            logger.warning(f"Reminder mark load error: {e}")
+        if self.last_minute is None:
+            self.last_minute = _floor_minute(self.clock()) - MINUTE
+
+    async def tick(self) -> None:
+        """Один шаг планировщика: обработать все минуты после последней обработанной"""
+        if self.last_minute is None:
+            await self.load_mark()
+        tick_started = time.perf_counter()
+        now_utc = self.clock()
+        current_minute = _floor_minute(now_utc)
+        if current_minute <= self.last_minute:
+            return
+        # Отставание: насколько позже положенного обрабатывается самая старая минута
+        lag = (now_utc - (self.last_minute + MINUTE)).total_seconds()
+        REMINDER_LAG.set(max(0.0, lag))
+        window_start = max(self.last_minute, current_minute - self.max_catchup)
+        missed = int((current_minute - window_start) / MINUTE) - 1
+        if missed > 0:
+            REMINDER_CATCHUP.inc(missed)
+            logger.info(f"⏱ Напоминания: догоняем {missed} пропущенных минут")
+        await self.process_window(ReminderWindow(window_start, current_minute, now_utc))
+        self.last_minute = current_minute
+        await self.database.set_scheduler_mark(self.job, current_minute.strftime("%Y-%m-%d %H:%M:%S"))
+        duration = time.perf_counter() - tick_started
+        REMINDER_TICK_SECONDS.observe(duration)
+        if duration > 60:
+            logger.warning(f"⚠️ Цикл напоминаний занял {duration:.1f} с — следующие минуты будут обработаны догоняющим окном")
+
+    async def run(self) -> None:
+        """Фоновый цикл, выровненный по границам минут настенных часов"""
+        while True:
+            try:
+                await self.tick()
+                # Пауза до начала следующей минуты
+                now_utc = self.clock()
+                await self.sleep(60 - now_utc.second - now_utc.microsecond / 1_000_000 + 0.05)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"Reminder loop error: {e}")
+                await self.sleep(5)
+
+    # ----- Сбор -----
+    async def process_window(self, window: ReminderWindow) -> None:
+        """Собрать напоминания всех политик за окно и доставить их"""
+        horizon = window.now_utc + timedelta(days=2)
+        deadline_rows, daily_rows = await self.database.get_reminder_snapshot(
+            window.start, window.end, horizon, self.shard_index, self.shard_count
+        )
+        rows = {"deadline": deadline_rows, "daily": daily_rows}
+        # Напоминания окна, сгруппированные по чату: {chat_id: [item, ...]}
+        outbox: Dict[int, List[dict]] = {}
+        # Сначала — не доставленные раньше (не старше догоняющего окна)
+        oldest = window.now_utc - self.max_catchup
+        for key, item in list(self.retry.items()):
+            if key in self.sent or item["due"] < oldest:
+                del self.retry[key]
+                continue
+            outbox.setdefault(item["chat_id"], []).append(item)
+        for policy in self.policies:
+            try:
+                items = policy.collect(rows[policy.source], window)
+            except Exception as e:
+                logger.warning(f"Reminder policy '{policy.name}' error: {e}")
+                continue
+            for item in items:
+                if item["key"] in self.sent or item["key"] in self.retry:
+                    continue
+                outbox.setdefault(item["chat_id"], []).append(item)
+        await self.deliver(outbox)
+        self._prune(deadline_rows, window)
+
+    def _prune(self, deadline_rows: List[tuple], window: ReminderWindow) -> None:
+        """Забыть ключи завершённых квестов и прошедших дней, чтобы память не росла"""
+        active = {row[0] for row in deadline_rows}
+        oldest_day = (window.start - timedelta(days=2)).strftime("%Y-%m-%d")
+        self.sent = {
+            key for key in self.sent
+            if (len(key) == 2 and key[1] in active) or (len(key) == 4 and key[2] >= oldest_day)
+        }
+
+    # ----- Доставка -----
+    async def deliver(self, outbox: Dict[int, List[dict]]) -> None:
+        """Отправка напоминаний окна.
+
+        В режиме дайджеста напоминания одного чата объединяются в сообщения в пределах
+        лимитов Telegram (текст и кнопки), иначе каждое напоминание уходит отдельным сообщением.
+        Отметка о доставке ставится только после успешной отправки; неотправленные
+        напоминания остаются в self.retry до следующего окна.
+        """
+        for chat_id, items in outbox.items():
+            if not items:
+                continue
+            if self.digest and len(items) > 1:
+                for chunk in _digest_chunks(items):
+                    lines = [f"🔔 Напоминания ({len(chunk)}):", ""]
+                    lines += [item["line"] for item in chunk]
+                    try:
+                        await self.bot.send_message(chat_id, "\n".join(lines), reply_markup=_digest_keyboard(chunk))
+                    except Exception as e:
+                        logger.warning(f"Reminder digest send error (chat {chat_id}): {e}")
+                        self._keep(chunk)
+                        continue
+                    self._delivered(chunk)
+                continue
+            for item in items:
+                try:
+                    await self.bot.send_message(chat_id, item["text"], reply_markup=_quest_keyboard(item["quest_id"], item["open_text"]))
+                except Exception:
+                    self._keep([item])
+                    continue
+                self._delivered([item])
+
+    def _keep(self, items: List[dict]) -> None:
+        for item in items:
+            self.retry[item["key"]] = item
+
+    def _delivered(self, items: List[dict]) -> None:
+        REMINDER_SENT.inc()
+        sent_at = self.clock()
+        for item in items:
+            self.sent.add(item["key"])
+            self.retry.pop(item["key"], None)
+            REMINDER_LATENCY.observe(max(0.0, (sent_at - item["due"]).total_seconds()))
 
 
+# Совместимость со старым импортом
+ReminderSystem = ReminderEngine
@@ -0,0 +1,209 @@
+"""
+Защита внешнего API от перегрузки
+Ограничитель одновременных запросов с ограниченной очередью ожидания, автомат
+отключения (closed → open → half-open) по доле ошибок и медленных ответов
+и квота запросов на пользователя (token bucket)
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from metrics import metrics
+
+
+class Overloaded(Exception):
+    """Нет свободного слота: очередь ожидания заполнена или ожидание истекло"""
+
+
+class ConcurrencyLimiter:
+    """Не более max_inflight одновременных запросов и не более max_queue ожидающих"""
+
+    def __init__(self, name: str, max_inflight: int, max_queue: int, queue_timeout: float):
+        """
+        Args:
+            name: Префикс метрик (например, "ai")
+            max_inflight: Максимум одновременных запросов
+            max_queue: Максимум ожидающих свободного слота; остальные сразу получают Overloaded
+            queue_timeout: Сколько секунд ждать слот, прежде чем отказать
+        """
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+        self.waiting = 0
+        self.inflight_gauge = metrics.gauge(f"{name}_inflight_requests", "Выполняющиеся запросы")
+        self.waiting_gauge = metrics.gauge(f"{name}_queued_requests", "Запросы в очереди на свободный слот")
+        self.rejects = metrics.counter(f"{name}_overload_rejects_total", "Запросы, отклонённые из-за переполненной очереди")
+
+    async def __aenter__(self) -> "ConcurrencyLimiter":
+        if self.semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejects.inc()
+                raise Overloaded(f"очередь заполнена ({self.waiting})")
+            self.waiting += 1
+            self.waiting_gauge.set(self.waiting)
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejects.inc()
+                raise Overloaded(f"слот не освободился за {self.queue_timeout} с") from None
+            finally:
+                self.waiting -= 1
+                self.waiting_gauge.set(self.waiting)
+        else:
+            await self.semaphore.acquire()
+        self.inflight += 1
+        self.inflight_gauge.set(self.inflight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.inflight -= 1
+        self.inflight_gauge.set(self.inflight)
+        self.semaphore.release()
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения по последним window вызовам
+
+    closed: вызовы проходят; если среди последних вызовов (не меньше min_calls) доля
+        неудачных — ошибка или ответ дольше slow_call_seconds — достигла failure_rate,
+        автомат размыкается
+    open: вызовы сразу отклоняются open_seconds секунд
+    half_open: пропускается half_open_calls пробных вызовов; все удачные — автомат
+        замыкается, любой неудачный — снова размыкается
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.state = self.CLOSED
+        # Исходы последних вызовов: True — неудачный
+        self.outcomes: deque = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+        self.state_gauge = metrics.gauge(f"{name}_circuit_state", "Состояние автомата отключения: 0 closed, 1 half-open, 2 open")
+        self.opened = metrics.counter(f"{name}_circuit_opened_total", "Размыкания автомата отключения")
+        self.rejects = metrics.counter(f"{name}_circuit_rejects_total", "Вызовы, отклонённые разомкнутым автоматом")
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов; в half-open занимает слот пробного вызова"""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.open_seconds:
+                self.rejects.inc()
+                return False
+            self._set_state(self.HALF_OPEN)
+            self.probes = 0
+            self.probe_successes = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes >= self.half_open_calls:
+                self.rejects.inc()
+                return False
+            self.probes += 1
+        return True
+
+    def record(self, ok: bool, latency: float) -> None:
+        """Исход вызова, разрешённого allow()"""
+        failed = not ok or latency >= self.slow_call_seconds
+        if self.state == self.HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+            if failed:
+                self._open()
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= self.half_open_calls:
+                self.outcomes.clear()
+                self._set_state(self.CLOSED)
+            return
+        if self.state == self.OPEN:
+            # Ответ на вызов, начатый до размыкания
+            return
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+            self._open()
+
+    def release(self) -> None:
+        """Вызов не состоялся (отмена, нет слота): вернуть слот пробного вызова без исхода"""
+        if self.state == self.HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+
+    def retry_after(self) -> float:
+        """Сколько секунд автомат ещё будет разомкнут (0 — вызовы принимаются)"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (self.clock() - self.opened_at))
+
+    def _open(self) -> None:
+        self.opened_at = self.clock()
+        self.outcomes.clear()
+        self.opened.inc()
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self.state_gauge.set(self.STATE_VALUES[state])
+
+
+class UserQuota:
+    """Квота запросов на пользователя: burst запросов подряд, далее per_minute в минуту"""
+
+    def __init__(self, name: str, per_minute: float, burst: int, max_users: int = 10000, clock=time.monotonic):
+        """
+        Args:
+            name: Префикс метрик
+            per_minute: Скорость пополнения квоты, запросов в минуту
+            burst: Ёмкость ведра (запросов подряд без ожидания)
+            max_users: Сколько пользователей помнить (давно не обращавшиеся вытесняются)
+            clock: Источник времени (для тестов)
+        """
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        self.clock = clock
+        # user_id -> (токены, время последнего пополнения)
+        self.buckets: "OrderedDict[int, tuple]" = OrderedDict()
+        self.rejects = metrics.counter(f"{name}_quota_rejects_total", "Запросы, отклонённые по квоте пользователя")
+
+    def acquire(self, user_id: int) -> float:
+        """Списать один запрос; 0 — разрешено, иначе через сколько секунд появится квота"""
+        if self.burst <= 0 or self.rate <= 0:
+            return 0.0
+        now = self.clock()
+        tokens, updated = self.buckets.pop(user_id, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        retry_after: Optional[float] = None
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self.buckets[user_id] = (tokens, now)
+        while len(self.buckets) > self.max_users:
+            self.buckets.popitem(last=False)
+        if retry_after is None:
+            return 0.0
+        self.rejects.inc()
+        return retry_after
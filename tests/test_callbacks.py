@@ -0,0 +1,34 @@
+"""
+Кнопки старого формата в ранее отправленных сообщениях попадают в обработчик
+с тем числом аргументов, которое он принимает
+"""
+
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from callbacks import ACTIONS, unpack
+from handlers import callback_router
+
+
+class FakeCallback:
+    def __init__(self, data: str):
+        self.data = data
+        self.answers = []
+
+    async def answer(self, text=None, *args, **kwargs):
+        self.answers.append(text)
+
+
+def test_legacy_ids_dropped_for_actions_without_arguments():
+    assert unpack("noop_123") == (ACTIONS["noop"], ())
+    assert unpack("share_list_5") == (ACTIONS["share_list"], ())
+    assert unpack("del_item_3_4") == (ACTIONS["del_item"], (3, 4))
+
+
+def test_legacy_noop_tap_is_silent():
+    callback = FakeCallback("noop_123")
+    asyncio.run(callback_router.dispatch(callback))
+    assert callback.answers == [None]
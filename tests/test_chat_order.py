@@ -0,0 +1,71 @@
+"""
+Порядок обработки внутри чата: следующее обновление видит состояние FSM,
+установленное предыдущим (ChatSerializer стоит до чтения состояния)
+"""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ["FSM_STORAGE"] = "memory"
+
+from aiogram import Bot, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Chat, Message, Update, User
+
+from database_async import db
+from main import create_dispatcher
+
+
+class Dialog(StatesGroup):
+    a = State()
+    b = State()
+
+
+def make_update(update_id: int, text: str) -> Update:
+    user = User(id=42, is_bot=False, first_name="Test")
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=42, type="private"),
+        from_user=user,
+        text=text,
+    )
+    return Update(update_id=update_id, message=message)
+
+
+def test_second_update_sees_state_set_by_first():
+    seen = []
+    router = Router()
+
+    @router.message(Dialog.a, F.text.in_({"first", "second"}))
+    async def in_a(message: Message, state: FSMContext):
+        seen.append(("a", message.text))
+        # Пауза до смены состояния: без упорядочивания второе сообщение успело бы прочитать Dialog.a
+        await asyncio.sleep(0.05)
+        await state.set_state(Dialog.b)
+
+    @router.message(Dialog.b, F.text.in_({"first", "second"}))
+    async def in_b(message: Message, state: FSMContext):
+        seen.append(("b", message.text))
+
+    async def scenario():
+        await db.init_db()
+        dp = create_dispatcher()
+        dp.include_router(router)
+        bot = Bot(token="42:TEST")
+        try:
+            await dp.fsm.get_context(bot, chat_id=42, user_id=42).set_state(Dialog.a)
+            await asyncio.gather(
+                dp.feed_update(bot, make_update(1, "first")),
+                dp.feed_update(bot, make_update(2, "second")),
+            )
+        finally:
+            await bot.session.close()
+            await db.close()
+
+    asyncio.run(scenario())
+    assert seen == [("a", "first"), ("b", "second")]
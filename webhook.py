@@ -0,0 +1,114 @@
+"""
+Режим webhook: обновления принимает встроенный HTTP-сервер aiohttp
+Telegram присылает каждое обновление POST-запросом на WEBHOOK_PATH; запрос с неверным
+секретом (заголовок X-Telegram-Bot-Api-Secret-Token) отклоняется с 401. Ответ отдаётся
+сразу, обработка идёт в фоне через ту же цепочку middleware, что и при long polling.
+При остановке сервер перестаёт принимать запросы и ждёт обработки уже принятых
+обновлений (не дольше WEBHOOK_DRAIN_SECONDS), затем останавливает диспетчер
+"""
+
+import asyncio
+import signal
+from typing import Any, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from loguru import logger
+
+from config import config
+from metrics import metrics
+
+WEBHOOK_REJECTED = metrics.counter("webhook_rejected_total", "Запросы webhook с неверным секретом")
+WEBHOOK_DRAIN_TIMEOUTS = metrics.counter("webhook_drain_timeouts_total", "Остановки, не дождавшиеся обработки принятых обновлений")
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """Приём обновлений с фоновой обработкой и ожиданием принятых обновлений при остановке"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None, drain_timeout: Optional[float] = None, **data: Any):
+        """
+        Args:
+            dispatcher: Диспетчер
+            bot: Бот
+            secret_token: Ожидаемый X-Telegram-Bot-Api-Secret-Token (пусто — без проверки)
+            drain_timeout: Ожидание обработки принятых обновлений при остановке, с (по умолчанию config.WEBHOOK_DRAIN_SECONDS)
+            **data: Данные для обработчиков (как kwargs start_polling)
+        """
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token or None, **data)
+        self.drain_timeout = config.WEBHOOK_DRAIN_SECONDS if drain_timeout is None else drain_timeout
+
+    def verify_secret(self, telegram_secret_token: str, bot: Bot) -> bool:
+        if super().verify_secret(telegram_secret_token, bot):
+            return True
+        WEBHOOK_REJECTED.inc()
+        return False
+
+    async def close(self) -> None:
+        """Дождаться обработки принятых обновлений; сессию бота закрывает main"""
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info(f"⏳ Webhook: ждём обработки обновлений: {len(tasks)}")
+        _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        if pending:
+            WEBHOOK_DRAIN_TIMEOUTS.inc()
+            logger.warning(f"⚠️ Webhook: не дождались обработки обновлений: {len(pending)}")
+            for task in pending:
+                task.cancel()
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot: Bot, path: Optional[str] = None, secret_token: Optional[str] = None, **data: Any) -> web.Application:
+    """
+    Приложение aiohttp с обработчиком webhook и запуском/остановкой диспетчера
+
+    Args:
+        path: Путь webhook (по умолчанию config.WEBHOOK_PATH)
+        secret_token: Секрет (по умолчанию config.WEBHOOK_SECRET)
+        **data: Данные для обработчиков и dp.startup
+    """
+    app = web.Application()
+    handler = WebhookHandler(dispatcher, bot, config.WEBHOOK_SECRET if secret_token is None else secret_token, transport="webhook", **data)
+    # Обработчик регистрируется первым: при остановке сначала дожидаемся принятых обновлений, потом dp.shutdown
+    handler.register(app, path=path or config.WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot, **data)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, allowed_updates: Optional[List[str]] = None, **data: Any) -> None:
+    """
+    Запустить сервер webhook на WEBHOOK_HOST:WEBHOOK_PORT и работать до SIGINT/SIGTERM
+
+    Args:
+        allowed_updates: Типы обновлений для setWebhook (по умолчанию — используемые обработчиками диспетчера)
+    """
+    app = create_webhook_app(dispatcher, bot, **data)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+        logger.info(f"🌐 Webhook: {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+        if config.WEBHOOK_URL:
+            await bot.set_webhook(
+                config.WEBHOOK_URL + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET or None,
+                allowed_updates=dispatcher.resolve_used_update_types() if allowed_updates is None else allowed_updates,
+                max_connections=min(100, max(1, config.UPDATE_WORKERS)),
+            )
+            logger.info(f"🔗 setWebhook: {config.WEBHOOK_URL}{config.WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+        # Закрывает сокет, ждёт принятые обновления, затем dp.shutdown
+        await runner.cleanup()
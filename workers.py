@@ -0,0 +1,260 @@
+"""
+Многопроцессный режим: приёмник обновлений и N рабочих процессов
+Приёмник получает обновления (long polling или webhook) и передаёт каждое рабочему
+процессу по user_id % N через локальный TCP-сокет (строка JSON на обновление).
+Обновления одного пользователя всегда попадают в один процесс по одному соединению,
+поэтому их порядок сохраняется; в процессе их упорядочивает ChatSerializer. Рабочий
+процесс — обычный бот (create_dispatcher с handlers.router, своя сессия Bot API и свой
+пул соединений с базой), фоновые задачи распределяются арендами, как между экземплярами.
+Упавший рабочий процесс перезапускается; обновления для него ждут в очереди приёмника
+"""
+
+import asyncio
+import multiprocessing
+import os
+import secrets
+import signal
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject, Update, User
+from loguru import logger
+
+from config import config
+from database_async import db
+from metrics import metrics
+
+WORKER_FORWARDED = metrics.counter("worker_updates_forwarded_total", "Обновления, переданные рабочим процессам")
+WORKER_BACKLOG = metrics.gauge("worker_backlog", "Обновления в очереди приёмника (рабочий процесс не подключён)")
+WORKER_DROPPED = metrics.counter("worker_updates_dropped_total", "Обновления, отброшенные при переполнении очереди приёмника")
+WORKER_RESTARTS = metrics.counter("worker_restarts_total", "Перезапуски рабочих процессов")
+
+# Обновлений в очереди одного рабочего процесса, пока он не подключён (сверх — отбрасываются старые)
+BACKLOG_LIMIT = 10000
+# Проверка рабочих процессов, с
+SUPERVISE_INTERVAL = 1.0
+
+
+def worker_log_file(path: str, index: int) -> str:
+    """Свой файл лога рабочего процесса: bot.log → bot.worker0.log (ротация файла — только в одном процессе)"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{index}{ext}"
+
+
+def shard_of(update: Update, user: Optional[User], workers: int) -> int:
+    """Номер рабочего процесса: по user_id, без пользователя — по update_id"""
+    return (user.id if user is not None else update.update_id) % workers
+
+
+class _Worker:
+    """Рабочий процесс со стороны приёмника: процесс, соединение и очередь до подключения"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.backlog: Deque[bytes] = deque(maxlen=BACKLOG_LIMIT)
+        self.connected = asyncio.Event()
+
+
+class WorkerPool:
+    """Рабочие процессы и передача им обновлений"""
+
+    def __init__(self, count: int, transport: str):
+        """
+        Args:
+            count: Число рабочих процессов
+            transport: polling или webhook (метка метрик задержки в рабочих процессах)
+        """
+        self.count = count
+        self.transport = transport
+        self.token = secrets.token_hex(16)
+        self.workers = [_Worker(i) for i in range(count)]
+        self.context = multiprocessing.get_context("spawn")
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+        self.supervisor: Optional[asyncio.Task] = None
+        self.stopping = False
+
+    async def start(self) -> None:
+        """Открыть сокет для рабочих процессов и запустить их"""
+        self.server = await asyncio.start_server(self._accept, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        for worker in self.workers:
+            self._spawn(worker)
+        self.supervisor = asyncio.create_task(self._supervise())
+        logger.info(f"🧵 Рабочих процессов: {self.count}")
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """Дождаться подключения всех рабочих процессов"""
+        await asyncio.wait_for(asyncio.gather(*(w.connected.wait() for w in self.workers)), timeout)
+
+    def send(self, update: Update, user: Optional[User]) -> None:
+        """Передать обновление рабочему процессу (порядок вызовов сохраняется)"""
+        worker = self.workers[shard_of(update, user, self.count)]
+        line = update.model_dump_json(exclude_unset=True).encode() + b"\n"
+        WORKER_FORWARDED.inc()
+        if worker.writer is not None and not worker.writer.is_closing():
+            worker.writer.write(line)
+            return
+        if len(worker.backlog) == worker.backlog.maxlen:
+            WORKER_DROPPED.inc()
+        worker.backlog.append(line)
+        self._count_backlog()
+
+    async def drain(self, index: int) -> None:
+        writer = self.workers[index].writer
+        if writer is not None:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Закрыть соединения (рабочие процессы доделывают принятые обновления и завершаются)"""
+        self.stopping = True
+        if self.supervisor:
+            self.supervisor.cancel()
+        for worker in self.workers:
+            if worker.writer is not None:
+                worker.writer.close()
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is not None:
+                await loop.run_in_executor(None, worker.process.join, timeout)
+                if worker.process.is_alive():
+                    logger.warning(f"⚠️ Рабочий процесс {worker.index} не завершился за {timeout} с")
+                    worker.process.terminate()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _spawn(self, worker: _Worker) -> None:
+        worker.process = self.context.Process(
+            target=worker_process, args=(worker.index, self.count, self.port, self.token, self.transport), name=f"worker-{worker.index}",
+        )
+        worker.process.start()
+
+    async def _supervise(self) -> None:
+        while not self.stopping:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for worker in self.workers:
+                if worker.process is not None and not worker.process.is_alive() and not self.stopping:
+                    logger.error(f"❌ Рабочий процесс {worker.index} завершился (код {worker.process.exitcode}), перезапуск")
+                    WORKER_RESTARTS.inc()
+                    if worker.writer is not None:
+                        worker.writer.close()
+                        worker.writer = None
+                    self._spawn(worker)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Рабочий процесс подключается и представляется строкой «токен номер»"""
+        try:
+            token, index = (await asyncio.wait_for(reader.readline(), 30)).decode().split()
+            index = int(index)
+        except (asyncio.TimeoutError, ValueError, UnicodeDecodeError):
+            writer.close()
+            return
+        if not secrets.compare_digest(token, self.token) or not 0 <= index < self.count:
+            writer.close()
+            return
+        worker = self.workers[index]
+        worker.writer = writer
+        worker.connected.set()
+        while worker.backlog:
+            writer.write(worker.backlog.popleft())
+        self._count_backlog()
+        await writer.drain()
+        # Рабочий процесс ничего не присылает; EOF — соединение закрыто
+        await reader.read()
+        if worker.writer is writer:
+            worker.writer = None
+            worker.connected.clear()
+
+    def _count_backlog(self) -> None:
+        WORKER_BACKLOG.set(sum(len(w.backlog) for w in self.workers))
+
+
+class ForwardToWorkers(BaseMiddleware):
+    """Внешний middleware dp.update приёмника: обновление уходит рабочему процессу, обработчики не вызываются"""
+
+    def __init__(self, pool: WorkerPool):
+        self.pool = pool
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        self.pool.send(event, user)
+        await self.pool.drain(shard_of(event, user, self.pool.count))
+        return None
+
+
+async def run_front(bot: Bot, workers: int) -> None:
+    """Приёмник: база, рабочие процессы и получение обновлений в режиме config.BOT_MODE"""
+    from handlers import router
+    from webhook import run_webhook
+
+    await db.init_db()
+    await db.close()
+    allowed_updates = router.resolve_used_update_types()
+    pool = WorkerPool(workers, config.BOT_MODE)
+    dp = Dispatcher()
+    dp.update.outer_middleware(ForwardToWorkers(pool))
+    await pool.start()
+    try:
+        if config.BOT_MODE == "webhook":
+            await run_webhook(dp, bot, allowed_updates=allowed_updates)
+        else:
+            await bot.delete_webhook()
+            # Обновления передаются по очереди: порядок внутри пользователя сохраняется
+            await dp.start_polling(bot, allowed_updates=allowed_updates, handle_as_tasks=False, close_bot_session=False)
+    finally:
+        await pool.stop()
+
+
+def worker_process(index: int, count: int, port: int, token: str, transport: str) -> None:
+    """Точка входа рабочего процесса (multiprocessing, spawn)"""
+    from logging_setup import setup_logging
+
+    # Ctrl+C получает вся группа процессов: рабочий процесс останавливает приёмник, закрывая соединение
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    config.LOG_FILE = worker_log_file(config.LOG_FILE, index)
+    setup_logging()
+    # Эндпоинт метрик у каждого процесса свой: METRICS_PORT + 1 + номер
+    if config.METRICS_PORT:
+        config.METRICS_PORT += 1 + index
+    asyncio.run(_worker_main(index, count, port, token, transport))
+
+
+async def _worker_main(index: int, count: int, port: int, token: str, transport: str) -> None:
+    from main import create_bot, create_dispatcher, on_shutdown, on_startup
+
+    bot = create_bot()
+    dp = create_dispatcher(shard=(index, count))
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=2 ** 22)
+    writer.write(f"{token} {index}\n".encode())
+    await writer.drain()
+    logger.info(f"🧵 Рабочий процесс {index + 1}/{count} подключён")
+    tasks: set = set()
+    try:
+        while line := await reader.readline():
+            update = Update.model_validate_json(line, context={"bot": bot})
+            # Как handle_as_tasks при polling: порядок задач = порядок обновлений, дальше — ChatSerializer
+            task = asyncio.create_task(dp.feed_update(bot, update, transport=transport))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        writer.close()
+        if tasks:
+            await asyncio.wait(tasks, timeout=config.WEBHOOK_DRAIN_SECONDS)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        try:
+            await dp.storage.close()
+        except Exception:
+            pass
+        await db.close()
+        await bot.session.close()
+        await logger.complete()